@@ -1,12 +1,35 @@
 import pandas as pd
 import os
 import argparse
+import json
 import pdb
-import math
 import sys
 import subprocess
 import re
 from pathlib import Path
+from data_io import FORMATS, write_frame, read_frame, compact_frame
+from dedupe_engine import (dedupe_df, dedupe_sharded, dedupe_incremental,
+                           variable_definition)
+from registry_sql import (lookup_registry, fuzzy_lookup_registry,
+                          registry_names)
+from fuzzy_index import FuzzyIndex
+from normalise import add_org_key
+from metrics import RunMetrics
+from incremental import split_delta
+from settings_registry import open_registry
+from results_store import ResultsStore
+
+# Columns of the rows returned by sqlfile.sql_query
+RESULT_COLUMNS = ['org_string', 'obtained_address', 'obtd_id',
+                  'obtd_legal_name', 'obtd_tax_id']
+
+# Registry columns often repeated across rows, stored as categoricals when
+# they repeat enough (see data_io.compact_frame)
+REGISTRY_COLUMNS = ['obtained_address', 'obtd_id', 'obtd_legal_name',
+                    'obtd_tax_id']
+
+# Stage timings of this run
+run_metrics = RunMetrics()
 
 
 def get_input_args():
@@ -17,25 +40,103 @@ def get_input_args():
     """
 
     parser = argparse.ArgumentParser(description="Input data file name/loc")
+    parser.add_argument('--config', default='', type=str,
+                        help="JSON file of argument values, keyed by "
+                             "argument name (command line flags override it)")
     parser.add_argument('--dir', default='Data_Projects/ITA_data/', type=str,
                         help="set the data directory")
     parser.add_argument('--datafile', default='italian_suppliers_abc.csv',
                         type=str, help="set the data file")
+    parser.add_argument('--batch', action='store_true',
+                        help="run without prompts (--min_length defaults "
+                             "to 3)")
+    parser.add_argument('--min_length', default=None, type=int,
+                        help="string-length Y for confidence_processing")
+    parser.add_argument('--usecols', default='', type=str,
+                        help="comma separated data file columns to load "
+                             "(default: all); org_string and address are "
+                             "always included")
+    parser.add_argument('--registry_table', default='', type=str,
+                        help="registry table to match org_strings against "
+                             "inside SQLite (default: use sqlfile.sql_query)")
+    parser.add_argument('--registry_name_col', default='name', type=str,
+                        help="organisation name column of --registry_table")
+    parser.add_argument('--registry_cols',
+                        default='address,id,legal_name,tax_id', type=str,
+                        help="comma separated registry columns holding the "
+                             "address, id, legal name and tax id")
+    parser.add_argument('--fuzzy_index', default='', type=str,
+                        help="fuzzy index of --registry_table names (built "
+                             "on first use) for org_strings with no exact "
+                             "match")
+    parser.add_argument('--fuzzy_min_score', default=0.9, type=float,
+                        help="lowest similarity accepted as a fuzzy match")
+    parser.add_argument('--dedupe', default='native',
+                        choices=['native', 'csvdedupe'],
+                        help="run dedupe in-process (native) or through "
+                             "the csvdedupe command line tool")
+    parser.add_argument('--dedupe_shards', default=0, type=int,
+                        help="cluster in this many blocked shards across "
+                             "processes (0 clusters all records at once)")
+    parser.add_argument('--dedupe_workers', default=None, type=int,
+                        help="processes for sharded dedupe (default: cores)")
+    parser.add_argument('--settings_registry',
+                        default='Data_Projects/settings_registry/', type=str,
+                        help="folder of learned settings shared between "
+                             "projects comparing the same fields ('' to "
+                             "disable)")
+    parser.add_argument('--intermediate_format', default='parquet',
+                        choices=list(FORMATS),
+                        help="format of files passed between stages")
+    parser.add_argument('--incremental', default='', type=str,
+                        help="'_idexpanded' output of an earlier run, in "
+                             "--dir: only new or changed rows are looked up "
+                             "and linked to its clusters")
+    parser.add_argument('--results_db', default='', type=str,
+                        help="indexed SQLite store of the final results "
+                             "(default: <datafile>_results.db in --dir)")
+    parser.add_argument('--metrics_report', default='', type=str,
+                        help="JSON run report of stage timings (default: "
+                             "<datafile>_run_report.json in --dir)")
+    parser.add_argument('--prometheus_textfile', default='', type=str,
+                        help="also write the run metrics to this .prom file "
+                             "for the node_exporter textfile collector")
+    args, _ = parser.parse_known_args()
+    if args.config:
+        with open(args.config) as f:
+            config_values = json.load(f)
+        # argparse does not check defaults, so the file's values are
+        # checked here as if they had been given on the command line
+        actions = {action.dest: action for action in parser._actions}
+        for arg, value in config_values.items():
+            if arg not in actions:
+                parser.error("unknown argument '{}' in {}"
+                             .format(arg, args.config))
+            choices = actions[arg].choices
+            if choices is not None and value not in choices:
+                parser.error("invalid choice {!r} for '{}' in {} (choose "
+                             "from {})".format(value, arg, args.config,
+                                               ', '.join(map(str, choices))))
+        parser.set_defaults(**config_values)
     args = parser.parse_args()
+    if args.batch and args.min_length is None:
+        args.min_length = 3
     return args
 
 
-def load_df(data_dir, data_file):
+def load_df(data_dir, data_file, usecols=None):
     """
     Load data file
 
     :param data_dir: the directory containing the datafile
         (default: current location)
     :param data_file: the csv file containing organisation information
+    :param usecols: columns to load (default: all of them)
     :return df: pandas dataframe
     :return df_name: name of df
     """
-    df = pd.read_csv(str(data_dir + data_file))
+    with run_metrics.stage('load_df'):
+        df = pd.read_csv(str(data_dir + data_file), usecols=usecols)
     df_name = str(data_file)[:-4]
     return df, df_name
 
@@ -55,15 +156,69 @@ def deduplicate(infile, string, output_file):
     data_fp = str(homedir) + "/" + str(in_arg.dir)
     training_fp = data_fp + "training.json"
     settings_fp = data_fp + "learned_settings"
+    variables = variable_definition([str(string), 'address', 'obtd_id',
+                                     'obtained_address', 'obtd_legal_name'])
+    registry = open_registry(in_arg.settings_registry)
+    if registry is not None:
+        registry.checkout(variables, settings_fp, training_fp, 'csvdedupe')
+    if in_arg.batch and not os.path.exists(settings_fp):
+        # csvdedupe would stop to ask for labelled pairs
+        sys.exit("--batch --dedupe csvdedupe needs learned settings in "
+                 "{} or the settings registry; run once without --batch "
+                 "or use --dedupe native".format(data_fp))
     cmd = ['python csvdedupe.py ' + infile + ' --field_names ' + str(string) +
            ' address obtd_id obtained_address obtd_legal_name --output_file ' +
            str(output_file) + ' --training_file ' + str(training_fp) +
            ' --settings_file ' + str(settings_fp)]
     p = subprocess.Popen(cmd, cwd='./csvdedupe/csvdedupe', shell=True)
     p.wait()
+    if registry is not None:
+        registry.publish(variables, settings_fp, training_fp, 'csvdedupe',
+                         source=data_fp)
 
 
-def confidence_processing(data_dir, df_name, string_col):
+def deduplicate_native(df, string, incremental=False):
+    """
+    Clusters possible duplicates together with the dedupe library directly
+    on the in-memory dataframe, adding the cluster id and confidence score
+    columns. Reuses the training.json and learned_settings in the data
+    directory when present. With --dedupe_shards the records are blocked
+    on org_key prefix and obtd_id and clustered in parallel processes.
+
+    :param df: the merged dataframe
+    :param string: the user-defined org_string column name (default org_string)
+    :param incremental: keep the clusters of rows that already have one
+        and only link the others to them (see
+        dedupe_engine.dedupe_incremental)
+    :return df: pandas dataframe
+    """
+    homedir = Path(__file__).resolve().parents[0]
+    data_fp = str(homedir) + "/" + str(in_arg.dir)
+    fields = [str(string), 'address', 'obtd_id', 'obtained_address',
+              'obtd_legal_name']
+    registry = open_registry(in_arg.settings_registry)
+    if incremental:
+        return dedupe_incremental(df, fields, data_fp + "learned_settings",
+                                  data_fp + "gazetteer_settings",
+                                  data_fp + "training.json",
+                                  interactive=not in_arg.batch,
+                                  registry=registry)
+    if in_arg.dedupe_shards:
+        return dedupe_sharded(df, fields, [('org_key', 4), ('obtd_id', None)],
+                              data_fp + "learned_settings",
+                              data_fp + "training.json",
+                              n_shards=in_arg.dedupe_shards,
+                              max_workers=in_arg.dedupe_workers,
+                              interactive=not in_arg.batch,
+                              registry=registry)
+    return dedupe_df(df, fields,
+                     training_file=data_fp + "training.json",
+                     settings_file=data_fp + "learned_settings",
+                     interactive=not in_arg.batch, registry=registry)
+
+
+def confidence_processing(data_dir, df_name, string_col, min_length=None,
+                          results_db=None):
     '''
     Split deduped dataframe twice. One is for deduped rows >70% confidence
     score AND no. of letters > Y. This is because a deviation for a string of
@@ -73,15 +228,22 @@ def confidence_processing(data_dir, df_name, string_col):
     :param data_dir: filepath to folder containing deduped data
     :param df_name: name of dataframe
     :string_col: user-defined name for the column containing the org_strings
+    :param min_length: string-length Y (default: ask the user)
+    :param results_db: also write every row, flagged 'accepted' or not,
+        to this results_store.ResultsStore file
 
     :return df_70Y_accept_name: name of df with >70% & > Y length strings
     :return df_70Y_unaccept_name: name of df with <70% or
     (>70% AND Y length strings)
     '''
 
-    df = pd.read_csv(str(data_dir + df_name))
+    df = read_frame(str(data_dir + df_name))
+    # Outputs are named after the input, without its extension
+    df_name = os.path.splitext(df_name)[0]
 
-    Y = int(input("\nFor confidence scores >70%, select str length above which \
+    Y = min_length
+    if Y is None:
+        Y = int(input("\nFor confidence scores >70%, select str length above which \
         no further investigation is necessary (def=3):") or 3)
 
     df_70Y_accept = df[(df['Confidence Score'] >= 0.7) &
@@ -100,108 +262,112 @@ def confidence_processing(data_dir, df_name, string_col):
     df_70Y_unaccept_name = save_data(data_dir, df_70Y_unaccept, df_name,
                                      '_unaccept')
 
+    if results_db:
+        with ResultsStore(results_db) as store:
+            store.write(df, string_col, 'obtd_id',
+                        accepted=df.index.isin(df_70Y_accept.index))
+
     return df_70Y_accept_name, df_70Y_unaccept_name
 
 
-def save_data(data_dir, df, df_name, suffix=None):
+def save_data(data_dir, df, df_name, suffix=None, fmt='csv'):
     """
     Save adjusted dataframe to 'filename + _classified.csv'
     :param data_dir: filepath to folder containing deduped data
     :param df
     :param name : name of dataframe
     :param suffix: ending of filename (i.e. _classified, _deduped etc)
+    :param fmt: file format, one of data_io.FORMATS (default csv).
+        Use csv for anything read by people or by csvdedupe.
 
     :return df_name
     """
-    orig_file_name = data_dir + df_name
     if suffix:
-        print("\nSaving output to : " + str(orig_file_name + suffix) + '.csv')
-        df.to_csv(orig_file_name + suffix + '.csv')
-        df_name += suffix + '.csv'
-    else:
-        print("\nSaving output to : " + str(data_dir + df_name) + '.csv')
-        df.to_csv(orig_file_name + '.csv')
-        df_name += '.csv'
+        df_name += suffix
+    with run_metrics.stage('save_data', len(df)):
+        out_path = write_frame(df, data_dir + df_name, fmt)
+    print("\nSaving output to : " + out_path)
+    df_name += FORMATS[fmt]
     return df_name
 
 
 def add_info(results, df):
     '''
     Maps the returned results from the SQL to the relevant columns in the
-    dataframe.
-
-    :param results: the results list returned from sql_query()
+    dataframe with a single keyed merge on the canonical org_key, so
+    spelling variants of a name share its result. Rows with no SQL
+    result are left blank. Registry values shared by many rows are
+    stored as categoricals.
+
+    :param results: the results returned from sql_query(), either rows of
+        (org_string, address, id, legal_name, tax_id) or a dataframe with
+        RESULT_COLUMNS
     :param/return df: the dataframe
     '''
-    org_dict = {}
-
-    for word in results:
-        org_dict[word[0]] = word[1:]
-        org_dict.update(org_dict)
-
-    df['results'] = df['org_string'].map(org_dict)
-
-    for line in range(len(df['results'])):
-        if pd.isnull(df['results'][line]):
-            df['results'][line] = (math.nan, math.nan, math.nan)
-
-    df[['obtained_address', 'obtd_id', 'obtd_legal_name', 'obtd_tax_id']] \
-        = pd.DataFrame(df['results'].values.tolist())
-
-    # Copy the obtained id column as will be making adjustments
-    # in assign_org_ids_to_clusters
-    df['obtained_id_orig'] = df['obtd_id']
-
-    return df
-
-
-def assign_org_ids_to_clusters(df, df_name):
+    if not isinstance(results, pd.DataFrame):
+        results = pd.DataFrame.from_records(list(results),
+                                            columns=RESULT_COLUMNS)
+    results = add_org_key(results.reset_index(drop=True))
+    # One result per key. The SQL rows come in no fixed order, so the row
+    # kept is the one with the most registry fields filled in, ties going
+    # to the lowest values of those fields (compared as text).
+    order = results[REGISTRY_COLUMNS].fillna('').astype(str)
+    order['filled'] = -results[REGISTRY_COLUMNS].notnull().sum(axis=1)
+    order = order.sort_values(['filled'] + REGISTRY_COLUMNS,
+                              kind='mergesort')
+    results = results.loc[order.index].drop_duplicates(subset='org_key')
+
+    df = add_org_key(df)
+    # Keep the row labels, which an incremental run joins on
+    df = df.merge(results.drop(columns='org_string'), on='org_key',
+                  how='left').set_index(df.index)
+
+    return compact_frame(df, REGISTRY_COLUMNS)
+
+
+def assign_org_ids_to_clusters(df, df_name, threshold=0.7):
     '''
     For members of a cluster with a confidence score greater than 70%,
     they will be assigned the obtained id number of the highest-confidence
-    row in that cluster.
+    row in that cluster which has an obtained id. Where several rows share
+    the highest score, the first of them in df is used.
+
+    Done with a single groupby over the rows rather than a loop per
+    cluster, so runtime is linear in the number of rows.
+
+    :param df: the deduped dataframe
+    :param df_name: name of dataframe
+    :param threshold: minimum confidence score for a row to take on the
+        cluster's id
+    :return df: dataframe with obtd_id filled in across clusters
+    :return df_name: name of the saved '_idexpanded' file
     '''
-    st = set(df['Cluster ID'])
-    for idx in st:
-        # filter df by the cluster id
-        dfidx = df[df['Cluster ID'] == idx]
-        # once the filter is applied filter again for non-blank obtd_id
-        try:
-            dfidx = pd.notnull(df)
-            # then choose the one with the highest confidence
-            max_conf_idx = dfidx['Confidence Score'].idxmax()
-            # apply that obtd_id to the cluster members with a confidence > 70%
-            for row in range(len(df)):
-                try:
-                    if df['Cluster ID'][row] == idx:
-                        # If confidence is above 70%:
-                        if df['Confidence Score'][row] >= 0.7:
-                            # Update location row:obtd_id with the
-                            # id pertaining to the highest
-                            # confidence score in the cluster.
-                            df.at[row, 'obtd_id'] = int(df['obtd_id']
-                                                        [max_conf_idx])
-                except ValueError:
-                    continue
-        except ValueError:
-            continue
-
-        # Sort rows by cluster
-        df = df.sort_values(by=['Cluster ID'])
-
-        # Round confidence scores to 2dp. Can't format as % this converts to
-        # str, and need to compare to the threshold in confidence_processing()
-        df['Confidence Score'] = df['Confidence Score']\
-            .map(lambda x: round(x, 2))
-        # Save df
-        df_name = save_data(in_arg.dir, df, df_name, '_idexpanded')
-        return df, df_name
+    # Rows able to supply an id: non-blank obtd_id and a confidence score
+    candidates = df[df['obtd_id'].notnull() &
+                    df['Confidence Score'].notnull()]
+    # Row label of the highest-confidence candidate in each cluster
+    best_rows = candidates.groupby('Cluster ID')['Confidence Score'].idxmax()
+    cluster_ids = pd.Series(df.loc[best_rows, 'obtd_id'].values,
+                            index=best_rows.index)
+
+    # Broadcast each cluster's id to its members above the threshold
+    cluster_id = df['Cluster ID'].map(cluster_ids)
+    expand = (df['Confidence Score'] >= threshold) & cluster_id.notnull()
+    df.loc[expand, 'obtd_id'] = cluster_id[expand]
+
+    # Sort rows by cluster
+    df = df.sort_values(by=['Cluster ID'])
+
+    # Round confidence scores to 2dp. Can't format as % this converts to
+    # str, and need to compare to the threshold in confidence_processing()
+    df['Confidence Score'] = df['Confidence Score'].round(2)
+    # Save df
+    df_name = save_data(in_arg.dir, df, df_name, '_idexpanded',
+                        in_arg.intermediate_format)
+    return df, df_name
 
 
 def file_tidy(df, joined_file=None):
-    # results column not needed
-    df = df.drop('results', axis=1)
-
     # remove ('unnamed: 2') id column as duplicated. flags uses regex
     # package to ignore case formatting.
     df = df.drop(df.columns[df.columns.str.contains('unnamed',
@@ -217,6 +383,32 @@ def file_tidy(df, joined_file=None):
     return df
 
 
+def fuzzy_results(con, df, results):
+    '''
+    Fuzzy-match the org_strings which found no exact registry result,
+    building the registry's FuzzyIndex at in_arg.fuzzy_index first if it
+    does not exist yet.
+
+    :param con: connection to the registry database
+    :param df: the dataframe
+    :param results: the exact results from lookup_registry
+    :return: dataframe of fuzzy results, in the same form as results
+    '''
+    if os.path.exists(in_arg.fuzzy_index):
+        index = FuzzyIndex.load(in_arg.fuzzy_index)
+    else:
+        print("Building fuzzy index of registry names...")
+        index = FuzzyIndex(registry_names(con, in_arg.registry_table,
+                                          in_arg.registry_name_col))
+        index.save(in_arg.fuzzy_index)
+    unmatched = set(df['org_string'].dropna()) - set(results['org_string'])
+    return fuzzy_lookup_registry(con, unmatched, index,
+                                 in_arg.registry_table,
+                                 in_arg.registry_name_col,
+                                 in_arg.registry_cols.split(','),
+                                 RESULT_COLUMNS[1:], in_arg.fuzzy_min_score)
+
+
 def main():
     pd.options.mode.chained_assignment = None  # default='warn'
     # Set the PYTHONPATH variable to include the directory in which
@@ -227,33 +419,85 @@ def main():
     # Import the SQLquery module from the relevant Data_Projects folder
     sqlfile = __import__('sqlfile')
 
-    df, df_name = load_df(in_arg.dir, in_arg.datafile)
+    usecols = None
+    if in_arg.usecols:
+        usecols = list(dict.fromkeys(['org_string', 'address'] +
+                                     in_arg.usecols.split(',')))
+    df, df_name = load_df(in_arg.dir, in_arg.datafile, usecols)
+    run_name = df_name
+
+    unchanged = None
+    if in_arg.incremental:
+        # Rows unchanged since the earlier run keep its results
+        previous = read_frame(in_arg.dir + in_arg.incremental)
+        unchanged, df = split_delta(df, previous, list(df.columns))
 
     DEFAULT_PATH = os.path.join(os.path.dirname(__file__), in_arg.dir +
                                 'ITA_db.db')
 
     con = sqlfile.connect_SQL(DEFAULT_PATH)
 
-    results = sqlfile.sql_query(con)
-
-    df = add_info(results, df)
-
-    joined_file = save_data(in_arg.dir, df, df_name, '_merged')
-
-    deduplicate('../../' + in_arg.dir + joined_file, 'org_string',
-                '../../' + in_arg.dir + df_name + '_ddup.csv')
-
-    df, df_name = load_df(in_arg.dir, in_arg.datafile[:-4] + '_ddup.csv')
+    with run_metrics.stage('registry_lookup', len(df)):
+        if in_arg.registry_table:
+            # Push the matching down into SQLite rather than fetching the
+            # whole result set of sql_query
+            results = lookup_registry(con, df['org_string'].dropna().unique(),
+                                      in_arg.registry_table,
+                                      in_arg.registry_name_col,
+                                      in_arg.registry_cols.split(','),
+                                      RESULT_COLUMNS[1:])
+            if in_arg.fuzzy_index:
+                results = pd.concat([results,
+                                     fuzzy_results(con, df, results)],
+                                    ignore_index=True)
+        else:
+            results = sqlfile.sql_query(con)
+
+    with run_metrics.stage('add_info', len(df)):
+        df = add_info(results, df)
+
+    if unchanged is not None:
+        df = pd.concat([unchanged, df], sort=False).sort_index()
+        with run_metrics.stage('deduplicate', len(df)):
+            df = deduplicate_native(df, 'org_string', incremental=True)
+        df_name += '_ddup'
+    elif in_arg.dedupe == 'csvdedupe':
+        joined_file = save_data(in_arg.dir, df, df_name, '_merged')
+
+        with run_metrics.stage('deduplicate', len(df)):
+            deduplicate('../../' + in_arg.dir + joined_file, 'org_string',
+                        '../../' + in_arg.dir + df_name + '_ddup.csv')
+
+        df, df_name = load_df(in_arg.dir, in_arg.datafile[:-4] + '_ddup.csv')
+    else:
+        with run_metrics.stage('deduplicate', len(df)):
+            df = deduplicate_native(df, 'org_string')
+        df_name += '_ddup'
 
     df = file_tidy(df, joined_file=None)
 
-    df, df_name = assign_org_ids_to_clusters(df, df_name)
+    with run_metrics.stage('assign_org_ids_to_clusters', len(df)):
+        df, df_name = assign_org_ids_to_clusters(df, df_name)
+
+    with run_metrics.stage('confidence_processing', len(df)):
+        df = confidence_processing(in_arg.dir, df_name, 'org_string',
+                                   in_arg.min_length,
+                                   in_arg.results_db or
+                                   in_arg.dir + run_name + '_results.db')
 
-    df = confidence_processing(in_arg.dir, df_name, 'org_string')
+    run_metrics.write_json(in_arg.metrics_report or
+                           in_arg.dir + run_name + '_run_report.json')
+    if in_arg.prometheus_textfile:
+        run_metrics.write_prometheus(in_arg.prometheus_textfile)
 
 
 # ---------------------------------------------------------------
 if __name__ == '__main__':
     in_arg = get_input_args()
+    if in_arg.incremental and in_arg.dedupe == 'csvdedupe':
+        sys.exit("--incremental needs native dedupe (--dedupe native)")
+    if in_arg.fuzzy_index and not in_arg.registry_table:
+        sys.exit("--fuzzy_index indexes the names of --registry_table, "
+                 "which is not set")
     main()
     # python -m pdb -c continue DM_ITA_orgtype_classifierv5.py
@@ -1,35 +1,108 @@
 import pandas as pd
 import requests
 import argparse
-import numpy as np
 import chwrapper
-import time
 import pdb
-import math
-import config
+import json
+import os
 import sys
 import logging
 import subprocess
-from tqdm import tqdm
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from orgclassifier_client import (OrgClassifierClient, LocalClassifier,
+                                  wait_until_ready)
+from org_cache import ClassificationCache, ResponseCache, file_identity
+from ch_lookup import CompaniesHouseLookup
+from ch_bulk_index import BulkIndex
+from fuzzy_index import FuzzyIndex
+from checkpoint import RunCheckpoint, file_stamp
+from data_io import FORMATS, write_frame, read_frame, compact_frame
+from dedupe_engine import (dedupe_df, dedupe_sharded, dedupe_incremental,
+                           variable_definition)
+from normalise import add_org_key, per_key
+from metrics import RunMetrics
+from incremental import split_delta
+from settings_registry import open_registry
+from results_store import ResultsStore
 logger = logging.getLogger(__name__)
 logging.getLogger("requests").setLevel(logging.WARNING)
 
+# Columns repeating a handful of values, stored as categoricals
+CATEGORICAL_COLUMNS = ['org_type', 'company_or_not']
 
-def connect_to_orgclassifier():
+# Columns added by map_columns and by get_org_id
+CLASSIFY_COLUMNS = ['org_type', 'company_or_not']
+LOOKUP_COLUMNS = ['obtained_id', 'address', 'incorporation_date']
+
+# Name column of the data file, set by pre_processing
+string_col = 'org_string'
+
+# Stage timings, request latencies and cache hit ratios of this run
+run_metrics = RunMetrics()
+
+# Answers used in place of the interactive prompts in --batch mode
+BATCH_DEFAULTS = {'string_col': 'org_string', 'blank_rows': 'drop',
+                  'id_column': '', 'min_length': 3}
+
+
+def connect_to_orgclassifier(model='model.pkl.gz', timeout=60, workers=0):
     """
-    Connects to the orgtype_classifier API (localhost server) on port 8080
+    Starts the orgtype_classifier API (localhost server) on port 8080 and
+    waits until it is answering predictions
+
+    :param model: model file, relative to the orgtype-classifier folder
+    :param timeout: seconds to wait for the server to become ready
+    :param workers: if non-zero, start classifier_server.py with this many
+        processes instead of the orgtype-classifier's server.py
+    :return p: the server process, to be passed to stop_orgclassifier
     """
-    # os.system('open -a Terminal .')
-    cmd = ['python server.py model.pkl.gz']
-    p = subprocess.Popen(cmd, shell=True, cwd=r'orgtype-classifier',
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    cmd = [sys.executable, 'server.py', model]
+    if workers:
+        cmd = [sys.executable,
+               os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'classifier_server.py'),
+               model, '--workers', str(workers)]
+    # The server logs every request to stderr. A pipe nobody reads would
+    # fill up and block it mid-run, so the log goes to a temporary file,
+    # only read back if the server fails to start.
+    log = tempfile.TemporaryFile()
+    p = subprocess.Popen(cmd, cwd=r'orgtype-classifier',
+                         stdout=subprocess.DEVNULL, stderr=log)
+    p.log = log
     print("Connecting to orgtype-classifier...")
-    time.sleep(3)
+    try:
+        wait_until_ready(timeout=timeout, proc=p)
+    except RuntimeError:
+        stop_orgclassifier(p, show_log=True)
+        raise
     print("...Done\n")
-    time.sleep(1)
     return p
 
 
+def stop_orgclassifier(p, show_log=False):
+    """
+    Shut down the orgtype_classifier server started by
+    connect_to_orgclassifier
+
+    :param p: the server process
+    :param show_log: print the end of the server's stderr
+    """
+    if p.poll() is None:
+        p.terminate()
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+    if show_log:
+        p.log.seek(0)
+        print(p.log.read()[-4000:].decode('utf-8', 'replace'))
+    p.log.close()
+
+
 def get_input_args():
     """
     Assign arguments including defaults to pass to the python call
@@ -38,33 +111,205 @@ def get_input_args():
     """
 
     parser = argparse.ArgumentParser(description="Input data file name/loc")
+    parser.add_argument('--config', default='', type=str,
+                        help="JSON file of argument values, keyed by "
+                             "argument name (command line flags override it)")
     parser.add_argument('--dir', default='', type=str,
                         help="set the data directory")
     parser.add_argument('--datafile', default='sample_orgs.csv', type=str,
                         help="set the data file")
+    parser.add_argument('--batch', action='store_true',
+                        help="run without prompts, using the defaults below "
+                             "for anything not set")
+    parser.add_argument('--string_col', default=None, type=str,
+                        help="organisation name column (batch default "
+                             "org_string)")
+    parser.add_argument('--blank_rows', default=None,
+                        choices=['drop', 'quit'],
+                        help="what to do with blank org_strings (batch "
+                             "default drop)")
+    parser.add_argument('--id_column', default=None, type=str,
+                        help="column of already-analysed company numbers to "
+                             "compare against ('' for none, the batch "
+                             "default)")
+    parser.add_argument('--min_length', default=None, type=int,
+                        help="string-length Y for confidence_processing "
+                             "(batch default 3)")
+    parser.add_argument('--usecols', default='', type=str,
+                        help="comma separated data file columns to load "
+                             "(default: all); --string_col (or "
+                             "org_string) and --id_column are always "
+                             "included")
+    parser.add_argument('--chunksize', default=0, type=int,
+                        help="stream the data file in chunks of this many "
+                             "rows (0 loads it all at once)")
+    parser.add_argument('--incremental', default='', type=str,
+                        help="'_deduped' output of an earlier run, in "
+                             "--dir: only new or changed rows are "
+                             "classified, looked up and linked to its "
+                             "clusters")
+    parser.add_argument('--run_dir', default='', type=str,
+                        help="folder for stage checkpoints, e.g. runs/ "
+                             "(default: no checkpoints)")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip rows and stages completed by an earlier "
+                             "run on the same data file")
+    parser.add_argument('--checkpoint_rows', default=1000, type=int,
+                        help="rows per checkpoint when not streaming")
+    parser.add_argument('--pipeline_depth', default=2, type=int,
+                        help="chunks in flight at once in the overlapped "
+                             "classification and Companies House stages")
+    parser.add_argument('--intermediate_format', default='parquet',
+                        choices=list(FORMATS),
+                        help="format of files passed between stages")
+    parser.add_argument('--dedupe', default='native',
+                        choices=['native', 'csvdedupe'],
+                        help="run dedupe in-process (native) or through "
+                             "the csvdedupe command line tool")
+    parser.add_argument('--dedupe_shards', default=0, type=int,
+                        help="cluster in this many blocked shards across "
+                             "processes (0 clusters all records at once)")
+    parser.add_argument('--dedupe_workers', default=None, type=int,
+                        help="processes for sharded dedupe (default: cores)")
+    parser.add_argument('--settings_registry',
+                        default='Data_Projects/settings_registry/', type=str,
+                        help="folder of learned settings shared between "
+                             "projects comparing the same fields ('' to "
+                             "disable)")
+    parser.add_argument('--classifier', default='http',
+                        choices=['http', 'local'],
+                        help="classify via the orgtype-classifier server "
+                             "(http) or by loading the model in-process "
+                             "(local)")
+    parser.add_argument('--classifier_workers', default=4, type=int,
+                        help="number of classifier batches sent concurrently")
+    parser.add_argument('--classifier_batch', default=None, type=int,
+                        help="max number of org_strings per classifier batch "
+                             "(default: 50, or 5000 with "
+                             "--classifier_server_workers)")
+    parser.add_argument('--classifier_server_workers', default=0, type=int,
+                        help="serve the model with classifier_server.py in "
+                             "this many processes and send it POST batches "
+                             "(0 uses the orgtype-classifier's server.py)")
+    parser.add_argument('--classifier_cache', default='cache/orgtype_cache.db',
+                        type=str, help="org_type cache file ('' to disable)")
+    parser.add_argument('--ch_workers', default=8, type=int,
+                        help="number of concurrent Companies House searches")
+    parser.add_argument('--ch_cache', default='cache/ch_cache.db', type=str,
+                        help="Companies House response cache ('' to disable)")
+    parser.add_argument('--ch_cache_ttl', default=7, type=float,
+                        help="days for which cached CH responses are valid")
+    parser.add_argument('--ch_index', default='', type=str,
+                        help="offline Companies House index built by "
+                             "ch_bulk_index.py (replaces the API lookups)")
+    parser.add_argument('--fuzzy_index', default='', type=str,
+                        help="fuzzy name index for --ch_index, used for "
+                             "org_strings with no exact match")
+    parser.add_argument('--fuzzy_min_score', default=0.9, type=float,
+                        help="lowest similarity accepted as a fuzzy match")
+    parser.add_argument('--model', default='orgtype-classifier/model.pkl.gz',
+                        type=str, help="orgtype-classifier model file")
+    parser.add_argument('--results_db', default='', type=str,
+                        help="indexed SQLite store of the final results "
+                             "(default: <datafile>_results.db in --dir)")
+    parser.add_argument('--metrics_report', default='', type=str,
+                        help="JSON run report of stage timings, request "
+                             "latencies and cache hit ratios (default: "
+                             "<datafile>_run_report.json in --dir)")
+    parser.add_argument('--prometheus_textfile', default='', type=str,
+                        help="also write the run metrics to this .prom file "
+                             "for the node_exporter textfile collector")
+    args, _ = parser.parse_known_args()
+    if args.config:
+        with open(args.config) as f:
+            config_values = json.load(f)
+        # argparse does not check defaults, so the file's values are
+        # checked here as if they had been given on the command line
+        actions = {action.dest: action for action in parser._actions}
+        for arg, value in config_values.items():
+            if arg not in actions:
+                parser.error("unknown argument '{}' in {}"
+                             .format(arg, args.config))
+            choices = actions[arg].choices
+            if choices is not None and value not in choices:
+                parser.error("invalid choice {!r} for '{}' in {} (choose "
+                             "from {})".format(value, arg, args.config,
+                                               ', '.join(map(str, choices))))
+        parser.set_defaults(**config_values)
     args = parser.parse_args()
+    if args.batch:
+        for arg, default in BATCH_DEFAULTS.items():
+            if getattr(args, arg) is None:
+                setattr(args, arg, default)
     return args
 
 
-def load_df(data_dir, data_file):
+def data_columns(usecols, column=None, id_column=None):
+    """
+    Columns of the data file to load. The name column is always included,
+    whether given or the default, and so is the comparison id column.
+
+    :param usecols: comma separated column names ('' for all columns)
+    :param column: name of the column containing the organisation name
+        (default: org_string)
+    :param id_column: column of already-analysed company numbers, if any
+    :return: list of column names, or None for all of them
+    """
+    if not usecols:
+        return None
+    usecols = usecols.split(',') + [col for col in (column or 'org_string',
+                                                    id_column) if col]
+    return list(dict.fromkeys(usecols))
+
+
+def load_df(data_dir, data_file, usecols=None):
     """
     Load data file
 
     :param data_dir: the directory containing the datafile
         (default: current location)
     :param data_file: the csv file containing organisation information
+    :param usecols: columns to load (default: all of them)
     :return df: pandas dataframe
     :return df_name: name of df
     """
-    df = pd.read_csv(str(data_dir + data_file))
+    with run_metrics.stage('load_df'):
+        df = pd.read_csv(str(data_dir + data_file), usecols=usecols)
     df_name = str(data_file)[:-4]
-    df = df[:200]
 
     assert len(df) > 5
     return df, df_name
 
 
-def pre_processing(df):
+def load_df_chunks(data_dir, data_file, chunksize, usecols=None):
+    """
+    Lazily load data file in chunks of fixed size
+
+    :param data_dir: the directory containing the datafile
+        (default: current location)
+    :param data_file: the csv file containing organisation information
+    :param chunksize: number of rows per chunk
+    :param usecols: columns to load (default: all of them)
+    :return reader: iterator of pandas dataframes
+    :return df_name: name of df
+    """
+    reader = pd.read_csv(str(data_dir + data_file), chunksize=chunksize,
+                         usecols=usecols)
+    df_name = str(data_file)[:-4]
+    return reader, df_name
+
+
+def ask_string_col():
+    """
+    :return: name of the column containing the organisation name, as
+        typed by the user (default org_string)
+    """
+    return str(input("\nWhat is the exact name of the column containing the organisation name? \n \
+        (default is 'org_string' - hit enter for this input): \n") or
+               'org_string')
+
+
+def pre_processing(df, column=None, blank_rows=None):
     """
     Simple pre-processing function to:
     - Clarify the name of the column containing the organisation name,
@@ -73,81 +318,102 @@ def pre_processing(df):
         them or quit
 
     :param df: the pandas dataframe
+    :param column: name of the column containing the organisation name
+        (default: ask the user)
+    :param blank_rows: 'drop' to delete blank rows or 'quit' to stop
+        (default: ask the user)
     :return: df
     """
     print("Data Sample: ")
     print(df.head(3))
     # String_col used in post_processing too therefore initiate globally
     global string_col
-    string_col = str(input("\nWhat is the exact name of the column containing the organisation name? \n \
-        (default is 'org_string' - hit enter for this input): \n") or
-                     'org_string')
-    time.sleep(0.5)
+    if column is not None:
+        if column not in df.columns:
+            sys.exit("Organisation name column '{}' not found".format(column))
+        string_col = column
+    else:
+        string_col = ask_string_col()
 
-    while True:
-        try:
-            print("Converting org_string to string type...")
-            df[string_col] = df[string_col].astype(str)
-
-        except KeyError:
-            string_col = str(input("Incorrect organisation name column entered, \
-             try again :"))
-            continue
-        break
-    time.sleep(0.5)
+    while string_col not in df.columns:
+        string_col = str(input("Incorrect organisation name column entered, \
+         try again :"))
+    # Blank rows are found before the conversion, which would turn them
+    # into the string 'nan'
+    df, _ = drop_blank_rows(df, blank_rows)
+    print("Converting org_string to string type...")
+    df[string_col] = df[string_col].astype(str)
     print("...done")
-    time.sleep(0.5)
-    nans = lambda df: df.loc[df['org_string'].isnull()]
+    print("\nProgressing to org classification")
+    return df
+
+
+def drop_blank_rows(df, blank_rows=None):
+    """
+    Checks to see if there are blank org_strings and removes them or quits
+
+    :param df: the pandas dataframe
+    :param blank_rows: 'drop' to delete blank rows or 'quit' to stop
+        (default: ask the user if there are any)
+    :return df: df without the blank rows
+    :return blank_rows: the choice made, to be applied to later chunks
+        (None if there were no blank rows to ask about)
+    """
+    nans = lambda df: df.loc[df[string_col].isnull()]
     print("\nThere are {} blank org_strings in the file".format(len(nans(df))))
-    time.sleep(0.5)
     if len(nans(df)) > 0:
         print(nans(df))
-        choice = input("Type 'y' to delete blank rows or 'n' to \
+        if blank_rows is None:
+            choice = input("Type 'y' to delete blank rows or 'n' to \
             quit and self-amend :")
-        if choice == 'y':
-            df = df.dropna(inplace=True)
+            blank_rows = 'drop' if choice == 'y' else 'quit'
+        if blank_rows == 'drop':
+            df = df.dropna(subset=[string_col])
         else:
             sys.exit()
-    time.sleep(0.5)
-    print("\nProgressing to org classification")
-    return df
+    return df, blank_rows
 
 
-def classify_org(df):
+def classify_org(df, client=None, cache=None):
     """
-    Pass org_strings array to orgtype-classifier API to get the org_type
+    Pass org_strings array to orgtype-classifier API to get the org_type.
+    Only one org_string per canonical org_key is sent. If a
+    ClassificationCache is given only the cache misses are sent to the
+    classifier, and their results are added to the cache.
 
     :param df: the pandas dataframe
-    :return orgtype_dict : dictionary containing the org_string and org_type
+    :param client: OrgClassifierClient used to send the requests, or a
+        LocalClassifier (default: a client on localhost:8080)
+    :param cache: optional ClassificationCache
+    :return orgtype_dict : dictionary containing the org_key and org_type
     """
 
-    org_strings = df['org_string']
-    orgtype_dict = {}
-    # orgtype_classifier API accepts 50 strings max per request
-    if len(org_strings) >= 50:
-        split_length = 50
-    else:
-        split_length = 1
-
-    for sub_arr in tqdm(np.array_split(org_strings, split_length)):
-        concat_string = []
-        for word in sub_arr:
-            concat_string.append(word)
-        concat_string = '&q='.join(concat_string)
-        url = r'http://localhost:8080/predict?q=' + str(concat_string)
-        r = requests.get(url)
-        try:
-            # Convert requests response object to python dict
-            rj = r.json()
-        except ValueError:
-            print(ValueError)
-            break
-        orgtype_dict.update(rj)
+    def classify(org_strings):
+        orgtype_dict = {}
+        if cache is not None:
+            orgtype_dict = cache.get_many(org_strings)
+            org_strings = [word for word in org_strings
+                           if word not in orgtype_dict]
+            print("Classifier cache: {} hits, {} misses"
+                  .format(cache.hits, cache.misses))
+        if len(org_strings) == 0:
+            return orgtype_dict
 
-    return orgtype_dict
+        if client is None:
+            with OrgClassifierClient() as default_client:
+                new_types = default_client.classify(org_strings)
+        else:
+            new_types = client.classify(org_strings)
+        if cache is not None:
+            cache.put_many(new_types)
+        orgtype_dict.update(new_types)
+        return orgtype_dict
+
+    df = add_org_key(df, string_col)
+    return per_key(df, classify, string_col)
 
 
-def map_columns(df):
+def map_columns(df, client=None, cache=None):
     """
     - Call classify_org function
         and map results to new column org_type in dataframe
@@ -156,6 +422,8 @@ def map_columns(df):
         classification and is mapped to 'company_or_not'
 
     :param df: pandas dataframe
+    :param client: OrgClassifierClient passed through to classify_org
+    :param cache: ClassificationCache passed through to classify_org
     :return df: pandas dataframe
     """
 
@@ -172,85 +440,209 @@ def map_columns(df):
                         'Local Authority': 'Not A Company',
                         'Parish or Town Council': 'Not A Company'}
 
-    orgtype_dict = classify_org(df)
-    df['org_type'] = df['org_string'].map(orgtype_dict)
+    with run_metrics.stage('classify_org', len(df)):
+        orgtype_dict = classify_org(df, client, cache)
+    df['org_type'] = df['org_key'].map(orgtype_dict)
     df['company_or_not'] = df['org_type'].map(comp_or_not_dict)
 
-    return df
+    return compact_frame(df, CATEGORICAL_COLUMNS)
 
 
-def get_org_id(df):
+def get_org_id(df, engine=None):
     """
     Lookup company name via Companies House API and return company number
     :param df: pandas dataframe containing the organisation name
+    :param engine: CompaniesHouseLookup used to run the searches, or an
+        offline ch_bulk_index.BulkIndex (default: a CompaniesHouseLookup
+        using config.api_key)
     :return df: Amended dataframe containing additional company information
     """
 
-    s = chwrapper.Search(access_token=config.api_key)
-    org_strings = df['org_string']
-    ch_org_dict = {}
-    chunk_propn = 0
-
-    # Split org_string array into multiple arrays.
-    # api states max batch of 600...
-    # array_split doesn't have to have equal batch sizes.
-    for chunk in np.array_split(org_strings,
-                                math.ceil(len(org_strings) / 100), axis=0):
-
-        print("\nProcessing companies house batch of size: " + str(len(chunk)))
-
-        # For each org_string in the sub-array of org_strings
-        # pull org data from companies house
-        for word in tqdm(chunk):
-            response = s.search_companies(word)
-            if response.status_code == 200:
-                comp_house_dict = response.json()
-                # response.json() returns a nested dict with complete org info
-                # Below pulls just the company number.
-                # pdb.set_trace()
-                ch_org_dict[word] = [comp_house_dict['items'][0]
-                                    ['company_number']]
-                # Pull through address and incorporation date
-                try:
-                    address = comp_house_dict['items'][0]['address_snippet']
-                except:
-                    address = str('None')
-
-                try:
-                    inc_date = comp_house_dict['items'][0]['date_of_creation']
-                except:
-                    inc_date = '1000-01-01'
-
-                ch_org_dict[word].extend([address, inc_date])
-                ch_org_dict.update(ch_org_dict)
-
-            elif response.status_code == 404:
-                logger.debug("Error requesting CH data: %s %s",
-                             response.status_code, response.reason)
-            elif response.status_code == 429:
-                logger.debug("Error requesting CH data: %s %s",
-                             response.status_code, response.reason)
-                logger.debug("Waiting...")
-                time.sleep(60)
-                s = chwrapper.Search(access_token=config.api_key)
-            else:
-                logger.error("Error requesting CH data: %s %s",
-                             response.status_code, response.reason)
-        chunk_propn += int(len(chunk))
-        time.sleep(0.5)
-        print("\nProgress: " + str(chunk_propn) + " of " +
-              str(len(org_strings)))
-        # pdb.set_trace()
-        df['obtained_id'] = df['org_string'].map(ch_org_dict)
-    try:
-        df[['obtained_id', 'address', 'incorporation_date']] = \
-            pd.DataFrame(df['obtained_id'].values.tolist())
-    except KeyError as e:
-        print(e.message)
+    if engine is None:
+        import config
+        engine = CompaniesHouseLookup(
+            chwrapper.Search(access_token=config.api_key))
+    # One search per canonical org_key, fanned back out to every row
+    df = add_org_key(df, string_col)
+    print("\nProcessing companies house lookups for {} unique org_strings"
+          .format(df['org_key'].nunique()))
+    with run_metrics.stage('get_org_id', len(df)):
+        ch_org_dict = per_key(df, engine.lookup_many, string_col)
+    if getattr(engine, 'throttled', 0):
+        logger.debug("CH requests throttled %s times", engine.throttled)
+    if getattr(engine, 'failed', None):
+        print("{} org_strings could not be looked up (server errors) and "
+              "are left blank".format(len(engine.failed)))
+    if getattr(engine, 'cache', None) is not None:
+        print("Companies House cache: {} hits, {} misses"
+              .format(engine.cache.hits, engine.cache.misses))
+    # Map each field separately so rows with no match are left blank and
+    # the result stays aligned with df's index (which need not start at 0)
+    for i, col in enumerate(LOOKUP_COLUMNS):
+        df[col] = df['org_key'].map({key: info[i] for key, info
+                                     in ch_org_dict.items()})
     return df
 
 
-def post_processing(df, df_name):
+def run_stage(stage, func, chunk, index, checkpoint=None):
+    """
+    Run one enrichment stage on a row range. With a RunCheckpoint the
+    output is saved, and output saved by an earlier run is loaded instead
+    of re-running the stage.
+
+    :param stage: stage name, used for the checkpoint files
+    :param func: function taking and returning a dataframe
+    :param chunk: pandas dataframe of the rows in the range
+    :param index: position of the chunk in the input
+    :param checkpoint: optional RunCheckpoint
+    :return chunk: pandas dataframe
+    """
+    if checkpoint is not None and checkpoint.chunk_done(stage, index):
+        return checkpoint.load_chunk(stage, index)
+    chunk = func(chunk)
+    if checkpoint is not None:
+        checkpoint.save_chunk(stage, index, chunk)
+    return chunk
+
+
+def join_stages(chunk, classified, found):
+    """
+    Add the columns computed by map_columns and get_org_id for a chunk
+
+    :param chunk: pandas dataframe
+    :param classified: future of the map_columns output for the chunk
+    :param found: future of the get_org_id output for the chunk
+    :return chunk: pandas dataframe
+    """
+    classified, found = classified.result(), found.result()
+    for col in CLASSIFY_COLUMNS:
+        chunk[col] = classified[col]
+    for col in LOOKUP_COLUMNS:
+        chunk[col] = found[col]
+    return compact_frame(chunk, CATEGORICAL_COLUMNS)
+
+
+def pipelined_chunks(chunks, client=None, cache=None, engine=None,
+                     checkpoint=None, depth=2):
+    """
+    Run map_columns and get_org_id over a stream of chunks, overlapping
+    them. Both stages only need the organisation name, so each chunk is
+    handed to both at once, each stage working through its own queue of
+    chunks in a separate thread. At most `depth` chunks are in flight, and
+    each chunk is yielded as soon as both stages have finished it, so the
+    caller can process it while later chunks are still being classified
+    and looked up.
+
+    :param chunks: iterable of pandas dataframes
+    :param client: classifier passed through to map_columns
+    :param cache: ClassificationCache passed through to map_columns
+    :param engine: Companies House backend passed through to get_org_id
+    :param checkpoint: optional RunCheckpoint, see run_stage
+    :param depth: number of chunks in flight
+    :return: generator of the enriched chunks, in input order
+    """
+    classify = partial(map_columns, client=client, cache=cache)
+    lookup = partial(get_org_id, engine=engine)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=1) as classify_queue, \
+            ThreadPoolExecutor(max_workers=1) as lookup_queue:
+        for i, chunk in enumerate(chunks):
+            chunk = add_org_key(chunk, string_col)
+            names = chunk[[string_col, 'org_key']]
+            pending.append((
+                chunk,
+                classify_queue.submit(run_stage, 'map_columns', classify,
+                                      names.copy(), i, checkpoint),
+                lookup_queue.submit(run_stage, 'get_org_id', lookup,
+                                    names.copy(), i, checkpoint)))
+            if len(pending) >= depth:
+                yield join_stages(*pending.popleft())
+        while pending:
+            yield join_stages(*pending.popleft())
+
+
+def checkpointed_pipeline(df, client=None, cache=None, engine=None,
+                          checkpoint=None, rows=1000, depth=2):
+    """
+    Run map_columns and get_org_id over an in-memory dataframe in row
+    ranges of fixed size (see pipelined_chunks), so that an interrupted
+    run only loses the ranges in progress
+
+    :param df: pandas dataframe
+    :param client: classifier passed through to map_columns
+    :param cache: ClassificationCache passed through to map_columns
+    :param engine: Companies House backend passed through to get_org_id
+    :param checkpoint: optional RunCheckpoint
+    :param rows: number of rows per range
+    :param depth: number of ranges in flight
+    :return df: pandas dataframe
+    """
+    ranges = (df.iloc[start:start + rows]
+              for start in range(0, len(df), rows))
+    chunks = []
+    for chunk in pipelined_chunks(ranges, client, cache, engine, checkpoint,
+                                  depth):
+        chunks.append(chunk)
+        print("\nProgress: " + str(sum(len(c) for c in chunks)) + " of " +
+              str(len(df)))
+    # Chunks with different categories concatenate to object columns
+    return compact_frame(pd.concat(chunks), CATEGORICAL_COLUMNS)
+
+
+def stream_pipeline(reader, data_dir, df_name, client=None, cache=None,
+                    engine=None, checkpoint=None, column=None,
+                    blank_rows=None, depth=2):
+    """
+    Streaming version of the pre_processing -> map_columns -> get_org_id
+    stages. Each chunk is classified and looked up on its own and appended
+    to the '_classified' output, so peak memory depends on the chunk size
+    rather than the size of the input file. Chunks go through
+    pipelined_chunks, so a finished chunk is written while the following
+    ones are still being classified and looked up.
+
+    :param reader: iterator of dataframes from load_df_chunks
+    :param data_dir: directory to write the output to
+    :param df_name: name of dataframe for saving purposes
+    :param client: classifier passed through to map_columns
+    :param cache: ClassificationCache passed through to map_columns
+    :param engine: Companies House backend passed through to get_org_id
+    :param checkpoint: optional RunCheckpoint, see run_stage
+    :param column: passed through to pre_processing
+    :param blank_rows: passed through to pre_processing
+    :param depth: number of chunks in flight
+    :return classd_name: name of the '_classified' output file
+    """
+    classd_name = df_name + '_classified.csv'
+    out_path = data_dir + classd_name
+    print("\nStreaming output to : " + out_path)
+
+    def prepared():
+        policy = blank_rows
+        for i, chunk in enumerate(reader):
+            if i == 0:
+                # Sets the organisation name column (string_col)
+                chunk = pre_processing(chunk, column, policy)
+            else:
+                # Later chunks follow the same blank row policy. An answer
+                # typed at the first chunk's prompt is not passed back, so
+                # the user may be asked once more, and then never again.
+                chunk, policy = drop_blank_rows(chunk, policy)
+                chunk[string_col] = chunk[string_col].astype(str)
+            yield chunk
+
+    total = 0
+    for i, chunk in enumerate(pipelined_chunks(prepared(), client, cache,
+                                               engine, checkpoint, depth)):
+        with run_metrics.stage('save_data', len(chunk)):
+            chunk.to_csv(out_path, mode='w' if i == 0 else 'a',
+                         header=i == 0)
+        total += len(chunk)
+        print("\nProgress: {} rows written ({} blank org_ids in chunk)"
+              .format(total, chunk['obtained_id'].isnull().sum()))
+    return classd_name
+
+
+def post_processing(df, df_name, id_column=None):
     """
     - Check sample of adjusted dataframe
     - Check for blank company id's
@@ -259,25 +651,29 @@ def post_processing(df, df_name):
 
     :param df: pandas dataframe
     :param df_name: name of dataframe for saving purposes
+    :param id_column: name of a column of already-analysed company numbers
+        to compare against, '' if there is none (default: ask the user)
 
     :return df
     """
-    time.sleep(1)
     print("\nPost processed data Sample: ")
     print(df.head(10))
-    time.sleep(0.5)
     print("\nChecking org_id data: ")
-    time.sleep(0.5)
     nans = lambda df: df.loc[df['obtained_id'].isnull()]
     print("\nThere are {} blank org_ids in the file.".format(len(nans(df))))
     if len(nans(df)) != 0:
         print(nans(df))
-    preset_id = str(input("\nIs there a column in the dataset representing \
+    if id_column is None:
+        preset_id = str(input("\nIs there a column in the dataset representing \
         already-analysed company numbers? (y/n) :"))
-    if preset_id == 'y':
-        id_comparison = str(input("\nPlease enter the name of the comparative\
+        id_column = ''
+        if preset_id == 'y':
+            id_column = str(input("\nPlease enter the name of the comparative\
          column :\n"))
-        time.sleep(0.5)
+    elif id_column and id_column not in df.columns:
+        sys.exit("Comparison id column '{}' not found".format(id_column))
+    if id_column:
+        id_comparison = id_column
         while True:
             try:
                 print("\nComparing obtained_ids to pre-analysed ids...")
@@ -293,7 +689,6 @@ def post_processing(df, df_name):
 
         print("\nThere is/are {} mis-matching ids in the file.\n"
               .format(sum(df['id_mismatch'])))
-        time.sleep(0.5)
 
         # If there are mis-matching IDs, print a condensed table and
         # save to separate file for further investigation
@@ -301,15 +696,14 @@ def post_processing(df, df_name):
         if (sum(df['id_mismatch'])) > 0:
             df_errors = df[df['id_mismatch'] == True]
             print(df_errors[[string_col, id_comparison, 'obtained_id']])
-            time.sleep(0.5)
             print("\nSaving mismatching ids to : " + str(df_name) +
                   '_classified_errors.csv')
             df_errors.to_csv(df_name + '_classified_errors.csv')
-            time.sleep(0.5)
     return df
 
 
-def deduplicate(infile, string, output_file):
+def deduplicate(infile, string, output_file, data_dir='', registry=None,
+                interactive=True):
     """
     Calls the dedupe.io api to cluster possible duplicates together.
     Outputs updated datafile with cluster id and confidence score
@@ -318,15 +712,81 @@ def deduplicate(infile, string, output_file):
     :param infile: the already-classified datafile
     :param string: the user-defined org_string column name (default org_string)
     :param output_file: the deduped filename
+    :param data_dir: folder holding training.json and learned_settings
+    :param registry: optional settings_registry.SettingsRegistry to take
+        learned settings from and add them to
+    :param interactive: allow csvdedupe to ask the user to label examples;
+        if False the run stops when there are no learned settings
     """
+    training_file = os.path.abspath(data_dir + 'training.json')
+    settings_file = os.path.abspath(data_dir + 'learned_settings')
+    variables = variable_definition([str(string), 'obtained_id', 'address',
+                                     'incorporation_date'])
+    if registry is not None:
+        registry.checkout(variables, settings_file, training_file,
+                          'csvdedupe')
+    if not interactive and not os.path.exists(settings_file):
+        # csvdedupe would stop to ask for labelled pairs
+        sys.exit("--batch --dedupe csvdedupe needs learned settings in "
+                 "{} or the settings registry; run once without --batch "
+                 "or use --dedupe native".format(data_dir or './'))
     cmd = ['python csvdedupe.py ' + infile + ' --field_names ' + str(string) +
            ' obtained_id address incorporation_date' + ' --output_file ' +
-           str(output_file)]
+           str(output_file) + ' --training_file ' + training_file +
+           ' --settings_file ' + settings_file]
     p = subprocess.Popen(cmd, cwd='./csvdedupe/csvdedupe', shell=True)
     p.wait()
+    if registry is not None:
+        registry.publish(variables, settings_file, training_file, 'csvdedupe',
+                         source=os.path.abspath(data_dir))
 
 
-def confidence_processing(data_dir, df_name, string_col):
+def deduplicate_native(df, string, data_dir, shards=0, workers=None,
+                       interactive=True, incremental=False, registry=None):
+    """
+    Clusters possible duplicates together with the dedupe library directly
+    on the in-memory dataframe, adding the cluster id and confidence score
+    columns. Learned settings and training data in data_dir are reused
+    when present.
+
+    :param df: the already-classified dataframe
+    :param string: the user-defined org_string column name (default org_string)
+    :param data_dir: folder holding training.json and learned_settings
+    :param shards: if non-zero, split the records into this many shards,
+        blocked on org_key prefix and obtained_id, and cluster them in
+        parallel processes
+    :param workers: number of processes for sharded clustering
+        (default: number of cores)
+    :param interactive: allow dedupe to ask the user to label examples
+    :param incremental: keep the clusters of rows that already have one
+        and only link the others to them (see
+        dedupe_engine.dedupe_incremental)
+    :param registry: optional settings_registry.SettingsRegistry, see
+        dedupe_engine.train_deduper
+    :return df: pandas dataframe
+    """
+    fields = [str(string), 'obtained_id', 'address', 'incorporation_date']
+    training_file = data_dir + 'training.json'
+    settings_file = data_dir + 'learned_settings'
+    if incremental:
+        return dedupe_incremental(df, fields, settings_file,
+                                  data_dir + 'gazetteer_settings',
+                                  training_file, interactive=interactive,
+                                  registry=registry)
+    if shards:
+        df = add_org_key(df, str(string))
+        return dedupe_sharded(df, fields,
+                              [('org_key', 4), ('obtained_id', None)],
+                              settings_file, training_file,
+                              n_shards=shards, max_workers=workers,
+                              interactive=interactive, registry=registry)
+    return dedupe_df(df, fields, training_file=training_file,
+                     settings_file=settings_file, interactive=interactive,
+                     registry=registry)
+
+
+def confidence_processing(data_dir, df_name, string_col, deduped_file=None,
+                          min_length=None, results_db=None):
     '''
     Split deduped dataframe twice. One is for deduped rows >90% confidence
     score AND no. of letters > Y. This is because a deviation for a string of
@@ -336,65 +796,231 @@ def confidence_processing(data_dir, df_name, string_col):
     :param data_dir: filepath to folder containing deduped data
     :param df_name: name of dataframe
     :string_col: user-defined name for the column containing the org_strings
+    :param deduped_file: name of the deduped data file
+        (default: df_name + '_deduped.csv')
+    :param min_length: string-length Y (default: ask the user)
+    :param results_db: also write every row, flagged 'accepted' or not,
+        to this results_store.ResultsStore file
 
     :return df_90Y_accept_name: name of df with >90% & > Y length strings
     :return df_90Y_unaccept_name: name of df with <90% or
     (>90% AND Y length strings)
     '''
-    df = pd.read_csv(str(data_dir + df_name + '_deduped.csv'))
-    Y = int(input("\nFor confidence scores of >90%, select the string-length\
+    if deduped_file is None:
+        deduped_file = df_name + '_deduped.csv'
+    df = read_frame(str(data_dir + deduped_file))
+    Y = min_length
+    if Y is None:
+        Y = int(input("\nFor confidence scores of >90%, select the string-length\
      below which no further investigation is deemed necessary \
      (default 3):") or 3)
     df_90Y_accept = df[(df['Confidence Score'] >= 0.9) & (df[string_col]
                                                           .str.len() >= Y)]
     df_90Y_unaccept = df[~df[string_col].isin(df_90Y_accept[string_col])]
-    time.sleep(0.5)
     print("Splitting dataframes based on confidence/letter criteria...")
-    time.sleep(0.5)
     print("...Done")
     df_90Y_accept_name = save_data(data_dir, df_90Y_accept, df_name,
                                    '_accepted_conf')
-    time.sleep(0.5)
     df_90Y_unaccept_name = save_data(data_dir, df_90Y_unaccept,
                                      df_name, '_unaccepted_conf')
+    if results_db:
+        with ResultsStore(results_db) as store:
+            store.write(df, string_col, 'obtained_id',
+                        accepted=df.index.isin(df_90Y_accept.index))
     return df_90Y_accept_name, df_90Y_unaccept_name
 
 
-def save_data(data_dir, df, df_name, suffix=None):
+def save_data(data_dir, df, df_name, suffix=None, fmt='csv'):
     """
     Save adjusted dataframe to 'filename + _classified.csv'
     :param data_dir: filepath to folder containing deduped data
     :param df
     :param name : name of dataframe
     :param suffix: ending of filename (i.e. _classified, _deduped etc)
+    :param fmt: file format, one of data_io.FORMATS (default csv).
+        Use csv for anything read by people or by csvdedupe.
 
     :return df_name
     """
-    orig_file_name = data_dir + df_name
     if suffix:
-        print("\nSaving output to : " + str(orig_file_name + suffix) + '.csv')
-        df.to_csv(orig_file_name + suffix + '.csv')
-        df_name += suffix + '.csv'
-    else:
-        print("\nSaving output to : " + str(data_dir + df_name) + '.csv')
-        df.to_csv(orig_file_name + '.csv')
-        df_name += '.csv'
+        df_name += suffix
+    with run_metrics.stage('save_data', len(df)):
+        out_path = write_frame(df, data_dir + df_name, fmt)
+    print("\nSaving output to : " + out_path)
+    df_name += FORMATS[fmt]
     return df_name
 
 
 # ---------------------------------------------------------------
 if __name__ == '__main__':
-    connect_to_orgclassifier()
     in_arg = get_input_args()
-    df, df_name = load_df(in_arg.dir, in_arg.datafile)
-    pre_processing(df)
-    df = map_columns(df)
-    df = get_org_id(df)
-    df = post_processing(df, df_name)
-    classd_name = save_data(in_arg.dir, df, df_name, '_classified')
-    deduplicate('../../' + classd_name, string_col, '../../' +
-                df_name + '_deduped.csv')
-    confidence_processing(in_arg.dir, df_name, string_col)
+    if in_arg.incremental and (in_arg.chunksize or
+                               in_arg.dedupe == 'csvdedupe'):
+        sys.exit("--incremental needs the in-memory pipeline and native "
+                 "dedupe (no --chunksize, --dedupe native)")
+    df = None
+    checkpoint = None
+    if in_arg.string_col is None and (in_arg.run_dir or in_arg.usecols):
+        # Needed before loading: the column is part of the checkpoint
+        # settings and of the columns to load
+        in_arg.string_col = ask_string_col()
+    if in_arg.run_dir:
+        # Everything that changes the saved chunks, so --resume never
+        # loads chunks made with another model, lookup backend or column
+        settings = [in_arg.chunksize, in_arg.checkpoint_rows,
+                    in_arg.intermediate_format, in_arg.incremental,
+                    in_arg.string_col, in_arg.blank_rows, in_arg.usecols,
+                    in_arg.classifier, file_identity(in_arg.model),
+                    file_stamp(in_arg.ch_index),
+                    file_stamp(in_arg.fuzzy_index), in_arg.fuzzy_min_score]
+        checkpoint = RunCheckpoint(
+            in_arg.run_dir, in_arg.dir + in_arg.datafile,
+            settings=' '.join(str(value) for value in settings),
+            resume=in_arg.resume, fmt=in_arg.intermediate_format)
+
+    if checkpoint is not None and checkpoint.stage_done('classified'):
+        print("\nSkipping classification and lookup, already completed")
+        string_col = checkpoint.meta('string_col')
+        df_name = checkpoint.meta('df_name')
+        classd_name = checkpoint.meta('classd_name')
+    else:
+        orgtype_cache = None
+        if in_arg.classifier_cache:
+            orgtype_cache = ClassificationCache(in_arg.classifier_cache,
+                                                in_arg.model)
+        server = None
+        if in_arg.classifier == 'local':
+            classifier = LocalClassifier(in_arg.model)
+        else:
+            server = connect_to_orgclassifier(
+                os.path.abspath(in_arg.model),
+                workers=in_arg.classifier_server_workers)
+            classifier = OrgClassifierClient(
+                batch_size=in_arg.classifier_batch,
+                method='post' if in_arg.classifier_server_workers else 'get',
+                # Enough batches in flight to keep every server process busy
+                max_workers=max(in_arg.classifier_workers,
+                                in_arg.classifier_server_workers),
+                metrics=run_metrics)
+        ch_cache = None
+        if in_arg.ch_index:
+            fuzzy = None
+            if in_arg.fuzzy_index:
+                fuzzy = FuzzyIndex.load(in_arg.fuzzy_index)
+            ch_engine = BulkIndex(in_arg.ch_index, fuzzy,
+                                  in_arg.fuzzy_min_score)
+        else:
+            # The API key is only needed for live Companies House lookups
+            import config
+            if in_arg.ch_cache:
+                ch_cache = ResponseCache(in_arg.ch_cache,
+                                         ttl=in_arg.ch_cache_ttl * 24 * 3600)
+            ch_engine = CompaniesHouseLookup(
+                chwrapper.Search(access_token=config.api_key),
+                max_workers=in_arg.ch_workers, cache=ch_cache,
+                metrics=run_metrics)
+
+        usecols = data_columns(in_arg.usecols, in_arg.string_col,
+                               in_arg.id_column)
+        try:
+            if in_arg.chunksize:
+                reader, df_name = load_df_chunks(in_arg.dir, in_arg.datafile,
+                                                 in_arg.chunksize, usecols)
+                classd_name = stream_pipeline(reader, in_arg.dir, df_name,
+                                              classifier, orgtype_cache,
+                                              ch_engine, checkpoint,
+                                              in_arg.string_col,
+                                              in_arg.blank_rows,
+                                              in_arg.pipeline_depth)
+            else:
+                df, df_name = load_df(in_arg.dir, in_arg.datafile, usecols)
+                df = pre_processing(df, in_arg.string_col,
+                                    in_arg.blank_rows)
+                unchanged = None
+                if in_arg.incremental:
+                    # Rows unchanged since the earlier run keep its
+                    # results. post_processing rewrites the id column, so
+                    # it is left out of the comparison.
+                    previous = read_frame(in_arg.dir + in_arg.incremental,
+                                          index_col=0)
+                    unchanged, df = split_delta(
+                        df, previous, [col for col in df.columns
+                                       if col != in_arg.id_column])
+                # Without checkpoints the whole file is one range, so each
+                # name is still only classified and looked up once
+                rows = in_arg.checkpoint_rows if checkpoint is not None \
+                    else max(len(df), 1)
+                if len(df):
+                    df = checkpointed_pipeline(df, classifier,
+                                               orgtype_cache, ch_engine,
+                                               checkpoint, rows,
+                                               in_arg.pipeline_depth)
+                if unchanged is not None:
+                    df = pd.concat([unchanged, df], sort=False).sort_index()
+                df = post_processing(df, df_name, in_arg.id_column)
+                # csvdedupe can only read csv
+                classd_name = save_data(
+                    in_arg.dir, df, df_name, '_classified',
+                    'csv' if in_arg.dedupe == 'csvdedupe'
+                    else in_arg.intermediate_format)
+        finally:
+            classifier.close()
+            if server is not None:
+                stop_orgclassifier(server)
+            if orgtype_cache is not None:
+                run_metrics.cache_stats('classifier', orgtype_cache.hits,
+                                        orgtype_cache.misses)
+                orgtype_cache.close()
+            if ch_cache is not None:
+                run_metrics.cache_stats('companies_house', ch_cache.hits,
+                                        ch_cache.misses)
+                ch_cache.close()
+        if checkpoint is not None:
+            checkpoint.mark_stage_done('classified', string_col=string_col,
+                                       df_name=df_name,
+                                       classd_name=classd_name)
+
+    if checkpoint is not None and checkpoint.stage_done('deduplicate'):
+        print("\nSkipping deduplication, already completed")
+        deduped_name = checkpoint.meta('deduped_name')
+    elif in_arg.dedupe == 'csvdedupe':
+        if not classd_name.endswith(FORMATS['csv']):
+            # Classified by a checkpointed run without csvdedupe
+            classd_name = save_data(
+                in_arg.dir, read_frame(in_arg.dir + classd_name), df_name,
+                '_classified')
+        with run_metrics.stage('deduplicate'):
+            deduplicate('../../' + classd_name, string_col, '../../' +
+                        df_name + '_deduped.csv', in_arg.dir,
+                        open_registry(in_arg.settings_registry),
+                        interactive=not in_arg.batch)
+        deduped_name = df_name + '_deduped.csv'
+    else:
+        if df is None:
+            with run_metrics.stage('load_df'):
+                df = read_frame(in_arg.dir + classd_name, index_col=0)
+        with run_metrics.stage('deduplicate', len(df)):
+            df = deduplicate_native(df, string_col, in_arg.dir,
+                                    in_arg.dedupe_shards,
+                                    in_arg.dedupe_workers,
+                                    interactive=not in_arg.batch,
+                                    incremental=bool(in_arg.incremental),
+                                    registry=open_registry(
+                                        in_arg.settings_registry))
+        deduped_name = save_data(in_arg.dir, df, df_name, '_deduped',
+                                 in_arg.intermediate_format)
+    if checkpoint is not None and not checkpoint.stage_done('deduplicate'):
+        checkpoint.mark_stage_done('deduplicate', deduped_name=deduped_name)
+    with run_metrics.stage('confidence_processing'):
+        confidence_processing(in_arg.dir, df_name, string_col, deduped_name,
+                              in_arg.min_length,
+                              in_arg.results_db or
+                              in_arg.dir + df_name + '_results.db')
+
+    run_metrics.write_json(in_arg.metrics_report or
+                           in_arg.dir + df_name + '_run_report.json')
+    if in_arg.prometheus_textfile:
+        run_metrics.write_prometheus(in_arg.prometheus_textfile)
 
     # To run and allow pdb to catch any error and enter debug mode :
     # python -m pdb -c continue DM_orgtype_classifier_v15.py
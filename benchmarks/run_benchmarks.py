@@ -0,0 +1,266 @@
+"""
+Offline benchmark of the matching pipeline stages.
+
+Runs classify_org and get_org_id against local stub servers (see
+stub_servers), and add_info, deduplicate, assign_org_ids_to_clusters and
+confidence_processing on the files they produce, for synthetic inputs of
+each requested size. Timings are written as JSON and compared with the
+saved baseline for that size, so a slowdown shows up as a failed run.
+
+    python benchmarks/run_benchmarks.py --rows 10000 100000 --save_baseline
+    python benchmarks/run_benchmarks.py --rows 10000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+import pandas as pd
+
+import DM_ITA_match_MASTER as ita
+import DM_UK_match_MASTER as uk
+from ch_lookup import CompaniesHouseLookup, TokenBucket
+from data_io import FORMATS, write_frame
+from dedupe_engine import dedupe_df, dedupe_sharded
+from metrics import RunMetrics
+from orgclassifier_client import OrgClassifierClient
+from stub_servers import StubSearch, classifier_server, companies_house_server
+from synthetic import SIZES, generate_orgs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEDUPE_FIELDS = ['org_string', 'address', 'obtd_id', 'obtained_address',
+                 'obtd_legal_name']
+
+
+def get_input_args():
+    """
+    Assign arguments including defaults to pass to the python call
+
+    :return: arguments variable
+    """
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    parser.add_argument('--rows', default=[SIZES[0]], type=int, nargs='+',
+                        help="input sizes to run (e.g. 10000 100000 1000000)")
+    parser.add_argument('--dup_rate', default=0.3, type=float,
+                        help="share of rows duplicating an organisation")
+    parser.add_argument('--typo_rate', default=0.1, type=float,
+                        help="probability of a typo in a duplicate row")
+    parser.add_argument('--seed', default=0, type=int,
+                        help="random seed of the synthetic data")
+    parser.add_argument('--latency', default=0.005, type=float,
+                        help="seconds added to every stub server request")
+    parser.add_argument('--throttle_rate', default=0.01, type=float,
+                        help="share of stub requests answered 429")
+    parser.add_argument('--retry_after', default=0.1, type=float,
+                        help="Retry-After (seconds) sent with a 429")
+    parser.add_argument('--classifier_workers', default=4, type=int,
+                        help="concurrent classifier requests")
+    parser.add_argument('--classifier_method', default='get',
+                        choices=['get', 'post'],
+                        help="GET batches of 50 (server.py) or POST "
+                             "batches (classifier_server.py)")
+    parser.add_argument('--ch_workers', default=8, type=int,
+                        help="concurrent Companies House searches")
+    parser.add_argument('--ch_rate', default=1000.0, type=float,
+                        help="Companies House requests per second allowed "
+                             "by the token bucket")
+    parser.add_argument('--settings_file', default='', type=str,
+                        help="dedupe learned settings for the "
+                             "deduplicate stage (default: skip it and use "
+                             "the true clusters)")
+    parser.add_argument('--dedupe_shards', default=0, type=int,
+                        help="cluster in this many shards across processes")
+    parser.add_argument('--intermediate_format', default='parquet',
+                        choices=list(FORMATS),
+                        help="format of files passed between stages")
+    parser.add_argument('--out', default=os.path.join(BENCH_DIR, 'results'),
+                        type=str, help="directory for the timing reports")
+    parser.add_argument('--baseline_dir',
+                        default=os.path.join(BENCH_DIR, 'baselines'),
+                        type=str, help="directory of the saved baselines")
+    parser.add_argument('--save_baseline', action='store_true',
+                        help="save this run as the new baseline")
+    parser.add_argument('--tolerance', default=0.25, type=float,
+                        help="slowdown against the baseline that counts as "
+                             "a regression (0.25 = 25%%)")
+    return parser.parse_args()
+
+
+def timed(report, stage, rows, func, *args, **kwargs):
+    """
+    Run one stage and record its wall time and throughput in report
+
+    :param report: dictionary of stage: timings
+    :param stage: stage name
+    :param rows: number of rows the stage processes
+    :param func: the stage function
+    :return: whatever func returns
+    """
+    print("\n--- {} ({} rows)".format(stage, rows))
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    report[stage] = {'seconds': round(seconds, 4),
+                     'rows_per_s': round(rows / max(seconds, 1e-9), 1)}
+    return result
+
+
+def true_clusters(df, seed):
+    """
+    Stand-in for the deduplicate stage when there are no learned settings:
+    the generator's entity ids as clusters with random confidence scores
+    """
+    rng = random.Random(seed)
+    df['Cluster ID'] = df['entity_id']
+    df['Confidence Score'] = [rng.uniform(0.5, 1.0) for _ in range(len(df))]
+    return df
+
+
+def run(rows, args, workdir):
+    """
+    :param rows: number of input rows
+    :param args: arguments from get_input_args
+    :param workdir: directory for the files written by the stages
+    :return: dictionary of stage: timings
+    :return: RunMetrics of the stub server requests
+    """
+    metrics = RunMetrics()
+    orgs, registry = generate_orgs(rows, args.dup_rate, args.typo_rate,
+                                   args.seed)
+    stages = {}
+    stub_args = {'latency': args.latency,
+                 'throttle_rate': args.throttle_rate,
+                 'retry_after': args.retry_after, 'seed': args.seed}
+
+    # UK: classification and Companies House lookup
+    df = orgs[['org_string', 'postcode']].copy()
+    with classifier_server(**stub_args) as server, \
+            OrgClassifierClient(server.url,
+                                max_workers=args.classifier_workers,
+                                method=args.classifier_method,
+                                backoff=args.retry_after,
+                                metrics=metrics) as client:
+        orgtype_dict = timed(stages, 'classify_org', rows, uk.classify_org,
+                             df, client)
+    df['org_type'] = df['org_key'].map(orgtype_dict)
+
+    with companies_house_server(registry, **stub_args) as server:
+        engine = CompaniesHouseLookup(
+            StubSearch(server.url, args.ch_workers),
+            bucket=TokenBucket(args.ch_rate, args.ch_rate),
+            max_workers=args.ch_workers, backoff=args.retry_after,
+            metrics=metrics)
+        timed(stages, 'get_org_id', rows, uk.get_org_id, df, engine)
+
+    # ITA: registry results, dedupe and cluster id expansion
+    results = pd.DataFrame({'org_string': registry['name'],
+                            'obtained_address': registry['address'],
+                            'obtd_id': registry['company_number'],
+                            'obtd_legal_name': registry['name'],
+                            'obtd_tax_id': registry['company_number']})
+    df = orgs.rename(columns={'postcode': 'address'})
+    df = timed(stages, 'add_info', rows, ita.add_info, results, df)
+
+    if args.settings_file and args.dedupe_shards:
+        df = timed(stages, 'deduplicate', rows, dedupe_sharded, df,
+                   DEDUPE_FIELDS, [('org_key', 4), ('obtd_id', None)],
+                   args.settings_file, n_shards=args.dedupe_shards,
+                   interactive=False)
+    elif args.settings_file:
+        df = timed(stages, 'deduplicate', rows, dedupe_df, df, DEDUPE_FIELDS,
+                   settings_file=args.settings_file, interactive=False)
+    else:
+        print("\n--- deduplicate skipped (no --settings_file), using the "
+              "true clusters")
+        df = true_clusters(df, args.seed)
+
+    ita.in_arg = argparse.Namespace(
+        dir=workdir, intermediate_format=args.intermediate_format)
+    df, df_name = timed(stages, 'assign_org_ids_to_clusters', rows,
+                        ita.assign_org_ids_to_clusters, df, 'bench')
+
+    deduped_file = os.path.basename(write_frame(
+        df, workdir + 'bench_deduped', args.intermediate_format))
+    timed(stages, 'confidence_processing', rows, uk.confidence_processing,
+          workdir, 'bench', 'org_string', deduped_file, min_length=3)
+    return stages, metrics
+
+
+def compare(report, baseline, tolerance):
+    """
+    :param report: this run's report
+    :param baseline: the saved report for the same size
+    :param tolerance: allowed fractional slowdown
+    :return: list of the stages slower than the baseline allows
+    """
+    regressions = []
+    print("\n{:<30}{:>12}{:>12}{:>9}".format('stage', 'baseline s', 'now s',
+                                             'change'))
+    for stage, timing in report['stages'].items():
+        before = baseline['stages'].get(stage)
+        if not before:
+            continue
+        change = timing['seconds'] / before['seconds'] - 1
+        flag = ''
+        if change > tolerance:
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        print("{:<30}{:>12.3f}{:>12.3f}{:>+8.0%}{}".format(
+            stage, before['seconds'], timing['seconds'], change, flag))
+    return regressions
+
+
+def main():
+    args = get_input_args()
+    os.makedirs(args.out, exist_ok=True)
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ('rows', 'out', 'baseline_dir',
+                               'save_baseline', 'tolerance')}
+    regressions = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as workdir:
+            stages, metrics = run(rows, args, workdir + os.sep)
+        requests = metrics.report()
+        report = {'rows': rows,
+                  'created': datetime.now().isoformat(timespec='seconds'),
+                  'python': platform.python_version(),
+                  'platform': platform.platform(),
+                  'settings': settings,
+                  'stages': stages,
+                  'requests': requests['requests'],
+                  'counters': requests['counters'],
+                  'peak_rss_bytes': requests['peak_rss_bytes']}
+        file_name = 'bench_{}.json'.format(rows)
+        with open(os.path.join(args.out, file_name), 'w') as f:
+            json.dump(report, f, indent=2)
+
+        baseline_path = os.path.join(args.baseline_dir, file_name)
+        if os.path.exists(baseline_path) and not args.save_baseline:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+            if baseline['settings'] != settings:
+                print("\nBaseline {} used different settings, not compared"
+                      .format(baseline_path))
+            else:
+                regressions += compare(report, baseline, args.tolerance)
+        if args.save_baseline:
+            os.makedirs(args.baseline_dir, exist_ok=True)
+            with open(baseline_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print("\nSaved baseline " + baseline_path)
+
+    if regressions:
+        sys.exit("Slower than baseline: " + ', '.join(regressions))
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    main()
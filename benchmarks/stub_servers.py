@@ -0,0 +1,194 @@
+import gzip
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from normalise import canonical_name
+
+# Labels returned by the orgtype-classifier
+ORG_TYPES = ['Private Limited Company', 'Company Limited by Guarantee',
+             'Royal Charter Company', 'Community Interest Company',
+             'Registered Society', 'Registered charity', 'Individual',
+             'Government', 'School', 'Community Amateur Sports Club',
+             'Local Authority', 'Parish or Town Council']
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubServer:
+    """
+    Local stand-in for a remote API, served from a background thread.
+
+    Every request waits `latency` seconds before it is answered, and a
+    `throttle_rate` share of requests is answered 429 with a Retry-After
+    of `retry_after` seconds, so client concurrency, backoff and retry
+    handling can be measured without touching the real service.
+    """
+
+    def __init__(self, respond, latency=0.0, throttle_rate=0.0,
+                 retry_after=0, port=0, seed=0):
+        """
+        :param respond: function taking (path, query dict, decoded JSON
+            body or None) and returning (status, json-serialisable body)
+        :param latency: seconds added to every request
+        :param throttle_rate: probability of answering 429
+        :param retry_after: Retry-After (seconds) sent with a 429
+        :param port: port to listen on (default: any free port)
+        :param seed: seed of the 429 injection
+        """
+        self.respond = respond
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port),
+                                         self._handler())
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so pooled client connections are reused, without
+            # Nagle delays between the headers and the body
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.answer(self, url.path, parse_qs(url.query))
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                stub.answer(self, url.path, parse_qs(url.query),
+                            json.loads(body.decode('utf-8')))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def answer(self, handler, path, query, body=None):
+        with self.lock:
+            self.requests += 1
+            throttle = self.rng.random() < self.throttle_rate
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            status, body = 429, {'error': 'rate limited'}
+        else:
+            status, body = self.respond(path, query, body)
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        if throttle:
+            handler.send_header('Retry-After', str(self.retry_after))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def predict_org_type(org_string):
+    """
+    Deterministic stand-in prediction: spelling variants of a name share
+    its canonical form, so they get the same org_type
+    """
+    key = canonical_name(org_string).encode()
+    return ORG_TYPES[zlib.crc32(key) % len(ORG_TYPES)]
+
+
+def classifier_server(**kwargs):
+    """
+    Stub of the orgtype-classifier: GET /predict?q=...&q=... returns
+    {org_string: org_type}, and POST /predict of a JSON array of names
+    (as served by classifier_server.py) the list of their org_types
+
+    :param kwargs: passed to StubServer
+    :return: StubServer (not started)
+    """
+    def respond(path, query, body):
+        if path != '/predict':
+            return 404, {'error': 'not found'}
+        if body is not None:
+            return 200, [predict_org_type(word) for word in body]
+        return 200, {word: predict_org_type(word)
+                     for word in query.get('q', [])}
+
+    return StubServer(respond, **kwargs)
+
+
+def companies_house_server(registry, **kwargs):
+    """
+    Stub of the Companies House company search:
+    GET /search/companies?q=... returns the registry entry sharing the
+    name's canonical form as the only item, or no items
+
+    :param registry: dataframe of name, company_number, address and
+        incorporation_date (see synthetic.generate_orgs)
+    :param kwargs: passed to StubServer
+    :return: StubServer (not started)
+    """
+    items = {canonical_name(row.name): {
+        'title': row.name.upper(),
+        'company_number': row.company_number,
+        'address_snippet': row.address,
+        'date_of_creation': row.incorporation_date}
+        for row in registry.itertuples(index=False)}
+
+    def respond(path, query, body):
+        if path != '/search/companies':
+            return 404, {'error': 'not found'}
+        item = items.get(canonical_name(query.get('q', [''])[0]))
+        return 200, {'items': [item] if item else []}
+
+    return StubServer(respond, **kwargs)
+
+
+class StubSearch:
+    """
+    The part of chwrapper.Search used by ch_lookup.CompaniesHouseLookup,
+    pointed at a companies_house_server
+    """
+
+    def __init__(self, base_url, pool_size=8):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+
+    def search_companies(self, term):
+        return self.session.get(self.base_url + '/search/companies',
+                                params={'q': term})
@@ -0,0 +1,150 @@
+import random
+
+import pandas as pd
+
+# Building blocks for plausible UK supplier names
+WORDS = ['Acme', 'Albion', 'Apex', 'Arden', 'Ashford', 'Beacon', 'Bridge',
+         'Bright', 'Castle', 'Cedar', 'Central', 'Crown', 'Delta', 'Eagle',
+         'Eastern', 'Echo', 'Elm', 'Falcon', 'Forest', 'Global', 'Golden',
+         'Granite', 'Green', 'Harbour', 'Highland', 'Horizon', 'Iron',
+         'Kingfisher', 'Lake', 'Lion', 'Maple', 'Meadow', 'Mercury',
+         'Northern', 'Nova', 'Oak', 'Orchard', 'Pennine', 'Phoenix',
+         'Pioneer', 'Premier', 'Quantum', 'Red', 'Regent', 'River', 'Royal',
+         'Saxon', 'Silver', 'Southern', 'Sterling', 'Summit', 'Thames',
+         'Trinity', 'Union', 'Valley', 'Vector', 'Victoria', 'Western',
+         'Willow', 'Windsor']
+SECTORS = ['Associates', 'Builders', 'Care', 'Catering', 'Cleaning',
+           'Consulting', 'Construction', 'Design', 'Electrical',
+           'Engineering', 'Estates', 'Foods', 'Group', 'Haulage', 'Holdings',
+           'Homes', 'Logistics', 'Media', 'Medical', 'Motors', 'Partners',
+           'Plumbing', 'Print', 'Properties', 'Recruitment', 'Security',
+           'Services', 'Software', 'Solutions', 'Supplies', 'Systems',
+           'Technology', 'Training', 'Transport', 'Trust', 'Ventures']
+# (suffix, weight); '' is an unsuffixed name
+SUFFIXES = [('Ltd', 35), ('Limited', 20), ('LTD.', 5), ('PLC', 4),
+            ('LLP', 5), ('CIC', 3), ('', 28)]
+# Variants of one suffix that refer to the same organisation
+SUFFIX_VARIANTS = {'Ltd': ['Limited', 'LTD', 'Ltd.'],
+                   'Limited': ['Ltd', 'LIMITED', 'Ltd.'],
+                   'LTD.': ['Ltd', 'Limited'],
+                   'PLC': ['Public Limited Company', 'plc'],
+                   'LLP': ['Limited Liability Partnership', 'L.L.P.'],
+                   'CIC': ['Community Interest Company'],
+                   '': ['']}
+# Share of distinct organisations found in the registry
+REGISTERED = 0.7
+AREAS = ['AB', 'B', 'BS', 'CF', 'E', 'EH', 'G', 'L', 'LS', 'M', 'N', 'NE',
+         'NG', 'NW', 'OX', 'S', 'SE', 'SW', 'W']
+SIZES = [10000, 100000, 1000000]
+
+
+def make_name(rng):
+    """
+    :param rng: random.Random
+    :return: (name without suffix, suffix)
+    """
+    words = rng.sample(WORDS, rng.choice([1, 1, 2, 2, 3]))
+    stem = ' '.join(words + [rng.choice(SECTORS)])
+    suffix = rng.choices([s for s, _ in SUFFIXES],
+                         [w for _, w in SUFFIXES])[0]
+    return stem, suffix
+
+
+def add_typo(name, rng):
+    """
+    Apply one keyboard-style error: a dropped, doubled, swapped or
+    replaced character
+
+    :param name: string
+    :param rng: random.Random
+    :return: string
+    """
+    if len(name) < 4:
+        return name
+    i = rng.randrange(1, len(name) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:i] + name[i + 1:]
+    if kind == 1:
+        return name[:i] + name[i] + name[i:]
+    if kind == 2:
+        return name[:i - 1] + name[i] + name[i - 1] + name[i + 1:]
+    return name[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + name[i + 1:]
+
+
+def make_variant(stem, suffix, rng, typo_rate):
+    """
+    Spell an organisation name the way another record might: with a
+    different suffix spelling, case, '&' for 'and' and occasional typos
+
+    :param stem: name without suffix
+    :param suffix: the organisation's suffix
+    :param rng: random.Random
+    :param typo_rate: probability of a typo
+    :return: org_string
+    """
+    if rng.random() < 0.5:
+        suffix = rng.choice(SUFFIX_VARIANTS[suffix])
+    name = (stem + ' ' + suffix).strip()
+    roll = rng.random()
+    if roll < 0.15:
+        name = name.upper()
+    elif roll < 0.2:
+        name = name.lower()
+    if rng.random() < 0.05:
+        name = name.replace(' and ', ' & ')
+    if rng.random() < typo_rate:
+        name = add_typo(name, rng)
+    return name
+
+
+def generate_orgs(n_rows, dup_rate=0.3, typo_rate=0.1, seed=0):
+    """
+    Synthetic supplier file. Each distinct organisation appears once under
+    its registered name; the remaining dup_rate share of rows repeat
+    organisations (a few of them many times, as with real suppliers)
+    under variant spellings.
+
+    :param n_rows: number of rows
+    :param dup_rate: share of rows that duplicate an earlier organisation
+    :param typo_rate: probability of a typo in a duplicate row
+    :param seed: random seed; the same arguments give the same file
+    :return orgs: dataframe of org_string, postcode and entity_id (the
+        true cluster of the row)
+    :return registry: dataframe of the registered organisations' name,
+        entity_id, company_number, address and incorporation_date
+    """
+    rng = random.Random(seed)
+    n_entities = max(1, int(round(n_rows * (1 - dup_rate))))
+    entities = [make_name(rng) for _ in range(n_entities)]
+    postcodes = ['{}{} {}{}{}'.format(rng.choice(AREAS), rng.randint(1, 20),
+                                      rng.randint(1, 9),
+                                      rng.choice('ABDEFGHJLNPQRSTUWXYZ'),
+                                      rng.choice('ABDEFGHJLNPQRSTUWXYZ'))
+                 for _ in range(n_entities)]
+
+    rows = [((stem + ' ' + suffix).strip(), postcodes[i], i)
+            for i, (stem, suffix) in enumerate(entities)]
+    # Pareto-weighted choice of which organisations are duplicated
+    weights = [rng.paretovariate(1.5) for _ in range(n_entities)]
+    for i in rng.choices(range(n_entities), weights, k=n_rows - n_entities):
+        stem, suffix = entities[i]
+        rows.append((make_variant(stem, suffix, rng, typo_rate),
+                     postcodes[i], i))
+    rng.shuffle(rows)
+    orgs = pd.DataFrame(rows, columns=['org_string', 'postcode',
+                                       'entity_id'])
+
+    registered = [i for i in range(n_entities) if rng.random() < REGISTERED]
+    registry = pd.DataFrame({
+        'name': [(entities[i][0] + ' ' + entities[i][1]).strip()
+                 for i in registered],
+        'entity_id': registered,
+        'company_number': ['{:08d}'.format(1000000 + i) for i in registered],
+        'address': ['{} High Street, {}'.format(rng.randint(1, 200),
+                                                postcodes[i])
+                    for i in registered],
+        'incorporation_date': ['{}-{:02d}-{:02d}'.format(
+            rng.randint(1950, 2018), rng.randint(1, 12), rng.randint(1, 28))
+            for _ in registered]})
+    return orgs, registry
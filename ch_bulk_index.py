@@ -0,0 +1,190 @@
+import argparse
+import os
+import sqlite3
+
+import pandas as pd
+
+from fuzzy_index import FuzzyIndex
+from normalise import canonical_name
+from org_cache import SQL_CHUNK
+
+# Columns of the Companies House "basic company data" bulk product
+BULK_COLUMNS = ['CompanyName', 'CompanyNumber', 'RegAddress.AddressLine1',
+                'RegAddress.AddressLine2', 'RegAddress.PostTown',
+                'RegAddress.County', 'RegAddress.PostCode', 'CompanyStatus',
+                'IncorporationDate']
+ADDRESS_COLUMNS = ['RegAddress.AddressLine1', 'RegAddress.AddressLine2',
+                   'RegAddress.PostTown', 'RegAddress.County',
+                   'RegAddress.PostCode']
+
+
+def build_index(csv_path, db_path, chunksize=100000):
+    """
+    Build a SQLite lookup index from the Companies House bulk
+    "basic company data" CSV (http://download.companieshouse.gov.uk/)
+
+    :param csv_path: the bulk CSV (or zip containing it)
+    :param db_path: location of the index to (re)create
+    :param chunksize: rows of the bulk file processed at a time
+    :return: number of companies indexed
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    con = sqlite3.connect(db_path)
+    con.execute("CREATE TABLE companies (name_key TEXT, "
+                "company_number TEXT, address TEXT, incorporation_date TEXT, "
+                "active INTEGER)")
+    total = 0
+    # Some of the bulk file headers have a leading space, so strip them
+    # before selecting columns.
+    reader = pd.read_csv(csv_path, dtype=str, chunksize=chunksize,
+                         usecols=lambda c: c.strip() in BULK_COLUMNS)
+    for chunk in reader:
+        chunk.columns = chunk.columns.str.strip()
+        address = chunk[ADDRESS_COLUMNS].fillna('')\
+            .apply(lambda r: ', '.join(x for x in r if x), axis=1)
+        inc_date = pd.to_datetime(chunk['IncorporationDate'],
+                                  format='%d/%m/%Y', errors='coerce')\
+            .dt.strftime('%Y-%m-%d').fillna('1000-01-01')
+        # Keyed like the pipeline's org_key, so "ACME LTD" in the bulk file
+        # is found for "Acme Limited" in the data
+        rows = zip(chunk['CompanyName'].map(canonical_name),
+                   chunk['CompanyNumber'], address, inc_date,
+                   (chunk['CompanyStatus'] == 'Active').astype(int))
+        con.executemany("INSERT INTO companies VALUES (?, ?, ?, ?, ?)",
+                        rows)
+        total += len(chunk)
+        print("Indexed {} companies".format(total))
+    con.execute("CREATE INDEX companies_name ON companies (name_key)")
+    con.commit()
+    con.close()
+    return total
+
+
+class BulkIndex:
+    """
+    Offline Companies House lookup backend over an index made by
+    build_index. Has the same lookup_many interface as
+    ch_lookup.CompaniesHouseLookup so get_org_id can use either.
+    """
+
+    def __init__(self, db_path, fuzzy_index=None, min_score=0.9):
+        """
+        :param db_path: index created by build_index
+        :param fuzzy_index: optional fuzzy_index.FuzzyIndex over the
+            index's names (see build_fuzzy_index), used for names with
+            no exact match
+        :param min_score: lowest similarity accepted as a fuzzy match
+        """
+        self.fuzzy_index = fuzzy_index
+        self.min_score = min_score
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(db_path)
+        # Opened read-only; the index is never modified by lookups. May be
+        # used from a pipeline stage thread, one thread at a time
+        self.con = sqlite3.connect('file:{}?mode=ro'.format(db_path),
+                                   uri=True, check_same_thread=False)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup_many(self, org_strings, progress=True):
+        """
+        Look up every org_string in the index by its canonical name
+        (normalise.canonical_name). Where several companies share a name,
+        active companies are preferred, then the most recently
+        incorporated. With a fuzzy index, names with no exact match take
+        the company of their most similar indexed name, if it scores at
+        least min_score.
+
+        :param org_strings: iterable of organisation names
+        :param progress: unused, kept for interface compatibility
+        :return ch_org_dict: dictionary of
+            org_string: [company_number, address, inc_date] for the
+            names that were found
+        """
+        org_strings = list(org_strings)
+        ch_org_dict = self._lookup_exact(org_strings)
+        if self.fuzzy_index is not None:
+            unmatched = [word for word in org_strings
+                         if word not in ch_org_dict]
+            matches = self.fuzzy_index.best_matches(unmatched,
+                                                    self.min_score)
+            found = self._lookup_exact(set(matches.values()))
+            ch_org_dict.update({word: found[name] for word, name
+                                in matches.items() if name in found})
+        return ch_org_dict
+
+    def _lookup_exact(self, org_strings):
+        keys = {}
+        for word in dict.fromkeys(org_strings):
+            keys.setdefault(canonical_name(word), []).append(word)
+
+        ch_org_dict = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), SQL_CHUNK):
+            chunk = key_list[i:i + SQL_CHUNK]
+            # rowid makes the order of otherwise equal companies fixed
+            rows = self.con.execute(
+                "SELECT name_key, company_number, address, "
+                "incorporation_date FROM companies WHERE name_key IN ({}) "
+                "ORDER BY active DESC, incorporation_date DESC, rowid"
+                .format(','.join('?' * len(chunk))), chunk).fetchall()
+            for name_key, number, address, inc_date in rows:
+                for word in keys[name_key]:
+                    if word not in ch_org_dict:
+                        ch_org_dict[word] = [number, address, inc_date]
+        return ch_org_dict
+
+
+def build_fuzzy_index(db_path, index_path):
+    """
+    Build a FuzzyIndex over the distinct names of an index created by
+    build_index and save it
+
+    :param db_path: index created by build_index
+    :param index_path: location to save the fuzzy index
+    :return: the FuzzyIndex
+    """
+    con = sqlite3.connect(db_path)
+    names = [row[0] for row in
+             con.execute("SELECT DISTINCT name_key FROM companies")]
+    con.close()
+    print("Building fuzzy index over {} names...".format(len(names)))
+    index = FuzzyIndex(names)
+    index.save(index_path)
+    return index
+
+
+def get_input_args():
+    """
+    Assign arguments including defaults to pass to the python call
+
+    :return: arguments variable for the bulk file and the index location
+    """
+    parser = argparse.ArgumentParser(
+        description="Build an offline Companies House lookup index")
+    parser.add_argument('bulk_csv', type=str,
+                        help="Companies House basic company data CSV")
+    parser.add_argument('--index', default='cache/ch_index.db', type=str,
+                        help="index file to create")
+    parser.add_argument('--fuzzy_index', default='', type=str,
+                        help="also build a fuzzy name index at this path")
+    return parser.parse_args()
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    in_arg = get_input_args()
+    index_dir = os.path.dirname(in_arg.index)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+    build_index(in_arg.bulk_csv, in_arg.index)
+    if in_arg.fuzzy_index:
+        build_fuzzy_index(in_arg.index, in_arg.fuzzy_index)
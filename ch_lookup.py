@@ -0,0 +1,249 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+# Companies House allows 600 requests per 5 minute window per api key
+CH_QUOTA = 600
+CH_WINDOW = 300
+# Requests that may be sent back to back. Any window of CH_WINDOW seconds
+# then holds at most CH_BURST + rate * CH_WINDOW requests, so the refill
+# rate is set to keep that within CH_QUOTA.
+CH_BURST = 10
+# Longest wait between retries of one name; a full window always clears
+# the quota
+MAX_BACKOFF = CH_WINDOW
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all lookup workers.
+
+    Tokens refill continuously at rate per second up to capacity, so no
+    window of w seconds sees more than capacity + rate * w requests. The
+    defaults keep every CH_WINDOW window within CH_QUOTA, not just the
+    long-run average. pause() empties the bucket for a given time, e.g.
+    when the API answers 429 with a Retry-After header.
+    """
+
+    def __init__(self, rate=(CH_QUOTA - CH_BURST) / CH_WINDOW,
+                 capacity=CH_BURST):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens held (burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        """
+        Block until a token is available, then take it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.updated - now, 0) + \
+                    (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for the next `seconds` seconds
+
+        :param seconds: time to wait before the next request
+        """
+        with self.lock:
+            resume = time.monotonic() + seconds
+            if resume > self.updated:
+                self.tokens = 0
+                self.updated = resume
+
+
+def parse_search(comp_house_dict):
+    """
+    Pull the company number, address and incorporation date of the top
+    search result
+
+    :param comp_house_dict: json of a Companies House company search
+    :return: [company_number, address, inc_date], or None if no results
+    """
+    items = comp_house_dict.get('items') or []
+    if not items:
+        return None
+    top = items[0]
+    return [top['company_number'],
+            top.get('address_snippet', str('None')),
+            top.get('date_of_creation', '1000-01-01')]
+
+
+def retry_after(response, default):
+    """
+    Seconds to wait before retrying a throttled or failed request
+
+    :param response: the 429 or 5xx response
+    :param default: fallback if the response has no Retry-After header
+    """
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return default
+
+
+class CompaniesHouseLookup:
+    """
+    Concurrent Companies House search engine.
+
+    Up to max_workers searches run at once, all drawing from one
+    TokenBucket so that together they stay within the Companies House
+    quota. Throttled (429) names are retried after Retry-After, and names
+    that hit a server error (5xx) after an exponential backoff, rather
+    than dropped. Names still failing after max_retries are tried once
+    more at the end of lookup_many. With a ResponseCache, cached searches
+    (including negative results) are answered without an API call.
+    """
+
+    def __init__(self, search, bucket=None, max_workers=8, max_retries=10,
+                 backoff=5, cache=None, metrics=None):
+        """
+        :param search: chwrapper.Search instance
+        :param bucket: TokenBucket shared by the workers
+            (default: the Companies House quota)
+        :param max_workers: number of concurrent searches
+        :param max_retries: attempts per name after a 429, 5xx or network
+            error
+        :param backoff: first wait (seconds) after a 429 or 5xx without
+            Retry-After, doubled on every attempt
+        :param cache: optional org_cache.ResponseCache
+        :param metrics: optional metrics.RunMetrics recording request
+            latencies, throttled responses and retries
+        """
+        self.search = search
+        self.bucket = bucket or TokenBucket()
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.throttled = 0
+        # Names given up on after max_retries in the last lookup_many
+        self.failed = set()
+        # Guards throttled and failed, which every worker thread updates
+        self.lock = threading.Lock()
+        self.cache = cache
+        self.metrics = metrics
+
+    def lookup(self, word):
+        """
+        Search Companies House for a single org_string
+
+        :param word: org_string
+        :return: [company_number, address, inc_date] or None if not found
+            (or given up on, see failed)
+        """
+        if self.cache is not None:
+            items = self.cache.get(word)
+            if items is not None:
+                return parse_search({'items': items})
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.metrics is not None:
+                self.metrics.count('companies_house_retries')
+            self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.search.search_companies(word)
+                if self.metrics is not None:
+                    self.metrics.observe('companies_house',
+                                         time.perf_counter() - start)
+            except IOError as e:
+                logger.debug("Error requesting CH data: %s", e)
+                time.sleep(self.backoff)
+                continue
+            if response.status_code == 200:
+                comp_house_dict = response.json()
+                if self.cache is not None:
+                    self.cache.put(word, comp_house_dict.get('items') or [])
+                return parse_search(comp_house_dict)
+            elif response.status_code == 404:
+                logger.debug("Error requesting CH data: %s %s",
+                             response.status_code, response.reason)
+                if self.cache is not None:
+                    self.cache.put(word, [])
+                return None
+            elif response.status_code == 429:
+                with self.lock:
+                    self.throttled += 1
+                if self.metrics is not None:
+                    self.metrics.count('companies_house_429')
+                wait = retry_after(response, min(self.backoff * 2 ** attempt,
+                                                 MAX_BACKOFF))
+                logger.debug("CH throttled, waiting %ss", wait)
+                self.bucket.pause(wait)
+            elif response.status_code >= 500:
+                # Transient server errors; every worker backs off
+                if self.metrics is not None:
+                    self.metrics.count('companies_house_5xx')
+                wait = retry_after(response, min(self.backoff * 2 ** attempt,
+                                                 MAX_BACKOFF))
+                logger.debug("CH server error %s, waiting %ss",
+                             response.status_code, wait)
+                self.bucket.pause(wait)
+            else:
+                logger.error("Error requesting CH data: %s %s",
+                             response.status_code, response.reason)
+                return None
+        logger.error("Giving up on CH search for %s after %s attempts",
+                     word, self.max_retries + 1)
+        with self.lock:
+            self.failed.add(word)
+        return None
+
+    def lookup_many(self, org_strings, progress=True):
+        """
+        Search Companies House for every unique org_string concurrently.
+        Names given up on are searched once more after all the others,
+        and those failing again are left in failed.
+
+        :param org_strings: iterable of organisation names
+        :param progress: show a tqdm progress bar
+        :return ch_org_dict: dictionary of
+            org_string: [company_number, address, inc_date] for the
+            names that were found
+        """
+        unique_strings = list(dict.fromkeys(org_strings))
+        ch_org_dict = {}
+        self.failed = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for attempt in range(2):
+                if attempt:
+                    unique_strings = sorted(self.failed)
+                    if not unique_strings:
+                        break
+                    logger.warning("Searching %s failed org_strings again",
+                                   len(unique_strings))
+                    self.failed = set()
+                futures = {executor.submit(self.lookup, word): word
+                           for word in unique_strings}
+                for future in tqdm(as_completed(futures), total=len(futures),
+                                   disable=not progress):
+                    result = future.result()
+                    if result is not None:
+                        ch_org_dict[futures[future]] = result
+        if self.failed:
+            logger.error("%s org_strings could not be searched",
+                         len(self.failed))
+        return ch_org_dict
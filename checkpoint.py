@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from data_io import FORMATS, write_frame, read_frame
+
+
+def content_hash(path, extra=''):
+    """
+    sha1 of a file's contents (plus any extra run settings), used to make
+    sure a checkpoint is only ever resumed against the same input
+
+    :param path: input data file
+    :param extra: string of settings that also change the results
+    :return: sha1 hex digest
+    """
+    sha = hashlib.sha1(extra.encode())
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_stamp(path):
+    """
+    Cheap identity of a large file (path, size and modification time), for
+    settings files too big to hash on every run
+
+    :param path: file path ('' for none)
+    :return: string, '' if there is no such file
+    """
+    if not path or not os.path.exists(path):
+        return ''
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size,
+                             stat.st_mtime_ns)
+
+
+class RunCheckpoint:
+    """
+    Per-run directory of completed pipeline work.
+
+    Each stage saves its output for every finished row range (chunk) and
+    whole stages can be marked as done, all recorded in manifest.json. The
+    directory is named after the content hash of the input file, so a
+    checkpoint written for different data is never picked up by mistake.
+    Pipeline stages running in separate threads may save chunks at the
+    same time; manifest updates are serialised with a lock.
+    """
+
+    def __init__(self, run_root, data_path, settings='', resume=False,
+                 fmt='parquet'):
+        """
+        :param run_root: folder holding the run directories
+        :param data_path: the input data file
+        :param settings: string of settings that change the results
+            (e.g. chunk size), folded into the hash
+        :param resume: keep completed work from a previous run with the
+            same input; otherwise any earlier checkpoint is discarded
+        :param fmt: format of the saved chunks, one of data_io.FORMATS
+        """
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.input_hash = content_hash(data_path, settings)
+        name = os.path.splitext(os.path.basename(data_path))[0]
+        self.run_dir = os.path.join(run_root,
+                                    name + '_' + self.input_hash[:16])
+        self.manifest_path = os.path.join(self.run_dir, 'manifest.json')
+        self.manifest = None
+        if resume and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest.get('input_hash') != self.input_hash:
+                print("Checkpoint does not match input, starting afresh")
+                self.manifest = None
+            else:
+                print("\nResuming run from " + self.run_dir)
+        if self.manifest is None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            os.makedirs(self.run_dir)
+            self.manifest = {'input_hash': self.input_hash, 'chunks': {},
+                             'stages': [], 'meta': {}}
+            self._write_manifest()
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        # os.replace is atomic, so a crash never leaves a partial manifest
+        os.replace(tmp_path, self.manifest_path)
+
+    def _chunk_path(self, stage, index):
+        return os.path.join(self.run_dir, '{}_{:06d}'.format(stage, index))
+
+    def chunk_done(self, stage, index):
+        with self.lock:
+            return index in self.manifest['chunks'].get(stage, [])
+
+    def save_chunk(self, stage, index, df):
+        """
+        Save the output of a stage for one row range
+
+        :param stage: name of the stage (e.g. 'map_columns')
+        :param index: position of the chunk in the input
+        :param df: the stage's output for that chunk
+        """
+        write_frame(df, self._chunk_path(stage, index), self.fmt)
+        with self.lock:
+            self.manifest['chunks'].setdefault(stage, []).append(index)
+            self._write_manifest()
+
+    def load_chunk(self, stage, index):
+        path = self._chunk_path(stage, index) + FORMATS[self.fmt]
+        return read_frame(path, index_col=0)
+
+    def stage_done(self, stage):
+        return stage in self.manifest['stages']
+
+    def mark_stage_done(self, stage, **meta):
+        """
+        Record that a whole stage has finished
+
+        :param stage: name of the stage
+        :param meta: values needed to skip the stage on resume
+            (e.g. the output file name)
+        """
+        with self.lock:
+            self.manifest['stages'].append(stage)
+            self.manifest['meta'].update(meta)
+            self._write_manifest()
+
+    def meta(self, key):
+        return self.manifest['meta'].get(key)
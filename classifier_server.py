@@ -0,0 +1,186 @@
+"""
+Batch HTTP server for the orgtype-classifier model.
+
+    python classifier_server.py orgtype-classifier/model.pkl.gz --workers 4
+
+GET /predict?q=...&q=... answers like the orgtype-classifier's server.py,
+with a JSON object of org_string: org_type. POST /predict takes a JSON
+array of org_strings (gzip compressed if sent with Content-Encoding: gzip)
+and returns a JSON array of their org_types in the same order, so batches
+of thousands of names are not limited by the URL length.
+
+With --workers N the model is loaded once and N processes are forked to
+serve the same listening socket, sharing the loaded model copy-on-write,
+so throughput scales with the number of cores.
+"""
+import argparse
+import gzip
+import json
+import os
+import pickle
+import signal
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# Largest request body accepted (bytes, after decompression)
+MAX_BODY = 64 * 1024 * 1024
+# Responses larger than this are gzipped for clients that accept it
+GZIP_MIN_BYTES = 1024
+
+
+def load_model(model_path):
+    """
+    :param model_path: gzipped pickle of the trained model
+    :return: the model
+    """
+    with gzip.open(model_path, 'rb') as f:
+        return pickle.load(f)
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    """
+    Handles /predict requests with the model of the server
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/predict':
+            return self.send_json(404, {'error': 'not found'})
+        org_strings = parse_qs(url.query).get('q', [])
+        org_types = self.predict(org_strings)
+        self.send_json(200, dict(zip(org_strings, org_types)))
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/predict':
+            return self.send_json(404, {'error': 'not found'})
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            return self.send_json(413, {'error': 'request too large'})
+        body = self.rfile.read(length)
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+                if len(body) > MAX_BODY:
+                    return self.send_json(413, {'error': 'request too large'})
+            org_strings = json.loads(body.decode('utf-8'))
+        except (OSError, ValueError) as e:
+            return self.send_json(400, {'error': str(e)})
+        if not isinstance(org_strings, list):
+            return self.send_json(400, {'error': 'expected a JSON array'})
+        self.send_json(200, self.predict([str(word) for word
+                                          in org_strings]))
+
+    def predict(self, org_strings):
+        if not org_strings:
+            return []
+        return self.server.model.predict(np.array(org_strings,
+                                                  dtype=object)).tolist()
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        gzipped = (len(data) >= GZIP_MIN_BYTES and
+                   'gzip' in self.headers.get('Accept-Encoding', ''))
+        if gzipped:
+            data = gzip.compress(data, compresslevel=1)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(model, host='127.0.0.1', port=8080):
+    """
+    :param model: object with a predict method taking an array of strings
+    :param host: interface to listen on
+    :param port: port to listen on (0 for any free port)
+    :return: HTTPServer, not yet serving
+    """
+    server = HTTPServer((host, port), PredictHandler)
+    server.model = model
+    return server
+
+
+def serve(model_path, host='127.0.0.1', port=8080, workers=1):
+    """
+    Load the model and serve predictions until interrupted
+
+    :param model_path: gzipped pickle of the trained model
+    :param host: interface to listen on
+    :param port: port to listen on
+    :param workers: number of pre-forked server processes (platforms
+        without fork always use one)
+    """
+    server = make_server(load_model(model_path), host, port)
+    if workers <= 1 or not hasattr(os, 'fork'):
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    # Idle workers all wait on the socket; the ones that lose the race
+    # for a connection get EAGAIN (ignored by socketserver) rather than
+    # blocking in accept
+    server.socket.setblocking(False)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+    server.server_close()
+
+
+def get_input_args():
+    """
+    Assign arguments including defaults to pass to the python call
+
+    :return: arguments variable
+    """
+    parser = argparse.ArgumentParser(description="orgtype-classifier server")
+    parser.add_argument('model', type=str,
+                        help="gzipped pickle of the trained model")
+    parser.add_argument('--host', default='127.0.0.1', type=str,
+                        help="interface to listen on")
+    parser.add_argument('--port', default=8080, type=int,
+                        help="port to listen on")
+    parser.add_argument('--workers', default=os.cpu_count() or 1, type=int,
+                        help="number of server processes (default: cores)")
+    return parser.parse_args()
+
+
+# ---------------------------------------------------------------
+if __name__ == '__main__':
+    in_arg = get_input_args()
+    # Models pickled alongside their own modules (e.g. in the
+    # orgtype-classifier checkout) are loaded from the working directory
+    sys.path.insert(0, os.getcwd())
+    serve(in_arg.model, in_arg.host, in_arg.port, in_arg.workers)
@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+
+# Formats for intermediate files passed between pipeline stages. CSV is
+# kept for anything read by people or by csvdedupe.
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def write_frame(df, path, fmt='csv'):
+    """
+    Write a dataframe in the given format. Parquet and Arrow keep the
+    dtypes and the index, so no 'Unnamed' column appears when reading back.
+
+    :param df: pandas dataframe
+    :param path: file path without extension
+    :param fmt: one of FORMATS
+    :return: the full path written
+    """
+    path += FORMATS[fmt]
+    if fmt == 'csv':
+        df.to_csv(path)
+    elif fmt == 'parquet':
+        df.to_parquet(path)
+    else:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df)
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return path
+
+
+def read_frame(path, index_col=None):
+    """
+    Read a dataframe written by write_frame (or any csv), choosing the
+    format from the file extension. Parquet and Arrow files are memory
+    mapped rather than parsed.
+
+    :param path: full file path
+    :param index_col: for csv files, the column holding the index
+        (0 for csv files written by write_frame)
+    :return df: pandas dataframe
+    """
+    ext = os.path.splitext(path)[1]
+    if ext == FORMATS['parquet']:
+        return pd.read_parquet(path, memory_map=True)
+    elif ext == FORMATS['arrow']:
+        import pyarrow as pa
+        with pa.memory_map(path, 'r') as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    return pd.read_csv(path, index_col=index_col)
+
+
+def compact_frame(df, columns, max_ratio=0.5):
+    """
+    Store repetitive string columns as categoricals, so each distinct value
+    is held once rather than once per row. Columns with more than
+    max_ratio distinct values per row are left alone, as are missing ones.
+
+    :param df: pandas dataframe
+    :param columns: names of the columns to consider
+    :param max_ratio: highest share of distinct values worth converting
+    :return df: pandas dataframe
+    """
+    for col in columns:
+        if col not in df.columns or df[col].dtype.name == 'category':
+            continue
+        if df[col].nunique() <= max_ratio * len(df):
+            df[col] = df[col].astype('category')
+    return df
@@ -0,0 +1,420 @@
+import os
+import random
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import dedupe
+import pandas as pd
+
+# Learned settings only load in the dedupe version that wrote them
+SETTINGS_KIND = 'dedupe-' + str(getattr(dedupe, '__version__', ''))
+
+
+def pre_process(value):
+    """
+    Clean a field the way csvdedupe does before comparing it: lower case,
+    no quotes or repeated whitespace, and None for blanks
+
+    :param value: field value
+    :return: cleaned string or None
+    """
+    if pd.isnull(value):
+        return None
+    value = re.sub(r'\s+', ' ', str(value)).strip().strip('"\'').lower()
+    return value or None
+
+
+def to_records(df, fields):
+    """
+    Convert the relevant dataframe columns to the {record_id: record} dict
+    dedupe expects, keyed by the dataframe index
+
+    :param df: pandas dataframe
+    :param fields: names of the columns to compare
+    :return data_d: dictionary of index: {field: cleaned value}
+    """
+    # Built as lists rather than with Series.map, which would turn the
+    # None dedupe expects for missing values back into NaN
+    cleaned = [[pre_process(value) for value in df[field]]
+               for field in fields]
+    return {idx: dict(zip(fields, values))
+            for idx, values in zip(df.index, zip(*cleaned))}
+
+
+def variable_definition(fields):
+    """
+    :param fields: names of the fields to compare
+    :return: dedupe variable definition comparing them as strings
+    """
+    return [{'field': field, 'type': 'String', 'has missing': True}
+            for field in fields]
+
+
+def _settings_kind(gazetteer):
+    return ('gazetteer-' if gazetteer else '') + SETTINGS_KIND
+
+
+def register_settings(registry, fields, settings_file, training_file=None,
+                      gazetteer=False):
+    """
+    Add learned settings to a settings registry, if one is given
+
+    :param registry: settings_registry.SettingsRegistry or None
+    :param fields: names of the fields compared
+    :param settings_file: learned settings file
+    :param training_file: training data the settings were learned from
+    :param gazetteer: whether these are gazetteer settings
+    """
+    if registry is not None:
+        registry.publish(variable_definition(fields), settings_file,
+                         training_file, _settings_kind(gazetteer),
+                         source=os.path.dirname(os.path.abspath(
+                             settings_file)))
+
+
+def train_deduper(data_d, fields, training_file=None, settings_file=None,
+                  sample_size=1500, interactive=True, canonical_d=None,
+                  registry=None):
+    """
+    Load a deduper from learned settings if they exist, otherwise train one
+    (reusing any existing training data and asking the user to label more)
+    and save its settings and training data for next time. With
+    canonical_d a gazetteer is trained instead, to link data_d records to
+    canonical_d ones. With a settings registry, settings registered for
+    the same fields are used when the project has none of its own, and
+    the project's settings are registered for other projects.
+
+    :param data_d: records from to_records
+    :param fields: names of the fields to compare
+    :param training_file: json file of labelled pairs
+    :param settings_file: learned settings file
+    :param sample_size: number of record pairs sampled for active learning
+    :param interactive: ask the user to label pairs; if False, training
+        uses the existing training data only
+    :param canonical_d: records of the reference set for a gazetteer
+    :param registry: optional settings_registry.SettingsRegistry
+    :return deduper: a trained dedupe.Dedupe or dedupe.StaticDedupe (or
+        dedupe.Gazetteer or dedupe.StaticGazetteer)
+    """
+    gazetteer = canonical_d is not None
+    variables = variable_definition(fields)
+    if registry is not None and settings_file:
+        registry.checkout(variables, settings_file, training_file,
+                          _settings_kind(gazetteer))
+    if settings_file and os.path.exists(settings_file):
+        register_settings(registry, fields, settings_file, training_file,
+                          gazetteer)
+        print("Reading learned settings from " + settings_file)
+        with open(settings_file, 'rb') as f:
+            if gazetteer:
+                return dedupe.StaticGazetteer(f)
+            return dedupe.StaticDedupe(f)
+    have_training = training_file and os.path.exists(training_file)
+    if not interactive and not have_training:
+        raise RuntimeError("No learned settings or training data to dedupe "
+                           "with, and labelling is disabled")
+
+    if gazetteer:
+        deduper = dedupe.Gazetteer(variables)
+        deduper.sample(data_d, canonical_d, sample_size)
+    else:
+        deduper = dedupe.Dedupe(variables)
+        deduper.sample(data_d, sample_size)
+    if have_training:
+        print("Reading labeled examples from " + training_file)
+        with open(training_file) as f:
+            deduper.readTraining(f)
+    if interactive:
+        print("Starting active labeling...")
+        dedupe.consoleLabel(deduper)
+    deduper.train()
+    if training_file:
+        with open(training_file, 'w') as f:
+            deduper.writeTraining(f)
+    if settings_file:
+        with open(settings_file, 'wb') as f:
+            deduper.writeSettings(f)
+        register_settings(registry, fields, settings_file, training_file,
+                          gazetteer)
+    return deduper
+
+
+def dedupe_df(df, fields, training_file=None, settings_file=None,
+              deduper=None, recall_weight=1, interactive=True,
+              registry=None):
+    """
+    Cluster possible duplicates in an in-memory dataframe with the dedupe
+    library, adding the same 'Cluster ID' and 'Confidence Score' columns
+    csvdedupe writes. Records not in any cluster get a cluster of their own
+    and a blank confidence score.
+
+    :param df: pandas dataframe
+    :param fields: names of the columns to compare
+    :param training_file: json file of labelled pairs
+    :param settings_file: learned settings file
+    :param deduper: an already-trained deduper to use instead of loading or
+        training one
+    :param recall_weight: weighting of recall against precision when
+        choosing the clustering threshold
+    :param interactive: see train_deduper
+    :param registry: see train_deduper
+    :return df: pandas dataframe
+    """
+    data_d = to_records(df, fields)
+    if deduper is None:
+        deduper = train_deduper(data_d, fields, training_file, settings_file,
+                                interactive=interactive, registry=registry)
+    threshold = deduper.threshold(data_d, recall_weight=recall_weight)
+    print("Clustering...")
+    clustered_dupes = deduper.match(data_d, threshold)
+    print("# duplicate sets {}".format(len(clustered_dupes)))
+
+    cluster_ids = {}
+    confidences = {}
+    for cluster_id, (record_ids, scores) in enumerate(clustered_dupes):
+        for record_id, score in zip(record_ids, scores):
+            cluster_ids[record_id] = cluster_id
+            confidences[record_id] = score
+    return assign_clusters(df, cluster_ids, confidences)
+
+
+def assign_clusters(df, cluster_ids, confidences):
+    """
+    Add 'Cluster ID' and 'Confidence Score' columns from per-record
+    results. Records not in any cluster get a cluster of their own and a
+    blank confidence score.
+
+    :param df: pandas dataframe
+    :param cluster_ids: dictionary of index: cluster number (0, 1, ...)
+    :param confidences: dictionary of index: confidence score
+    :return df: pandas dataframe
+    """
+    n_clusters = len(set(cluster_ids.values()))
+    df['Cluster ID'] = df.index.map(cluster_ids)
+    df['Confidence Score'] = df.index.map(confidences).astype(float)
+    singletons = df['Cluster ID'].isnull()
+    df.loc[singletons, 'Cluster ID'] = range(n_clusters,
+                                             n_clusters + singletons.sum())
+    df['Cluster ID'] = df['Cluster ID'].astype(int)
+    return df
+
+
+class UnionFind:
+    """
+    Disjoint-set forest used to merge clusters found in different shards
+    that share a record
+    """
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        # Path compression
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+
+def shard_records(df, data_d, block_cols, n_shards):
+    """
+    Partition records into shards by blocking key. Each (column, prefix
+    length) pair in block_cols gives a record one key (records blank in
+    that column are skipped), and every key is hashed to a shard, so a
+    record can sit in more than one shard.
+
+    :param df: pandas dataframe
+    :param data_d: records from to_records
+    :param block_cols: list of (column, prefix length) pairs; a prefix
+        length of None uses the whole value
+    :param n_shards: number of shards
+    :return: list of non-empty {record_id: record} dicts
+    """
+    shards = [{} for _ in range(n_shards)]
+    for col, prefix_len in block_cols:
+        keys = df[col].dropna().astype(str)
+        if prefix_len:
+            keys = keys.str[:prefix_len]
+        for idx, key in keys.items():
+            shard = zlib.crc32((col + '|' + key).encode()) % n_shards
+            shards[shard][idx] = data_d[idx]
+    return [shard for shard in shards if shard]
+
+
+def _match_shard(args):
+    settings_file, shard, threshold = args
+    if len(shard) < 2:
+        return []
+    with open(settings_file, 'rb') as f:
+        deduper = dedupe.StaticDedupe(f, num_cores=1)
+    return [(tuple(ids), list(scores))
+            for ids, scores in deduper.match(shard, threshold)]
+
+
+def merge_shard_clusters(shard_clusters):
+    """
+    Merge the clusters found in different shards: clusters sharing a
+    record become one cluster, and each record keeps its highest
+    confidence score
+
+    :param shard_clusters: iterable of each shard's list of
+        (record_ids, scores) clusters
+    :return cluster_ids: dictionary of record_id: cluster number
+        (0, 1, ...)
+    :return confidences: dictionary of record_id: confidence score
+    """
+    uf = UnionFind()
+    confidences = {}
+    for clusters in shard_clusters:
+        for record_ids, scores in clusters:
+            for record_id, score in zip(record_ids, scores):
+                uf.union(record_ids[0], record_id)
+                confidences[record_id] = max(
+                    score, confidences.get(record_id, score))
+
+    roots = {}
+    cluster_ids = {record_id: roots.setdefault(uf.find(record_id),
+                                               len(roots))
+                   for record_id in confidences}
+    return cluster_ids, confidences
+
+
+def dedupe_sharded(df, fields, block_cols, settings_file, training_file=None,
+                   n_shards=None, max_workers=None, recall_weight=1,
+                   interactive=True, registry=None, threshold_sample=50000):
+    """
+    Multi-core version of dedupe_df. Records are split into shards by
+    blocking key (see shard_records) and each shard is clustered in its
+    own process from the learned settings, with one clustering threshold
+    chosen for the whole file. Clusters from different shards that share
+    a record are then merged (see merge_shard_clusters).
+
+    :param df: pandas dataframe
+    :param fields: names of the columns to compare
+    :param block_cols: list of (column, prefix length) blocking keys
+    :param settings_file: learned settings file, trained first (on the
+        whole file) if it does not exist yet
+    :param training_file: json file of labelled pairs
+    :param n_shards: number of shards (default: 4 per worker)
+    :param max_workers: number of processes (default: number of cores)
+    :param recall_weight: weighting of recall against precision when
+        choosing the clustering threshold
+    :param interactive: see train_deduper
+    :param registry: see train_deduper
+    :param threshold_sample: number of records, picked at random, on which
+        the threshold is chosen
+    :return df: pandas dataframe
+    """
+    data_d = to_records(df, fields)
+    deduper = train_deduper(data_d, fields, training_file, settings_file,
+                            interactive=interactive, registry=registry)
+    # Chosen once rather than per shard, so that whether two records are
+    # clustered does not depend on which other records share their shard
+    sample_ids = random.Random(0).sample(list(data_d), min(threshold_sample,
+                                                           len(data_d)))
+    threshold = deduper.threshold({idx: data_d[idx] for idx in sample_ids},
+                                  recall_weight=recall_weight)
+    max_workers = max_workers or os.cpu_count()
+    shards = shard_records(df, data_d, block_cols,
+                           n_shards or 4 * max_workers)
+    print("Clustering {} shards on {} cores...".format(len(shards),
+                                                      max_workers))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        jobs = [(settings_file, shard, threshold) for shard in shards]
+        cluster_ids, confidences = merge_shard_clusters(
+            executor.map(_match_shard, jobs))
+    print("# duplicate sets {}".format(len(set(cluster_ids.values()))))
+    return assign_clusters(df, cluster_ids, confidences)
+
+
+def dedupe_incremental(df, fields, settings_file, gazetteer_settings_file,
+                       training_file=None, threshold=0.5, interactive=True,
+                       registry=None, gazetteer=None, deduper=None):
+    """
+    Cluster only the rows of df that have no 'Cluster ID' yet, keeping the
+    clusters of the rest (e.g. rows carried over unchanged from an earlier
+    run). New rows are first linked, gazetteer style, to their best match
+    among the clustered rows and join its cluster, with the link score as
+    their confidence. The rows left over are clustered among themselves
+    (see dedupe_df) into new clusters numbered after the existing ones.
+    Record pairs are only scored for new rows, but the distinct clustered
+    records are blocked (gazetteer.index) again on every run, which takes
+    time linear in their number.
+
+    :param df: pandas dataframe, with 'Cluster ID' and 'Confidence Score'
+        blank for the new rows
+    :param fields: names of the columns to compare
+    :param settings_file: learned settings file of the deduper
+    :param gazetteer_settings_file: learned settings file of the
+        gazetteer, trained from training_file if it does not exist yet
+    :param training_file: json file of labelled pairs
+    :param threshold: lowest link score accepted as a match
+    :param interactive: see train_deduper
+    :param registry: see train_deduper
+    :param gazetteer: an already-trained gazetteer to use instead of
+        loading or training one
+    :param deduper: an already-trained deduper for the rows left over
+    :return df: pandas dataframe
+    """
+    new = df['Cluster ID'].isnull()
+    if not new.any():
+        return df
+    reference = df[~new].drop_duplicates(subset=fields + ['Cluster ID'])
+    delta = df[new].copy()
+    print("Linking {} new rows to {} existing clusters...".format(
+        len(delta), reference['Cluster ID'].nunique()))
+
+    cluster_ids = {}
+    confidences = {}
+    if len(reference):
+        messy_d = to_records(delta, fields)
+        # Canonical records get keys of their own, after the delta's
+        offset = int(max(df.index)) + 1
+        canonical_d = {offset + i: record for i, record in
+                       enumerate(to_records(reference, fields).values())}
+        reference_ids = dict(zip(canonical_d, reference['Cluster ID']))
+        if gazetteer is None:
+            gazetteer = train_deduper(messy_d, fields, training_file,
+                                      gazetteer_settings_file,
+                                      interactive=interactive,
+                                      canonical_d=canonical_d,
+                                      registry=registry)
+        gazetteer.index(canonical_d)
+        for matches in gazetteer.match(messy_d, threshold=threshold,
+                                       n_matches=1):
+            for (messy_id, canonical_id), score in matches:
+                cluster_ids[messy_id] = reference_ids[canonical_id]
+                confidences[messy_id] = score
+    delta['Cluster ID'] = delta.index.map(cluster_ids)
+    delta['Confidence Score'] = delta.index.map(confidences).astype(float)
+    print("# rows linked to existing clusters {}".format(len(cluster_ids)))
+
+    unlinked = delta['Cluster ID'].isnull()
+    if unlinked.any():
+        first_id = int(reference['Cluster ID'].max()) + 1 \
+            if len(reference) else 0
+        rest = delta[unlinked].drop(columns=['Cluster ID',
+                                             'Confidence Score'])
+        if len(rest) > 1:
+            rest = dedupe_df(rest, fields, training_file, settings_file,
+                             deduper=deduper, interactive=interactive,
+                             registry=registry)
+        else:
+            rest = assign_clusters(rest, {}, {})
+        rest['Cluster ID'] += first_id
+        delta.loc[unlinked, 'Cluster ID'] = rest['Cluster ID']
+        delta.loc[unlinked, 'Confidence Score'] = rest['Confidence Score']
+
+    df.loc[new, 'Cluster ID'] = delta['Cluster ID']
+    df.loc[new, 'Confidence Score'] = delta['Confidence Score']
+    df['Cluster ID'] = df['Cluster ID'].astype(int)
+    return df
@@ -0,0 +1,113 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from normalise import canonical_name
+
+
+class FuzzyIndex:
+    """
+    Candidate-retrieval index over registry names for fuzzy matching.
+
+    Names are turned into sparse TF-IDF vectors of character n-grams (on
+    their canonical form) once, when the index is built, and stored in
+    slices of at most part_size names. Queries are vectorised the same way
+    and scored a block of queries against one slice at a time with a
+    sparse matrix product, keeping only the running top k cosine
+    similarities for each query. Common n-grams match a large share of a
+    big registry, so the product is never taken against the whole of it:
+    its size is bounded by block_size x part_size.
+    """
+
+    def __init__(self, names, ngram_range=(3, 3), part_size=50000):
+        """
+        :param names: registry organisation names to index
+        :param ngram_range: character n-gram lengths used
+        :param part_size: number of registry names per slice
+        """
+        self.names = np.asarray(list(names), dtype=object)
+        self.vectorizer = TfidfVectorizer(analyzer='char_wb',
+                                          ngram_range=ngram_range,
+                                          preprocessor=canonical_name,
+                                          sublinear_tf=True,
+                                          dtype=np.float32)
+        # Rows are L2 normalised, so dot products are cosine similarities
+        self._split(self.vectorizer.fit_transform(self.names), part_size)
+
+    def _split(self, matrix, part_size):
+        """
+        :param matrix: names x n-grams csr matrix
+        :param part_size: number of names per slice
+        """
+        self.offsets = list(range(0, matrix.shape[0], part_size)) or [0]
+        self.parts = [matrix[lo:lo + part_size].T.tocsr()
+                      for lo in self.offsets]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def query(self, org_strings, k=5, min_score=0.0, block_size=200):
+        """
+        Find the k most similar registry names for each org_string
+
+        :param org_strings: iterable of organisation names
+        :param k: number of candidates kept per name
+        :param min_score: candidates scoring below this are dropped
+        :param block_size: number of queries scored per sparse product
+        :return: dataframe of org_string, candidate, score and rank
+            (0 = best), best first for each org_string
+        """
+        org_strings = list(org_strings)
+        rows = []
+        for start in range(0, len(org_strings), block_size):
+            block = org_strings[start:start + block_size]
+            vectors = self.vectorizer.transform(block)
+            best_scores = [None] * len(block)
+            best_cols = [None] * len(block)
+            for offset, part in zip(self.offsets, self.parts):
+                sims = vectors.dot(part).tocsr()
+                if min_score > 0:
+                    sims.data[sims.data < min_score] = 0
+                    sims.eliminate_zeros()
+                for i in np.flatnonzero(np.diff(sims.indptr)):
+                    lo, hi = sims.indptr[i], sims.indptr[i + 1]
+                    scores = sims.data[lo:hi]
+                    cols = sims.indices[lo:hi] + offset
+                    if best_scores[i] is not None:
+                        scores = np.concatenate([best_scores[i], scores])
+                        cols = np.concatenate([best_cols[i], cols])
+                    if len(scores) > k:
+                        top = np.argpartition(-scores, k)[:k]
+                        scores, cols = scores[top], cols[top]
+                    best_scores[i], best_cols[i] = scores, cols
+            for i, word in enumerate(block):
+                scores, cols = best_scores[i], best_cols[i]
+                if scores is None:
+                    continue
+                for rank, j in enumerate(np.argsort(-scores, kind='stable')):
+                    if scores[j] < min_score:
+                        break
+                    rows.append((word, self.names[cols[j]],
+                                 float(scores[j]), rank))
+        return pd.DataFrame(rows, columns=['org_string', 'candidate',
+                                           'score', 'rank'])
+
+    def best_matches(self, org_strings, min_score=0.9, block_size=200):
+        """
+        :param org_strings: iterable of organisation names
+        :param min_score: lowest similarity accepted as a match
+        :param block_size: number of queries scored per sparse product
+        :return: dictionary of org_string: best registry name, for the
+            org_strings with a candidate scoring at least min_score
+        """
+        candidates = self.query(org_strings, k=1, min_score=min_score,
+                                block_size=block_size)
+        return dict(zip(candidates['org_string'], candidates['candidate']))
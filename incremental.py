@@ -0,0 +1,44 @@
+import pandas as pd
+
+
+def row_hashes(df, columns):
+    """
+    64-bit hash of the content of each row, over the given columns. Values
+    are hashed as strings, so a file read back from csv or parquet hashes
+    the same as when it was written.
+
+    :param df: pandas dataframe
+    :param columns: names of the columns making up a row's content
+    :return: Series of uint64 aligned with df
+    """
+    return pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+
+
+def split_delta(df, previous, columns):
+    """
+    Split the rows of a data file into those already processed by an
+    earlier run, identified by their content hash, and the new or changed
+    ones. Unchanged rows take the earlier run's output row (with its
+    'Cluster ID', 'Confidence Score' and any other added columns).
+
+    :param df: pandas dataframe of the data file
+    :param previous: output of the earlier run (e.g. the '_deduped' or
+        '_idexpanded' file), which kept the data file's columns
+    :param columns: names of the data file columns to compare
+    :return unchanged: earlier output rows of the unchanged rows, indexed
+        like df
+    :return delta: rows of df that are new or changed
+    """
+    missing = [col for col in columns if col not in previous.columns]
+    if missing:
+        raise ValueError("Previous output has no column(s) {}; was it made "
+                         "from this data file?".format(', '.join(missing)))
+    hashes = row_hashes(df, columns)
+    previous = previous.set_index(row_hashes(previous, columns).values)
+    previous = previous[~previous.index.duplicated()]
+    seen = hashes.isin(previous.index)
+    unchanged = previous.loc[hashes[seen].values]
+    unchanged.index = df.index[seen]
+    print("\n{} unchanged rows, {} new or changed rows".format(
+        seen.sum(), (~seen).sum()))
+    return unchanged, df[~seen]
@@ -0,0 +1,228 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of this process in bytes, or None
+        where the resource module is unavailable
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram, in the cumulative form Prometheus uses
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """
+        :param q: quantile between 0 and 1
+        :return: upper bound of the bucket holding the quantile (None if it
+            is above the last bucket or nothing was observed)
+        """
+        if not self.count:
+            return None
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= q * self.count:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum_seconds': round(self.sum, 6),
+                'mean_seconds': (round(self.sum / self.count, 6)
+                                 if self.count else None),
+                'p50_seconds': self.quantile(0.5),
+                'p95_seconds': self.quantile(0.95),
+                'p99_seconds': self.quantile(0.99),
+                'buckets': dict(zip((str(b) for b in self.buckets),
+                                    self.counts))}
+
+
+class RunMetrics:
+    """
+    Thread-safe collector of the measurements of one pipeline run.
+
+    Stages are timed with the stage() context manager; calls for the same
+    stage (e.g. once per chunk) add up. API clients record the latency of
+    each request with observe() and events such as 429 responses and
+    retries with count(). Cache hit ratios are set at the end of the run
+    with cache_stats(). The result is written with write_json() and,
+    for a Prometheus node_exporter textfile collector, write_prometheus().
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.histograms = {}
+        self.counters = {}
+        self.caches = {}
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        """
+        Time the enclosed block as (part of) stage `name`
+
+        :param name: stage name
+        :param rows: number of rows the block processes
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                stage = self.stages.setdefault(name, {'seconds': 0.0,
+                                                      'rows': 0, 'calls': 0})
+                stage['seconds'] += seconds
+                stage['rows'] += rows
+                stage['calls'] += 1
+
+    def observe(self, name, seconds):
+        """
+        Record the latency of one request to service `name`
+        """
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    def count(self, name, n=1):
+        """
+        Add n to counter `name`, e.g. 'companies_house_429'
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def cache_stats(self, name, hits, misses):
+        """
+        Record the hit and miss totals of cache `name`
+        """
+        with self.lock:
+            self.caches[name] = {'hits': hits, 'misses': misses}
+
+    def report(self):
+        """
+        :return: dictionary of everything measured so far
+        """
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stages[name] = dict(stage, seconds=round(stage['seconds'], 4))
+                if stage['rows'] and stage['seconds']:
+                    stages[name]['rows_per_s'] = round(
+                        stage['rows'] / stage['seconds'], 1)
+            caches = {}
+            for name, cache in self.caches.items():
+                total = cache['hits'] + cache['misses']
+                caches[name] = dict(cache, hit_ratio=(
+                    round(cache['hits'] / total, 4) if total else None))
+            return {'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                             time.localtime(self.started)),
+                    'wall_seconds': round(time.time() - self.started, 3),
+                    'peak_rss_bytes': peak_rss(),
+                    'stages': stages,
+                    'requests': {name: hist.to_dict() for name, hist
+                                 in self.histograms.items()},
+                    'counters': dict(self.counters),
+                    'caches': caches}
+
+    def write_json(self, path):
+        """
+        Write the run report as JSON
+
+        :param path: output file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        print("\nRun report saved to : " + path)
+
+    def write_prometheus(self, path, prefix='orgmatch'):
+        """
+        Write the measurements in the Prometheus text exposition format.
+        The file is replaced atomically, as the textfile collector
+        requires.
+
+        :param path: output file, normally ending in .prom
+        :param prefix: metric name prefix
+        """
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for labels, value in samples:
+                lines.append('{}_{}{} {}'.format(prefix, name, labels, value))
+
+        metric('stage_seconds', 'gauge', 'Wall time spent in each stage.',
+               [('{{stage="{}"}}'.format(name), stage['seconds'])
+                for name, stage in report['stages'].items()])
+        metric('stage_rows', 'gauge', 'Rows processed by each stage.',
+               [('{{stage="{}"}}'.format(name), stage['rows'])
+                for name, stage in report['stages'].items()])
+        samples = []
+        with self.lock:
+            for name, hist in self.histograms.items():
+                for bound, count in zip(hist.buckets, hist.counts):
+                    samples.append(('_bucket{{service="{}",le="{}"}}'
+                                    .format(name, bound), count))
+                samples.append(('_bucket{{service="{}",le="+Inf"}}'
+                                .format(name), hist.count))
+                samples.append(('_sum{{service="{}"}}'.format(name),
+                                hist.sum))
+                samples.append(('_count{{service="{}"}}'.format(name),
+                                hist.count))
+        metric('request_seconds', 'histogram',
+               'Latency of requests to external services.', samples)
+        metric('events_total', 'counter',
+               'Throttled responses, retries and other events.',
+               [('{{event="{}"}}'.format(name), value)
+                for name, value in report['counters'].items()])
+        metric('cache_hit_ratio', 'gauge', 'Share of lookups found in cache.',
+               [('{{cache="{}"}}'.format(name), cache['hit_ratio'])
+                for name, cache in report['caches'].items()
+                if cache['hit_ratio'] is not None])
+        if report['peak_rss_bytes'] is not None:
+            metric('peak_rss_bytes', 'gauge', 'Peak resident set size.',
+                   [('', report['peak_rss_bytes'])])
+        metric('run_wall_seconds', 'gauge', 'Wall time of the run so far.',
+               [('', report['wall_seconds'])])
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+        print("Prometheus metrics saved to : " + path)
@@ -0,0 +1,88 @@
+import re
+import unicodedata
+
+# Legal-form endings folded to one spelling. Only applied at the end of a
+# name, longest first, after punctuation has been removed.
+LEGAL_SUFFIXES = [
+    ('public limited company', 'plc'),
+    ('limited liability partnership', 'llp'),
+    ('community interest company', 'cic'),
+    ('societa a responsabilita limitata', 'srl'),
+    ('societa per azioni', 'spa'),
+    ('societa in nome collettivo', 'snc'),
+    ('societa in accomandita semplice', 'sas'),
+    ('limited', 'ltd'),
+    ('incorporated', 'inc'),
+    ('corporation', 'corp'),
+    ('company', 'co'),
+    ('s r l', 'srl'),
+    ('s p a', 'spa'),
+    ('s n c', 'snc'),
+    ('s a s', 'sas'),
+]
+SUFFIX_RE = [(re.compile(r'(^|\s)' + suffix + r'$'), r'\1' + short)
+             for suffix, short in LEGAL_SUFFIXES]
+APOSTROPHE_RE = re.compile("['\u2019]")
+PUNCT_RE = re.compile(r'[^\w\s]')
+SPACE_RE = re.compile(r'\s+')
+
+
+def canonical_name(name):
+    """
+    Canonical form of an organisation name, so that variants such as
+    "ACME LTD", "Acme Limited" and "acme ltd." share one key: accents
+    removed, case-folded, '&' read as 'and', punctuation dropped,
+    whitespace collapsed and the legal-form suffix folded
+
+    :param name: organisation name
+    :return: canonical key ('' for blanks)
+    """
+    if name is None or name != name:
+        return ''
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    name = name.casefold().replace('&', ' and ')
+    # "s.r.l." -> "s r l" -> folded to "srl" below
+    name = APOSTROPHE_RE.sub('', name)
+    name = PUNCT_RE.sub(' ', name).replace('_', ' ')
+    name = SPACE_RE.sub(' ', name).strip()
+    for pattern, short in SUFFIX_RE:
+        folded = pattern.sub(short, name)
+        if folded != name:
+            return folded
+    return name
+
+
+def add_org_key(df, string_col='org_string', key_col='org_key'):
+    """
+    Add the canonical key column to df if it is not there already
+
+    :param df: pandas dataframe
+    :param string_col: column containing the organisation name
+    :param key_col: name of the key column
+    :return df: pandas dataframe
+    """
+    if key_col not in df.columns:
+        df[key_col] = df[string_col].map(canonical_name)
+    return df
+
+
+def per_key(df, func, string_col='org_string', key_col='org_key'):
+    """
+    Run an external lookup once per unique canonical key. The first
+    org_string seen for each key is sent as its representative, and the
+    results come back keyed by canonical key, ready to be fanned out to
+    every row with df[key_col].map(...)
+
+    :param df: pandas dataframe with key_col (see add_org_key)
+    :param func: function taking a list of org_strings and returning a
+        dictionary of org_string: result
+    :param string_col: column containing the organisation name
+    :param key_col: name of the key column
+    :return: dictionary of key: result for the keys func returned
+    """
+    reps = df.drop_duplicates(subset=key_col)
+    reps = dict(zip(reps[key_col], reps[string_col]))
+    results = func(list(reps.values()))
+    return {key: results[word] for key, word in reps.items()
+            if word in results}
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on host parameters in a single statement is 999
+SQL_CHUNK = 500
+
+
+def cache_key(org_string):
+    """
+    Normalise an org_string for use as a cache key: case-folded, with
+    leading/trailing and repeated whitespace removed
+
+    :param org_string: organisation name
+    :return: normalised string
+    """
+    return ' '.join(str(org_string).casefold().split())
+
+
+def file_identity(path):
+    """
+    Content hash of a file, used to tie cached results to the exact model
+    that produced them
+
+    :param path: path to the file (e.g. model.pkl.gz)
+    :return: sha1 hex digest, or '' if the file does not exist
+    """
+    if not os.path.exists(path):
+        return ''
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class ClassificationCache:
+    """
+    Disk-backed (SQLite) cache of org_string -> org_type classifications.
+
+    Entries are keyed by the normalised org_string. The identity of the
+    model file is stored alongside them and the cache is emptied whenever
+    the model changes. Once max_entries is exceeded the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, db_path, model_path, max_entries=1000000):
+        """
+        :param db_path: location of the SQLite cache file
+        :param model_path: model file the classifier is serving
+            (e.g. orgtype-classifier/model.pkl.gz)
+        :param max_entries: maximum number of cached classifications
+        """
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # May be used from a pipeline stage thread; one thread at a time
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.execute("CREATE TABLE IF NOT EXISTS meta "
+                         "(key TEXT PRIMARY KEY, value TEXT)")
+        self.con.execute("CREATE TABLE IF NOT EXISTS orgtype "
+                         "(key TEXT PRIMARY KEY, org_type TEXT, "
+                         "last_used REAL)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS orgtype_last_used "
+                         "ON orgtype (last_used)")
+        self._check_model(file_identity(model_path))
+        self.con.commit()
+
+    def _check_model(self, model_id):
+        row = self.con.execute("SELECT value FROM meta WHERE key = 'model'")\
+            .fetchone()
+        if row is None or row[0] != model_id:
+            if row is not None:
+                logger.info("Classifier model changed, clearing cache")
+            self.con.execute("DELETE FROM orgtype")
+            self.con.execute("INSERT OR REPLACE INTO meta VALUES "
+                             "('model', ?)", (model_id,))
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.con.execute("SELECT COUNT(*) FROM orgtype").fetchone()[0]
+
+    def get_many(self, org_strings):
+        """
+        Look up cached org_types
+
+        :param org_strings: iterable of organisation names
+        :return: dictionary of org_string: org_type for the cache hits only
+        """
+        org_strings = list(dict.fromkeys(org_strings))
+        keys = {}
+        for word in org_strings:
+            keys.setdefault(cache_key(word), []).append(word)
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), SQL_CHUNK):
+            chunk = key_list[i:i + SQL_CHUNK]
+            rows = self.con.execute(
+                "SELECT key, org_type FROM orgtype WHERE key IN ({})"
+                .format(','.join('?' * len(chunk))), chunk).fetchall()
+            for key, org_type in rows:
+                for word in keys[key]:
+                    found[word] = org_type
+        if found:
+            now = time.time()
+            hit_keys = [(now, cache_key(word)) for word in found]
+            self.con.executemany("UPDATE orgtype SET last_used = ? "
+                                 "WHERE key = ?", hit_keys)
+            self.con.commit()
+        self.hits += len(found)
+        self.misses += len(org_strings) - len(found)
+        return found
+
+    def put_many(self, orgtype_dict):
+        """
+        Store new classifications, evicting the least recently used entries
+        if the cache grows past max_entries
+
+        :param orgtype_dict: dictionary of org_string: org_type
+        """
+        now = time.time()
+        self.con.executemany("INSERT OR REPLACE INTO orgtype VALUES (?, ?, ?)",
+                             [(cache_key(word), org_type, now)
+                              for word, org_type in orgtype_dict.items()])
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self.con.execute("DELETE FROM orgtype WHERE key IN (SELECT key "
+                             "FROM orgtype ORDER BY last_used LIMIT ?)",
+                             (excess,))
+        self.con.commit()
+
+
+class ResponseCache:
+    """
+    Disk-backed (SQLite) cache of Companies House search responses.
+
+    The top_n raw result items of each search are stored against the
+    normalised query string. Searches that found nothing (404 or an empty
+    item list) are stored too, as negative results. Entries older than ttl
+    seconds are treated as misses. Safe to share between lookup threads.
+    """
+
+    def __init__(self, db_path, ttl=7 * 24 * 3600, top_n=5):
+        """
+        :param db_path: location of the SQLite cache file
+        :param ttl: time (seconds) for which a cached response is valid
+        :param top_n: number of result items kept per search
+        """
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.ttl = ttl
+        self.top_n = top_n
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+        self.con.execute("CREATE TABLE IF NOT EXISTS ch_search "
+                         "(key TEXT PRIMARY KEY, items TEXT, "
+                         "fetched REAL)")
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, query):
+        """
+        :param query: the org_string searched for
+        :return: list of cached result items ([] for a negative result),
+            or None on a miss or an expired entry
+        """
+        with self.lock:
+            row = self.con.execute("SELECT items, fetched FROM ch_search "
+                                   "WHERE key = ?",
+                                   (cache_key(query),)).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, query, items):
+        """
+        :param query: the org_string searched for
+        :param items: result items of the search ([] if nothing was found)
+        """
+        with self.lock:
+            self.con.execute("INSERT OR REPLACE INTO ch_search "
+                             "VALUES (?, ?, ?)",
+                             (cache_key(query),
+                              json.dumps(items[:self.top_n]), time.time()))
+            self.con.commit()
+
+    def expire(self):
+        """
+        Delete entries older than the ttl
+        """
+        with self.lock:
+            self.con.execute("DELETE FROM ch_search WHERE fetched < ?",
+                             (time.time() - self.ttl,))
+            self.con.commit()
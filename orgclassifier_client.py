@@ -0,0 +1,233 @@
+import gzip
+import json
+import logging
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+# orgtype_classifier API accepts 50 strings max per GET request
+MAX_BATCH_SIZE = 50
+# Default batch for POST /predict (classifier_server.py), which takes a JSON
+# body rather than a query string
+POST_BATCH_SIZE = 5000
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class OrgClassifierClient:
+    """
+    HTTP client for the orgtype-classifier API.
+
+    A single pooled requests.Session is shared by all workers so that
+    connections are kept alive between batches. org_strings are split into
+    batches of at most batch_size names and up to max_workers batches are
+    in flight at once, so throughput depends on the concurrency setting and
+    not on the size of the input file.
+
+    With method='post' batches are sent as gzipped JSON bodies to the
+    POST /predict endpoint of classifier_server.py, which has no URL length
+    limit, so batches can hold thousands of names.
+    """
+
+    def __init__(self, base_url='http://localhost:8080', batch_size=None,
+                 max_workers=4, max_retries=3, backoff=0.5, timeout=30,
+                 metrics=None, method='get'):
+        """
+        :param base_url: root url of the orgtype-classifier server
+        :param batch_size: max number of org_strings sent per request
+            (default: MAX_BATCH_SIZE for get, POST_BATCH_SIZE for post)
+        :param max_workers: number of batches requested concurrently
+        :param max_retries: attempts per batch after the first one fails
+        :param backoff: base delay (seconds), doubled on every retry
+        :param timeout: per-request timeout (seconds)
+        :param metrics: optional metrics.RunMetrics recording request
+            latencies, throttled responses and retries
+        :param method: 'get' for the orgtype-classifier's server.py, or
+            'post' for the batch endpoint of classifier_server.py
+        """
+        if method not in ('get', 'post'):
+            raise ValueError("method must be 'get' or 'post'")
+        if batch_size is None:
+            batch_size = POST_BATCH_SIZE if method == 'post' \
+                else MAX_BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.metrics = metrics
+        self.method = method
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def batches(self, org_strings):
+        """
+        Split org_strings into lists of at most batch_size names
+
+        :param org_strings: iterable of organisation names
+        :return: list of lists
+        """
+        org_strings = list(org_strings)
+        return [org_strings[i:i + self.batch_size]
+                for i in range(0, len(org_strings), self.batch_size)]
+
+    def predict_batch(self, batch):
+        """
+        Request the org_type of a single batch, retrying with exponential
+        backoff on connection errors and throttled/server-error responses
+
+        :param batch: list of org_strings (at most batch_size long)
+        :return: dictionary of org_string: org_type
+        """
+        url = self.base_url + '/predict'
+        if self.method == 'post':
+            request = {'data': gzip.compress(json.dumps(batch).encode(),
+                                             compresslevel=1),
+                       'headers': {'Content-Type': 'application/json',
+                                   'Content-Encoding': 'gzip'}}
+        else:
+            # Passing a list of tuples lets requests url-encode each name,
+            # so '&' or '#' in an org_string can't break the query.
+            request = {'params': [('q', word) for word in batch]}
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.metrics is not None:
+                self.metrics.count('classifier_retries')
+            start = time.perf_counter()
+            try:
+                r = self.session.request(self.method, url,
+                                         timeout=self.timeout, **request)
+                if self.metrics is not None:
+                    self.metrics.observe('classifier',
+                                         time.perf_counter() - start)
+                    if r.status_code == 429:
+                        self.metrics.count('classifier_429')
+                if r.status_code not in RETRY_STATUSES:
+                    r.raise_for_status()
+                    if self.method == 'post':
+                        # Predictions come back in the order sent
+                        return dict(zip(batch, r.json()))
+                    return r.json()
+                logger.debug("Classifier returned %s, retrying",
+                             r.status_code)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.debug("Classifier request failed: %s", e)
+            if attempt < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise requests.HTTPError("orgtype-classifier failed after {} "
+                                 "attempts".format(self.max_retries + 1))
+
+    def classify(self, org_strings, progress=True):
+        """
+        Classify every unique org_string, running up to max_workers batches
+        concurrently
+
+        :param org_strings: iterable of organisation names
+        :param progress: show a tqdm progress bar
+        :return orgtype_dict: dictionary of org_string: org_type
+        """
+        unique_strings = list(dict.fromkeys(org_strings))
+        orgtype_dict = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.predict_batch, batch)
+                       for batch in self.batches(unique_strings)]
+            for future in tqdm(as_completed(futures), total=len(futures),
+                               disable=not progress):
+                orgtype_dict.update(future.result())
+        return orgtype_dict
+
+
+def wait_until_ready(base_url='http://localhost:8080', timeout=60,
+                     proc=None, interval=0.25):
+    """
+    Poll the orgtype-classifier server until it answers a prediction
+
+    :param base_url: root url of the orgtype-classifier server
+    :param timeout: seconds to wait before giving up
+    :param proc: the server's subprocess.Popen, checked for early exit
+    :param interval: seconds between probes
+    :raises RuntimeError: if the server exits or is not ready in time
+    """
+    url = base_url.rstrip('/') + '/predict'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError("orgtype-classifier exited with code {}"
+                               .format(proc.returncode))
+        try:
+            if requests.get(url, params={'q': 'test'}, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    raise RuntimeError("orgtype-classifier not ready after {}s"
+                       .format(timeout))
+
+
+class LocalClassifier:
+    """
+    In-process orgtype classifier.
+
+    Loads the orgtype-classifier model (model.pkl.gz) once and calls its
+    predict on whole arrays of org_strings, so no server or HTTP round
+    trips are needed. Has the same classify interface as
+    OrgClassifierClient.
+    """
+
+    def __init__(self, model_path='orgtype-classifier/model.pkl.gz',
+                 batch_size=10000):
+        """
+        :param model_path: gzipped pickle of the trained model
+        :param batch_size: number of org_strings passed to each predict call
+        """
+        with gzip.open(model_path, 'rb') as f:
+            self.model = pickle.load(f)
+        self.batch_size = batch_size
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def classify(self, org_strings, progress=True):
+        """
+        Classify every unique org_string
+
+        :param org_strings: iterable of organisation names
+        :param progress: show a tqdm progress bar
+        :return orgtype_dict: dictionary of org_string: org_type
+        """
+        unique_strings = np.array(list(dict.fromkeys(org_strings)),
+                                  dtype=object)
+        orgtype_dict = {}
+        for start in tqdm(range(0, len(unique_strings), self.batch_size),
+                          disable=not progress):
+            batch = unique_strings[start:start + self.batch_size]
+            org_types = self.model.predict(batch).tolist()
+            orgtype_dict.update(zip(batch, org_types))
+        return orgtype_dict
@@ -0,0 +1,138 @@
+import pandas as pd
+
+from normalise import canonical_name
+
+
+def key_table(table):
+    """
+    :param table: registry table name
+    :return: name of the side table holding its canonical name keys
+    """
+    return table + '_name_key'
+
+
+def ensure_name_index(con, table, name_col, batch_size=10000):
+    """
+    Bring the side table of canonical name keys (normalise.canonical_name)
+    of the registry up to date, with an index on the key. The registry
+    table itself is left untouched. On every run, keys are added for new
+    rows and rows whose name changed, and dropped for deleted rows, so
+    only the first run computes a key for every registry name.
+
+    :param con: sqlite3 connection to the registry database
+    :param table: registry table name
+    :param name_col: column of the table holding the organisation name
+    :param batch_size: keys computed and written at a time
+    """
+    keys = key_table(table)
+    con.execute("CREATE TABLE IF NOT EXISTS {} (rid INTEGER PRIMARY KEY, "
+                "name TEXT, name_key TEXT)".format(keys))
+    con.execute("CREATE INDEX IF NOT EXISTS {0}_key ON {0} (name_key)"
+                .format(keys))
+    con.execute("DELETE FROM {0} WHERE rid NOT IN (SELECT rowid FROM {1})"
+                .format(keys, table))
+    # Collected first, so the key table is not written while it is read
+    con.execute("DROP TABLE IF EXISTS temp.stale_names")
+    con.execute(
+        "CREATE TEMP TABLE stale_names AS SELECT r.rowid AS rid, "
+        "r.{0} AS name FROM {1} r LEFT JOIN {2} k ON k.rid = r.rowid "
+        "WHERE k.rid IS NULL OR k.name IS NOT r.{0}"
+        .format(name_col, table, keys))
+    stale = con.execute("SELECT count(*) FROM temp.stale_names").fetchone()[0]
+    if stale:
+        print("Updating {} name keys of {}...".format(stale, table))
+        cur = con.execute("SELECT rid, name FROM temp.stale_names")
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            con.cursor().executemany(
+                "INSERT OR REPLACE INTO {} VALUES (?, ?, ?)".format(keys),
+                [(rid, name, canonical_name(name)) for rid, name in rows])
+    con.execute("DROP TABLE temp.stale_names")
+    con.commit()
+
+
+def lookup_registry(con, org_strings, table, name_col, result_cols,
+                    result_names, batch_size=10000):
+    """
+    Match org_strings against the registry inside SQLite. The input names
+    are loaded into a temporary table with their canonical keys and
+    joined to the registry through its indexed key table (see
+    ensure_name_index), and the matches are streamed back in batches, so
+    memory and time depend on the size of the input rather than of the
+    registry.
+
+    :param con: sqlite3 connection to the registry database
+    :param org_strings: iterable of organisation names
+    :param table: registry table name
+    :param name_col: column of the table holding the organisation name
+    :param result_cols: registry columns to return for each match
+    :param result_names: names to give those columns in the result
+    :param batch_size: rows fetched from SQLite at a time
+    :return: dataframe with org_string followed by result_names
+    """
+    ensure_name_index(con, table, name_col)
+    con.execute("DROP TABLE IF EXISTS temp.input_orgs")
+    con.execute("CREATE TEMP TABLE input_orgs (org_string TEXT PRIMARY KEY, "
+                "name_key TEXT)")
+    con.executemany("INSERT OR IGNORE INTO input_orgs VALUES (?, ?)",
+                    ((str(word), canonical_name(word))
+                     for word in org_strings))
+
+    cur = con.execute(
+        "SELECT i.org_string, {} FROM input_orgs i JOIN {} k "
+        "ON k.name_key = i.name_key JOIN {} r ON r.rowid = k.rid "
+        "WHERE i.name_key != ''"
+        .format(', '.join('r.' + col for col in result_cols),
+                key_table(table), table))
+    columns = ['org_string'] + list(result_names)
+    batches = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        batches.append(pd.DataFrame.from_records(rows, columns=columns))
+    con.execute("DROP TABLE temp.input_orgs")
+    if not batches:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(batches, ignore_index=True)
+
+
+def registry_names(con, table, name_col):
+    """
+    :param con: sqlite3 connection to the registry database
+    :param table: registry table name
+    :param name_col: column of the table holding the organisation name
+    :return: list of the distinct registry names, e.g. to build a
+        fuzzy_index.FuzzyIndex
+    """
+    return [row[0] for row in con.execute(
+        "SELECT DISTINCT {0} FROM {1} WHERE {0} IS NOT NULL"
+        .format(name_col, table))]
+
+
+def fuzzy_lookup_registry(con, org_strings, index, table, name_col,
+                          result_cols, result_names, min_score=0.9):
+    """
+    Match org_strings to their most similar registry name with a FuzzyIndex
+    and return the registry details of those names, in the same form as
+    lookup_registry
+
+    :param con: sqlite3 connection to the registry database
+    :param org_strings: iterable of organisation names
+    :param index: FuzzyIndex built over registry_names()
+    :param table: registry table name
+    :param name_col: column of the table holding the organisation name
+    :param result_cols: registry columns to return for each match
+    :param result_names: names to give those columns in the result
+    :param min_score: lowest similarity accepted as a match
+    :return: dataframe with org_string followed by result_names
+    """
+    matches = index.best_matches(org_strings, min_score)
+    found = lookup_registry(con, set(matches.values()), table, name_col,
+                            result_cols, result_names)
+    found = found.rename(columns={'org_string': 'candidate'})
+    matches = pd.DataFrame(list(matches.items()),
+                           columns=['org_string', 'candidate'])
+    return matches.merge(found, on='candidate').drop(columns='candidate')
@@ -0,0 +1,214 @@
+"""
+Indexed SQLite store of the final matching results, so downstream users
+can ask which cluster and company number an organisation belongs to
+without scanning the output csv files.
+
+    with ResultsStore('Data_Projects/sample_orgs_results.db') as store:
+        store.lookup('Acme Limited')          # rows for the name
+        store.cluster_of('Acme Limited')      # every row in its cluster(s)
+        store.company('01234567')             # rows matched to a company
+        store.confidence_band(0.5, 0.9, company_or_not='Company')
+
+Queries return pandas dataframes and use the indexes on the canonical
+name (normalise.canonical_name), 'Cluster ID', company number,
+company_or_not and 'Confidence Score', so they take milliseconds
+whatever the size of the store. company_or_not holds the values written
+by the UK pipeline ('Company' or 'Not A Company'); the ITA output has no
+such column.
+"""
+import os
+import sqlite3
+
+import pandas as pd
+
+from normalise import add_org_key, canonical_name
+
+TABLE = 'results'
+
+
+def quote(name):
+    """
+    :param name: column name, possibly with spaces (e.g. 'Cluster ID')
+    :return: the name quoted as an SQLite identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _text(value):
+    # Company numbers as text, without the '.0' of ids read back as floats
+    if pd.isnull(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class ResultsStore:
+    """
+    SQLite file holding one table of results rows. The name and company
+    number columns are recorded when the store is written, so the same
+    queries work on the UK ('obtained_id') and ITA ('obtd_id') outputs.
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: location of the SQLite file
+        """
+        self.db_path = db_path
+        self.con = None
+        self.meta = {}
+        self.columns = []
+        if os.path.exists(db_path):
+            self._connect()
+
+    def _connect(self):
+        self.con = sqlite3.connect(self.db_path)
+        self.meta = dict(self.con.execute("SELECT key, value FROM meta"))
+        self.columns = [row[1] for row in self.con.execute(
+            "PRAGMA table_info({})".format(TABLE))]
+
+    def write(self, df, name_col='org_string', company_col='obtained_id',
+              accepted=None, chunksize=10000):
+        """
+        Replace the contents of the store with the rows of df. The store
+        is built in a temporary file which then replaces the old one, so
+        readers never see it half written.
+
+        :param df: final dataframe, with 'Cluster ID' and
+            'Confidence Score' columns
+        :param name_col: column holding the organisation name
+        :param company_col: column holding the matched company number
+        :param accepted: optional boolean array, True for rows that
+            passed the confidence criteria
+        :param chunksize: rows inserted at a time
+        """
+        df = add_org_key(df.copy(), name_col)
+        # Categoricals and mixed-type ids are stored as plain text
+        for col in df.columns:
+            if df[col].dtype.name == 'category':
+                df[col] = df[col].astype(object)
+        if company_col in df.columns:
+            df[company_col] = df[company_col].map(_text)
+        if accepted is not None:
+            df['accepted'] = pd.Series(accepted, index=df.index).astype(int)
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        tmp_path = self.db_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        con = sqlite3.connect(tmp_path)
+        try:
+            df.to_sql(TABLE, con, index=False, chunksize=chunksize)
+            con.execute("CREATE TABLE meta "
+                        "(key TEXT PRIMARY KEY, value TEXT)")
+            con.executemany("INSERT INTO meta VALUES (?, ?)",
+                            [('name_col', name_col),
+                             ('company_col', company_col)])
+            indexes = [('org_key',), ('Cluster ID',), (name_col,),
+                       ('Confidence Score',), (company_col,),
+                       ('company_or_not', 'Confidence Score')]
+            for i, cols in enumerate(indexes):
+                if all(col in df.columns for col in cols):
+                    con.execute("CREATE INDEX {}_{} ON {} ({})".format(
+                        TABLE, i, TABLE, ', '.join(quote(col)
+                                                   for col in cols)))
+            con.execute("ANALYZE")
+            con.commit()
+        finally:
+            con.close()
+        self.close()
+        os.replace(tmp_path, self.db_path)
+        self._connect()
+        print("\nResults store saved to : {} ({} rows)"
+              .format(self.db_path, len(df)))
+
+    def query(self, where='', params=(), order_by=None, descending=False,
+              limit=None):
+        """
+        :param where: SQL condition on the results table ('' for all rows)
+        :param params: parameters of the condition
+        :param order_by: column to sort by
+        :param descending: sort in descending order
+        :param limit: maximum number of rows
+        :return: dataframe of the matching rows
+        """
+        if self.con is None:
+            raise FileNotFoundError("No results store at " + self.db_path)
+        sql = "SELECT * FROM " + TABLE
+        if where:
+            sql += " WHERE " + where
+        if order_by:
+            sql += " ORDER BY " + quote(order_by)
+            if descending:
+                sql += " DESC"
+        if limit:
+            sql += " LIMIT {:d}".format(limit)
+        return pd.read_sql_query(sql, self.con, params=list(params))
+
+    def lookup(self, name):
+        """
+        :param name: organisation name, in any of the spellings sharing
+            its canonical key
+        :return: rows for the name
+        """
+        return self.query("org_key = ?", (canonical_name(name),))
+
+    def company(self, company_number):
+        """
+        :param company_number: company number (or registry id)
+        :return: rows matched to the company
+        """
+        return self.query(quote(self.meta['company_col']) + " = ?",
+                          (_text(company_number),))
+
+    def cluster(self, cluster_id):
+        """
+        :param cluster_id: 'Cluster ID' value
+        :return: rows of the cluster, most confident first
+        """
+        return self.query('"Cluster ID" = ?', (int(cluster_id),),
+                          order_by='Confidence Score', descending=True)
+
+    def cluster_of(self, name):
+        """
+        :param name: organisation name
+        :return: rows of every cluster the name belongs to
+        """
+        return self.query('"Cluster ID" IN (SELECT "Cluster ID" FROM {} '
+                          'WHERE org_key = ?)'.format(TABLE),
+                          (canonical_name(name),))
+
+    def confidence_band(self, low=0.0, high=1.0, company_or_not=None,
+                        limit=None):
+        """
+        :param low: lowest confidence score included
+        :param high: highest confidence score included
+        :param company_or_not: only rows with this company_or_not value
+            ('Company' or 'Not A Company')
+        :param limit: maximum number of rows
+        :return: rows with a confidence score in [low, high]
+        """
+        where = '"Confidence Score" BETWEEN ? AND ?'
+        params = [low, high]
+        if company_or_not is not None:
+            if self.con is not None and \
+                    'company_or_not' not in self.columns:
+                raise ValueError("The results store at {} has no "
+                                 "company_or_not column"
+                                 .format(self.db_path))
+            where += ' AND company_or_not = ?'
+            params.append(company_or_not)
+        return self.query(where, params, limit=limit)
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
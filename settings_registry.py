@@ -0,0 +1,202 @@
+"""
+Registry of dedupe learned settings, shared by the projects in
+Data_Projects/.
+
+Settings are filed under a key hashed from the variable definition (the
+compared fields and their types) and the kind of settings, so any data
+set compared on the same fields can start from settings learned on
+another, instead of labelling pairs and learning predicates again:
+
+    settings_registry/
+        <key>/
+            schema.json           variable definition and kind
+            v1/learned_settings
+            v1/training.json      training data the settings came from
+            v1/meta.json          version, fingerprints, source, time
+            v2/...
+
+Each newly learned settings file becomes a new version. Versions record a
+fingerprint of their training data; when a project has training data of
+its own, only settings learned from that same data are used.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+
+SETTINGS_NAME = 'learned_settings'
+TRAINING_NAME = 'training.json'
+META_NAME = 'meta.json'
+SCHEMA_NAME = 'schema.json'
+
+
+def fingerprint(path):
+    """
+    :param path: file path
+    :return: sha256 hex digest of the file's content, or None if there
+        is no such file
+    """
+    if not path or not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def schema_key(variables, kind='dedupe'):
+    """
+    :param variables: dedupe variable definition, a list of dicts with
+        'field' and 'type'
+    :param kind: what the settings are for, e.g. 'dedupe-1.9.3' or
+        'csvdedupe'; settings of different kinds never match
+    :return: 16 character hex key
+    """
+    payload = json.dumps({'kind': kind, 'variables': variables},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def open_registry(root):
+    """
+    :param root: registry folder, '' for none
+    :return: SettingsRegistry, or None if root is empty
+    """
+    return SettingsRegistry(root) if root else None
+
+
+class SettingsRegistry:
+    """
+    Versioned store of learned settings keyed by schema_key
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def schema_dir(self, variables, kind='dedupe'):
+        return os.path.join(self.root, schema_key(variables, kind))
+
+    def versions(self, variables, kind='dedupe'):
+        """
+        :return: meta dicts of the registered versions, oldest first
+        """
+        schema_dir = self.schema_dir(variables, kind)
+        if not os.path.isdir(schema_dir):
+            return []
+        metas = []
+        for name in os.listdir(schema_dir):
+            meta_path = os.path.join(schema_dir, name, META_NAME)
+            if name.startswith('v') and os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    metas.append(json.load(f))
+        return sorted(metas, key=lambda meta: meta['version'])
+
+    def find(self, variables, kind='dedupe', training_file=None):
+        """
+        Newest registered settings usable with the given training data
+
+        :param variables: dedupe variable definition
+        :param kind: see schema_key
+        :param training_file: the project's training data; if it exists
+            only settings learned from identical data are returned
+        :return: path of the version's folder, or None
+        """
+        training = fingerprint(training_file)
+        for meta in reversed(self.versions(variables, kind)):
+            if training is None or meta['training_fingerprint'] == training:
+                return os.path.join(self.schema_dir(variables, kind),
+                                    'v{}'.format(meta['version']))
+        return None
+
+    def checkout(self, variables, settings_file, training_file=None,
+                 kind='dedupe'):
+        """
+        Copy matching registered settings to settings_file, and their
+        training data to training_file if it does not exist, unless the
+        project already has learned settings of its own
+
+        :param variables: dedupe variable definition
+        :param settings_file: the project's learned settings file
+        :param training_file: the project's training data file
+        :param kind: see schema_key
+        :return: True if settings were copied
+        """
+        if os.path.exists(settings_file):
+            return False
+        version_dir = self.find(variables, kind, training_file)
+        if version_dir is None:
+            return False
+        print("Using registered learned settings " + version_dir)
+        shutil.copyfile(os.path.join(version_dir, SETTINGS_NAME),
+                        settings_file)
+        registered_training = os.path.join(version_dir, TRAINING_NAME)
+        if training_file and not os.path.exists(training_file) and \
+                os.path.exists(registered_training):
+            shutil.copyfile(registered_training, training_file)
+        return True
+
+    def publish(self, variables, settings_file, training_file=None,
+                kind='dedupe', source=None):
+        """
+        Register learned settings as a new version, unless identical
+        settings are registered already
+
+        :param variables: dedupe variable definition
+        :param settings_file: learned settings file
+        :param training_file: training data the settings were learned from
+        :param kind: see schema_key
+        :param source: where the settings came from, e.g. the project folder
+        :return: version number of the settings, or None if settings_file
+            does not exist
+        """
+        settings = fingerprint(settings_file)
+        if settings is None:
+            return None
+        versions = self.versions(variables, kind)
+        for meta in versions:
+            if meta['settings_fingerprint'] == settings:
+                return meta['version']
+
+        schema_dir = self.schema_dir(variables, kind)
+        os.makedirs(schema_dir, exist_ok=True)
+        schema_path = os.path.join(schema_dir, SCHEMA_NAME)
+        if not os.path.exists(schema_path):
+            with open(schema_path, 'w') as f:
+                json.dump({'kind': kind, 'variables': variables}, f,
+                          indent=2)
+
+        # Filled in under a temporary name and renamed into place, so
+        # readers never see a partial version and concurrent publishers
+        # take different version numbers
+        tmp_dir = os.path.join(schema_dir, '.tmp-{}'.format(os.getpid()))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        shutil.copyfile(settings_file, os.path.join(tmp_dir, SETTINGS_NAME))
+        training = fingerprint(training_file)
+        if training is not None:
+            shutil.copyfile(training_file,
+                            os.path.join(tmp_dir, TRAINING_NAME))
+        version = versions[-1]['version'] + 1 if versions else 1
+        while True:
+            meta = {'version': version,
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'fields': [var['field'] for var in variables],
+                    'settings_fingerprint': settings,
+                    'training_fingerprint': training,
+                    'source': source}
+            with open(os.path.join(tmp_dir, META_NAME), 'w') as f:
+                json.dump(meta, f, indent=2)
+            version_dir = os.path.join(schema_dir, 'v{}'.format(version))
+            try:
+                os.rename(tmp_dir, version_dir)
+            except OSError:
+                if not os.path.exists(version_dir):
+                    raise
+                version += 1
+                continue
+            print("Registered learned settings as version {} of {}"
+                  .format(version, schema_dir))
+            return version
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+from ch_lookup import CompaniesHouseLookup, TokenBucket
+from orgclassifier_client import OrgClassifierClient
+from stub_servers import (StubSearch, classifier_server,
+                          companies_house_server, predict_org_type)
+from synthetic import generate_orgs
+
+
+# ---------------------------------TESTS--------------------------
+def test_generate_orgs_is_reproducible():
+    orgs, registry = generate_orgs(2000, dup_rate=0.3, seed=1)
+    again, _ = generate_orgs(2000, dup_rate=0.3, seed=1)
+    assert len(orgs) == 2000
+    assert orgs.equals(again)
+    assert orgs['entity_id'].nunique() == 1400
+    assert set(registry['entity_id']) <= set(orgs['entity_id'])
+
+
+def test_stub_servers_survive_throttling():
+    orgs, registry = generate_orgs(200, seed=2)
+    names = list(registry['name'][:20])
+    with classifier_server(throttle_rate=0.2) as server, \
+            OrgClassifierClient(server.url, batch_size=5,
+                                max_retries=6, backoff=0.01) as client:
+        types = client.classify(names, progress=False)
+    assert types == {name: predict_org_type(name) for name in names}
+
+    with companies_house_server(registry, throttle_rate=0.3) as server:
+        engine = CompaniesHouseLookup(StubSearch(server.url),
+                                      bucket=TokenBucket(1000, 1000),
+                                      backoff=0.01)
+        found = engine.lookup_many(names, progress=False)
+    assert server.throttled > 0
+    assert [found[name][0] for name in names] == \
+        list(registry['company_number'][:20])
@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from org_cache import ClassificationCache, ResponseCache
+
+
+# ---------------------------------TESTS--------------------------
+def test_classification_cache_hits(tmp_path):
+    model = tmp_path / 'model.pkl.gz'
+    model.write_bytes(b'v1')
+    with ClassificationCache(str(tmp_path / 'c.db'), str(model)) as cache:
+        cache.put_many({'Acme Ltd': 'Private Limited Company'})
+        found = cache.get_many(['ACME  LTD', 'Other Org'])
+    assert found == {'ACME  LTD': 'Private Limited Company'}
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_classification_cache_invalidated_by_model(tmp_path):
+    model = tmp_path / 'model.pkl.gz'
+    model.write_bytes(b'v1')
+    with ClassificationCache(str(tmp_path / 'c.db'), str(model)) as cache:
+        cache.put_many({'Acme Ltd': 'Private Limited Company'})
+    model.write_bytes(b'v2')
+    with ClassificationCache(str(tmp_path / 'c.db'), str(model)) as cache:
+        assert cache.get_many(['Acme Ltd']) == {}
+
+
+def test_classification_cache_eviction(tmp_path):
+    with ClassificationCache(str(tmp_path / 'c.db'), '', max_entries=2) \
+            as cache:
+        for word in ['a', 'b', 'c']:
+            cache.put_many({word: 'School'})
+        assert len(cache) == 2
+
+
+def test_response_cache_ttl(tmp_path):
+    with ResponseCache(str(tmp_path / 'ch.db'), ttl=60, top_n=1) as cache:
+        cache.put('Acme Ltd', [{'company_number': '1'},
+                               {'company_number': '2'}])
+        cache.put('Nobody', [])
+        assert cache.get('acme ltd') == [{'company_number': '1'}]
+        assert cache.get('Nobody') == []
+        assert cache.get('Unseen') is None
+        cache.ttl = -1
+        assert cache.get('acme ltd') is None
+    assert cache.hits == 2 and cache.misses == 2
@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from ch_bulk_index import BulkIndex, build_fuzzy_index, build_index
+
+
+def bulk_csv(tmp_path):
+    # Header spaces as in the real bulk file
+    rows = [('ACME LTD', '00000001', 'Dissolved', '01/02/1990'),
+            ('ACME LTD', '00000002', 'Active', '03/04/2001'),
+            ('ACME LTD', '00000003', 'Active', '05/06/1995'),
+            ('BETA & SONS PLC', '00000004', 'Active', '07/08/2010'),
+            ('GAMMA HOLDINGS LIMITED', '00000005', 'Active', '09/10/2015')]
+    df = pd.DataFrame(rows, columns=['CompanyName', ' CompanyNumber',
+                                     'CompanyStatus', 'IncorporationDate'])
+    df['RegAddress.AddressLine1'] = '1 High Street'
+    df['RegAddress.AddressLine2'] = None
+    df['RegAddress.PostTown'] = 'London'
+    df['RegAddress.County'] = None
+    df['RegAddress.PostCode'] = 'AB1 2CD'
+    path = tmp_path / 'BasicCompanyData.csv'
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+# ---------------------------------TESTS--------------------------
+def test_build_and_lookup_by_canonical_name(tmp_path):
+    db_path = str(tmp_path / 'ch_index.db')
+    assert build_index(bulk_csv(tmp_path), db_path) == 5
+    with BulkIndex(db_path) as index:
+        found = index.lookup_many(['Acme Limited', 'acme ltd.',
+                                   'Beta and Sons plc.', 'Delta Ltd'])
+    # Active companies first, then the most recently incorporated
+    assert found['Acme Limited'] == ['00000002', '1 High Street, London, '
+                                     'AB1 2CD', '2001-04-03']
+    assert found['acme ltd.'] == found['Acme Limited']
+    assert found['Beta and Sons plc.'][0] == '00000004'
+    assert 'Delta Ltd' not in found
+
+
+def test_fuzzy_lookup(tmp_path):
+    db_path = str(tmp_path / 'ch_index.db')
+    build_index(bulk_csv(tmp_path), db_path)
+    fuzzy = build_fuzzy_index(db_path, str(tmp_path / 'fuzzy.pkl'))
+    with BulkIndex(db_path, fuzzy, min_score=0.6) as index:
+        found = index.lookup_many(['Gamma Holding Ltd', 'Zzzz Qqqq'])
+    assert found == {'Gamma Holding Ltd': ['00000005', '1 High Street, '
+                                           'London, AB1 2CD', '2015-10-09']}
@@ -0,0 +1,115 @@
+import bisect
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import ch_lookup
+from ch_lookup import (CH_QUOTA, CH_WINDOW, CompaniesHouseLookup,
+                       TokenBucket)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # A real sleep always lets some time pass
+        self.now += max(seconds, 1e-6)
+
+
+# ---------------------------------TESTS--------------------------
+def test_token_bucket_keeps_every_window_within_quota(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ch_lookup.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(ch_lookup.time, 'sleep', clock.sleep)
+    bucket = TokenBucket()
+    times = []
+    for _ in range(3 * CH_QUOTA):
+        bucket.acquire()
+        times.append(clock.now)
+    for i, start in enumerate(times):
+        in_window = bisect.bisect_left(times, start + CH_WINDOW) - i
+        assert in_window <= CH_QUOTA
+    # ...while still using most of the quota
+    assert times[-1] - times[0] < 3.2 * CH_WINDOW
+
+
+class StubResponse:
+    def __init__(self, status_code, headers=None, items=None):
+        self.status_code = status_code
+        self.reason = 'Stub'
+        self.headers = headers or {}
+        self.items = items
+
+    def json(self):
+        return {'items': self.items}
+
+
+class StubSearch:
+    """
+    Answers search_companies with the queued responses, then with a match
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def search_companies(self, word):
+        self.calls.append((word, ch_lookup.time.monotonic()))
+        if self.responses:
+            return self.responses.pop(0)
+        return StubResponse(200, items=[{'company_number': '01234567',
+                                         'address_snippet': '1 High St',
+                                         'date_of_creation': '2001-01-01'}])
+
+
+def fake_clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ch_lookup.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(ch_lookup.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_lookup_waits_for_retry_after_on_429(monkeypatch):
+    fake_clock(monkeypatch)
+    search = StubSearch([StubResponse(429, {'Retry-After': '30'})])
+    engine = CompaniesHouseLookup(search, max_workers=1)
+    assert engine.lookup('Acme Ltd') == ['01234567', '1 High St',
+                                         '2001-01-01']
+    assert engine.throttled == 1
+    assert len(search.calls) == 2
+    assert search.calls[1][1] - search.calls[0][1] >= 30
+
+
+def test_lookup_retries_server_errors(monkeypatch):
+    fake_clock(monkeypatch)
+    search = StubSearch([StubResponse(503), StubResponse(502)])
+    engine = CompaniesHouseLookup(search, max_workers=1, backoff=5)
+    assert engine.lookup('Acme Ltd')[0] == '01234567'
+    times = [t for _, t in search.calls]
+    # Exponential backoff: 5s, then 10s
+    assert times[1] - times[0] >= 5
+    assert times[2] - times[1] >= 10
+    assert engine.failed == set()
+
+
+def test_failing_names_are_tried_again_then_reported(monkeypatch):
+    fake_clock(monkeypatch)
+    search = StubSearch([StubResponse(500)] * 5)
+    engine = CompaniesHouseLookup(search, max_workers=1, max_retries=2,
+                                  backoff=1)
+    # Three attempts fail, then the second pass finds the name...
+    assert engine.lookup_many(['Acme Ltd'], progress=False) == {
+        'Acme Ltd': ['01234567', '1 High St', '2001-01-01']}
+    assert engine.failed == set()
+    # ...unless it keeps failing
+    search = StubSearch([StubResponse(500)] * 6)
+    engine = CompaniesHouseLookup(search, max_workers=1, max_retries=2,
+                                  backoff=1)
+    assert engine.lookup_many(['Acme Ltd'], progress=False) == {}
+    assert engine.failed == {'Acme Ltd'}
+    assert len(search.calls) == 6
@@ -0,0 +1,53 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from checkpoint import RunCheckpoint, file_stamp
+
+
+# ---------------------------------TESTS--------------------------
+def test_concurrent_stages(tmp_path):
+    data = tmp_path / 'orgs.csv'
+    data.write_text('org_string\nAcme Ltd\n')
+    checkpoint = RunCheckpoint(str(tmp_path / 'runs'), str(data), fmt='csv')
+    chunk = pd.DataFrame({'org_string': ['Acme Ltd']})
+
+    # The classification and lookup stages save chunks from their own
+    # threads, as in pipelined_chunks
+    def stage(name):
+        for i in range(200):
+            checkpoint.save_chunk(name, i, chunk)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        jobs = [executor.submit(stage, name)
+                for name in ('map_columns', 'get_org_id')]
+        for job in jobs:
+            job.result()
+
+    resumed = RunCheckpoint(str(tmp_path / 'runs'), str(data), resume=True,
+                            fmt='csv')
+    for name in ('map_columns', 'get_org_id'):
+        assert all(resumed.chunk_done(name, i) for i in range(200))
+    assert list(resumed.load_chunk('get_org_id', 199)['org_string']) == \
+        ['Acme Ltd']
+
+
+def test_settings_change_discards_chunks(tmp_path):
+    data = tmp_path / 'orgs.csv'
+    data.write_text('org_string\nAcme Ltd\n')
+    model = tmp_path / 'index.db'
+    model.write_bytes(b'v1')
+    chunk = pd.DataFrame({'org_string': ['Acme Ltd']})
+    checkpoint = RunCheckpoint(str(tmp_path / 'runs'), str(data),
+                               settings=file_stamp(str(model)), fmt='csv')
+    checkpoint.save_chunk('get_org_id', 0, chunk)
+
+    model.write_bytes(b'v2 rebuilt')
+    resumed = RunCheckpoint(str(tmp_path / 'runs'), str(data),
+                            settings=file_stamp(str(model)), resume=True,
+                            fmt='csv')
+    assert not resumed.chunk_done('get_org_id', 0)
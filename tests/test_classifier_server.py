@@ -0,0 +1,72 @@
+import gzip
+import pickle
+import socket
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from classifier_server import make_server
+from orgclassifier_client import OrgClassifierClient, wait_until_ready
+
+NAMES = ['Acme Ltd', 'Beacon Limited', 'St Mary School', 'Oak Primary School',
+         'Leeds City Council', 'Kent County Council', 'Red Cross Charity',
+         'Oxfam Charity']
+TYPES = ['Private Limited Company', 'Private Limited Company', 'School',
+         'School', 'Local Authority', 'Local Authority',
+         'Registered charity', 'Registered charity']
+
+
+@pytest.fixture
+def model():
+    return make_pipeline(TfidfVectorizer(analyzer='char_wb'),
+                         LogisticRegression()).fit(NAMES, TYPES)
+
+
+# ---------------------------------TESTS--------------------------
+def test_post_and_get_match_model(model):
+    server = make_server(model, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    queries = ['Z & Y Ltd', 'Hill School', 'Z & Y Ltd', 'Fife Council'] * 50
+    expected = dict(zip(queries, model.predict(queries).tolist()))
+    try:
+        with OrgClassifierClient(url, method='post', batch_size=75) as client:
+            assert client.classify(queries, progress=False) == expected
+        with OrgClassifierClient(url) as client:
+            assert client.classify(queries, progress=False) == expected
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_multi_worker_server(model, tmp_path):
+    model_path = tmp_path / 'model.pkl.gz'
+    with gzip.open(str(model_path), 'wb') as f:
+        pickle.dump(model, f)
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    url = 'http://127.0.0.1:{}'.format(port)
+    proc = subprocess.Popen([sys.executable,
+                             str(ROOT / 'classifier_server.py'),
+                             str(model_path), '--port', str(port),
+                             '--workers', '2'])
+    try:
+        wait_until_ready(url, timeout=30, proc=proc)
+        with OrgClassifierClient(url, method='post', batch_size=3,
+                                 max_workers=4) as client:
+            found = client.classify(NAMES, progress=False)
+        assert found == dict(zip(NAMES, model.predict(NAMES).tolist()))
+    finally:
+        proc.terminate()
+        assert proc.wait(timeout=10) == 0
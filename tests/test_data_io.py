@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from data_io import FORMATS, compact_frame, read_frame, write_frame
+
+
+def classified():
+    df = pd.DataFrame({'org_string': ['Acme Ltd', 'Beta Trust', 'Acme Ltd',
+                                      'Gamma Ltd'],
+                       'obtained_id': ['00012345', None, '00012345', None],
+                       'Confidence Score': [0.9, np.nan, 0.8, 1.0],
+                       'Cluster ID': [0, 1, 0, 2],
+                       'org_type': ['Private Limited Company',
+                                    'Registered charity',
+                                    'Private Limited Company', None]},
+                      index=[3, 5, 8, 13])
+    return compact_frame(df, ['org_type'])
+
+
+# ---------------------------------TESTS--------------------------
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_columnar_round_trip_keeps_dtypes_and_index(tmp_path, fmt):
+    df = classified()
+    path = write_frame(df, str(tmp_path / 'orgs_classified'), fmt)
+    assert path.endswith(FORMATS[fmt])
+    back = read_frame(path)
+    assert back['org_type'].dtype.name == 'category'
+    pd.testing.assert_frame_equal(back, df)
+
+
+def test_csv_round_trip(tmp_path):
+    df = classified()
+    path = write_frame(df, str(tmp_path / 'orgs_classified'))
+    assert path.endswith('.csv')
+    back = read_frame(path, index_col=0)
+    # csv has no dtypes, so categories come back as plain text
+    assert list(back.index) == [3, 5, 8, 13]
+    assert 'Unnamed: 0' not in back.columns
+    assert list(back['org_type'][:3]) == list(df['org_type'][:3].astype(str))
+    assert back['org_type'].isnull().tolist() == \
+        df['org_type'].isnull().tolist()
+    pd.testing.assert_frame_equal(back[['org_string', 'Confidence Score',
+                                        'Cluster ID']],
+                                  df[['org_string', 'Confidence Score',
+                                      'Cluster ID']])
+
+
+def test_compact_frame():
+    df = pd.DataFrame({'org_type': ['Company', 'Charity'] * 5,
+                       'org_string': ['Org {}'.format(i) for i in range(10)]})
+    df = compact_frame(df, ['org_type', 'org_string', 'missing'])
+    assert df['org_type'].dtype.name == 'category'
+    # Mostly distinct values are left alone
+    assert df['org_string'].dtype.name != 'category'
+    assert compact_frame(df, ['org_type'])['org_type'].dtype.name == \
+        'category'
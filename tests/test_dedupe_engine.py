@@ -0,0 +1,59 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip('dedupe')
+from dedupe_engine import (UnionFind, merge_shard_clusters, shard_records,
+                           to_records)
+
+
+def orgs():
+    return pd.DataFrame({'org_string': ['Acme Ltd', 'Acme Limited',
+                                        'Beta plc', 'Gamma Trust', None],
+                         'obtained_id': ['001', None, '002', '001', None]},
+                        index=[10, 11, 12, 13, 14])
+
+
+# ---------------------------------TESTS--------------------------
+def test_union_find():
+    uf = UnionFind()
+    uf.union(1, 2)
+    uf.union(3, 4)
+    assert uf.find(1) == uf.find(2)
+    assert uf.find(1) != uf.find(3)
+    uf.union(2, 4)
+    assert len({uf.find(x) for x in [1, 2, 3, 4]}) == 1
+    assert uf.find(5) == 5
+
+
+def test_shard_records():
+    df = orgs()
+    data_d = to_records(df, ['org_string', 'obtained_id'])
+    block_cols = [('org_string', 3), ('obtained_id', None)]
+    shards = shard_records(df, data_d, block_cols, 4)
+    # Every record with a blocking key is in a shard, and records sharing
+    # a key are in the same shard
+    assert set().union(*shards) == {10, 11, 12, 13}
+    for key_ids in [(10, 11), (10, 13)]:
+        assert any(set(key_ids) <= set(shard) for shard in shards)
+    assert all(shard[idx] is data_d[idx] for shard in shards
+               for idx in shard)
+    # The same records are sharded the same way on every run
+    assert shards == shard_records(df, data_d, block_cols, 4)
+
+
+def test_clusters_spanning_shards_are_merged():
+    # 11 is clustered with 10 in one shard and with 13 in another
+    shard_clusters = [[((10, 11), [0.9, 0.8]), ((20, 21), [0.7, 0.6])],
+                      [((11, 13), [0.95, 0.5])],
+                      []]
+    cluster_ids, confidences = merge_shard_clusters(shard_clusters)
+    assert cluster_ids[10] == cluster_ids[11] == cluster_ids[13]
+    assert cluster_ids[20] == cluster_ids[21] != cluster_ids[10]
+    assert sorted(set(cluster_ids.values())) == [0, 1]
+    # Records keep their highest score
+    assert confidences == {10: 0.9, 11: 0.95, 13: 0.5, 20: 0.7, 21: 0.6}
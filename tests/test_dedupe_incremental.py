@@ -0,0 +1,84 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip('dedupe')
+from dedupe_engine import dedupe_incremental
+
+FIELDS = ['org_string', 'postcode']
+
+
+class StubGazetteer:
+    """
+    Links a new record to a canonical record with the same org_string
+    """
+
+    def index(self, canonical_d):
+        self.canonical_d = canonical_d
+
+    def match(self, messy_d, threshold=0.5, n_matches=1):
+        for messy_id, record in messy_d.items():
+            yield [((messy_id, canonical_id), 0.8) for canonical_id, canon
+                   in self.canonical_d.items()
+                   if canon['org_string'] == record['org_string']][:1]
+
+
+class StubDeduper:
+    """
+    Clusters records with the same postcode
+    """
+
+    def threshold(self, data_d, recall_weight=1):
+        return 0.5
+
+    def match(self, data_d, threshold):
+        groups = {}
+        for record_id, record in data_d.items():
+            groups.setdefault(record['postcode'], []).append(record_id)
+        return [(tuple(ids), [0.7] * len(ids)) for ids in groups.values()
+                if len(ids) > 1]
+
+
+def clustered():
+    return pd.DataFrame({'org_string': ['Acme Ltd', 'Beta plc', 'Beta plc'],
+                         'postcode': ['AB1', 'CD2', 'CD3'],
+                         'Cluster ID': [0, 4, 4],
+                         'Confidence Score': [1.0, 0.9, 0.9]})
+
+
+def run(df):
+    return dedupe_incremental(df, FIELDS, 'learned_settings',
+                              'gazetteer_settings', gazetteer=StubGazetteer(),
+                              deduper=StubDeduper())
+
+
+# ---------------------------------TESTS--------------------------
+def test_linked_and_unlinked_rows():
+    new = pd.DataFrame({'org_string': ['ACME LTD', 'Gamma', 'Delta',
+                                       'Epsilon'],
+                        'postcode': ['XX1', 'EF4', 'EF4', 'GH5']})
+    df = run(pd.concat([clustered(), new], ignore_index=True))
+
+    # Existing clusters are kept, a matching new row joins its cluster
+    assert list(df['Cluster ID'][:4]) == [0, 4, 4, 0]
+    assert df.loc[3, 'Confidence Score'] == 0.8
+    # The others are clustered among themselves after the highest id
+    assert df.loc[4, 'Cluster ID'] == df.loc[5, 'Cluster ID']
+    assert set(df['Cluster ID'][4:]) == {5, 6}
+    assert pd.isnull(df.loc[6, 'Confidence Score'])
+
+
+def test_single_new_row():
+    new = pd.DataFrame({'org_string': ['Zeta'], 'postcode': ['ZZ9']})
+    df = run(pd.concat([clustered(), new], ignore_index=True))
+    assert df.loc[3, 'Cluster ID'] == 5
+    assert df['Cluster ID'].dtype.kind == 'i'
+
+
+def test_nothing_new():
+    df = clustered()
+    assert run(df.copy()).equals(df)
@@ -0,0 +1,45 @@
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fuzzy_index import FuzzyIndex
+
+WORDS = ['north', 'south', 'holdings', 'trading', 'services', 'property',
+         'group', 'consulting', 'london', 'care']
+
+
+def registry(n):
+    # Names sharing most of their trigrams, like a real registry after
+    # legal suffixes are folded
+    return ['{} {} {} {:05d} ltd'.format(WORDS[i % 10], WORDS[i // 10 % 10],
+                                         WORDS[i // 100 % 10], i)
+            for i in range(n)]
+
+
+# ---------------------------------TESTS--------------------------
+def test_sliced_query_matches_whole():
+    names = registry(3000)
+    queries = ['Holdings South North 00012 Limited', 'care group trading',
+               'zzzz']
+    whole = FuzzyIndex(names, part_size=len(names)).query(queries, k=3)
+    sliced = FuzzyIndex(names, part_size=128).query(queries, k=3,
+                                                     block_size=2)
+    # Equal scores may be ordered differently, the scores may not
+    assert list(sliced['org_string']) == list(whole['org_string'])
+    assert list(sliced['score'].round(5)) == list(whole['score'].round(5))
+    assert sliced.loc[0, 'candidate'] == 'holdings south north 00012 ltd'
+    assert 'zzzz' not in set(sliced['org_string'])
+
+
+def test_query_memory_bounded():
+    index = FuzzyIndex(registry(40000), part_size=5000)
+    queries = registry(40000)[::40]
+    tracemalloc.start()
+    index.query(queries, k=5, block_size=100)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Scoring all 1000 queries against all 40000 names at once would
+    # hold ~40M similarities (hundreds of MB)
+    assert peak < 100 * 1024 * 1024
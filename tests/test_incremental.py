@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from incremental import split_delta
+
+
+# ---------------------------------TESTS--------------------------
+def test_split_delta(tmp_path):
+    previous = pd.DataFrame({'org_string': ['Acme Ltd', 'Beta plc', 'Gamma'],
+                             'postcode': ['AB1', 'CD2', 'EF3'],
+                             'Cluster ID': [0, 1, 1]})
+    # Round trip through csv, as the earlier output would be read back
+    previous.to_csv(tmp_path / 'previous.csv')
+    previous = pd.read_csv(tmp_path / 'previous.csv', index_col=0)
+    df = pd.DataFrame({'org_string': ['Gamma', 'Beta plc', 'Delta',
+                                      'Acme Ltd'],
+                       'postcode': ['EF3', 'XX9', 'GH4', 'AB1']})
+
+    unchanged, delta = split_delta(df, previous, ['org_string', 'postcode'])
+
+    assert list(unchanged.index) == [0, 3]
+    assert list(unchanged['Cluster ID']) == [1, 0]
+    assert list(delta['org_string']) == ['Beta plc', 'Delta']
+    assert list(delta.index) == [1, 2]
+
+
+def test_split_delta_needs_columns():
+    with pytest.raises(ValueError):
+        split_delta(pd.DataFrame({'org_string': ['Acme']}),
+                    pd.DataFrame({'name': ['Acme']}), ['org_string'])
@@ -0,0 +1,79 @@
+import argparse
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip('dedupe')
+import DM_ITA_match_MASTER as ita
+
+RESULTS = [('ACME SRL', 'Via Roma 1', 'IT001', 'Acme S.r.l.', 'T1'),
+           ('Acme s.r.l.', 'Via Roma 1', 'IT002', 'Acme S.r.l.', None),
+           ('Acme S.R.L.', 'Via Roma 2', 'IT003', 'Acme S.r.l.', 'T3'),
+           ('Beta SpA', None, 'IT009', None, None),
+           ('Beta SpA', 'Via Po 9', 'IT008', 'Beta S.p.A.', 'T8')]
+
+
+def orgs():
+    return pd.DataFrame({'org_string': ['Acme Srl', 'Beta S.p.A.',
+                                        'Gamma', 'acme srl'],
+                         'address': ['Roma', 'Torino', 'Milano', 'Roma']},
+                        index=[7, 3, 5, 9])
+
+
+# ---------------------------------TESTS--------------------------
+def test_add_info_picks_one_result_per_key():
+    df = ita.add_info(RESULTS, orgs())
+    assert list(df.index) == [7, 3, 5, 9]
+    # Most fields filled in, then the lowest values
+    assert list(df['obtd_id'].astype(object).fillna('')) == \
+        ['IT001', 'IT008', '', 'IT001']
+    assert df.loc[7, 'obtained_address'] == 'Via Roma 1'
+    assert df.loc[3, 'obtd_tax_id'] == 'T8'
+    assert pd.isnull(df.loc[5, 'obtd_legal_name'])
+
+
+def test_add_info_ignores_result_order():
+    expected = ita.add_info(RESULTS, orgs())
+    for seed in range(5):
+        shuffled = pd.DataFrame.from_records(RESULTS,
+                                             columns=ita.RESULT_COLUMNS)
+        shuffled = shuffled.sample(frac=1, random_state=seed)
+        pd.testing.assert_frame_equal(ita.add_info(shuffled, orgs()),
+                                      expected)
+
+
+def test_assign_org_ids_to_clusters(tmp_path, monkeypatch):
+    monkeypatch.setattr(ita, 'in_arg', argparse.Namespace(
+        dir=str(tmp_path) + '/', intermediate_format='csv'), raising=False)
+    df = pd.DataFrame({
+        'Cluster ID': [0, 0, 0, 1, 1, 1, 2, 2, 3],
+        'Confidence Score': [0.95, 0.8, 0.6, 0.9, 0.9, 0.75, 0.99, 0.8,
+                             1.0],
+        'obtd_id': ['A', None, None, None, 'B2', 'B1', None, None, 'D']},
+        index=[10, 11, 12, 20, 21, 22, 30, 31, 40])
+    df, df_name = ita.assign_org_ids_to_clusters(df, 'orgs_ddup')
+    assert df_name == 'orgs_ddup_idexpanded.csv'
+    assert (tmp_path / df_name).exists()
+    ids = df.sort_index()['obtd_id'].fillna('')
+    # Cluster 0: 'A'; row 12 is below the 0.7 threshold
+    assert list(ids[[10, 11, 12]]) == ['A', 'A', '']
+    # Cluster 1: rows 20 and 21 tie on 0.9, and 21 is the only one of
+    # them with an id
+    assert list(ids[[20, 21, 22]]) == ['B2', 'B2', 'B2']
+    # Cluster 2 has no id to share
+    assert list(ids[[30, 31]]) == ['', '']
+    assert ids[40] == 'D'
+
+
+def test_assign_org_ids_tie_goes_to_first_row(tmp_path, monkeypatch):
+    monkeypatch.setattr(ita, 'in_arg', argparse.Namespace(
+        dir=str(tmp_path) + '/', intermediate_format='csv'), raising=False)
+    df = pd.DataFrame({'Cluster ID': [5, 5, 5],
+                       'Confidence Score': [0.8, 0.9, 0.9],
+                       'obtd_id': ['X', 'Y', 'Z']}, index=[1, 2, 3])
+    df, _ = ita.assign_org_ids_to_clusters(df, 'orgs_ddup')
+    assert list(df.sort_index()['obtd_id']) == ['Y', 'Y', 'Y']
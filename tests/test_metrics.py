@@ -0,0 +1,44 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from metrics import RunMetrics
+
+
+# ---------------------------------TESTS--------------------------
+def test_run_report(tmp_path):
+    metrics = RunMetrics()
+    for rows in (100, 50):
+        with metrics.stage('classify_org', rows):
+            pass
+    for seconds in (0.004, 0.02, 0.02, 3.0):
+        metrics.observe('companies_house', seconds)
+    metrics.count('companies_house_429', 2)
+    metrics.cache_stats('classifier', hits=3, misses=1)
+    metrics.write_json(str(tmp_path / 'report.json'))
+
+    report = json.loads((tmp_path / 'report.json').read_text())
+    assert report['stages']['classify_org']['rows'] == 150
+    assert report['stages']['classify_org']['calls'] == 2
+    assert report['requests']['companies_house']['count'] == 4
+    assert report['requests']['companies_house']['p50_seconds'] == 0.025
+    assert report['counters'] == {'companies_house_429': 2}
+    assert report['caches']['classifier']['hit_ratio'] == 0.75
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = RunMetrics()
+    metrics.observe('classifier', 0.02)
+    metrics.count('classifier_retries')
+    path = str(tmp_path / 'orgmatch.prom')
+    metrics.write_prometheus(path)
+
+    lines = (tmp_path / 'orgmatch.prom').read_text().splitlines()
+    assert 'orgmatch_request_seconds_bucket{service="classifier",le="0.01"} 0' \
+        in lines
+    assert 'orgmatch_request_seconds_bucket{service="classifier",le="+Inf"} 1' \
+        in lines
+    assert 'orgmatch_events_total{event="classifier_retries"} 1' in lines
+    assert not (tmp_path / 'orgmatch.prom.tmp').exists()
@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from normalise import canonical_name, add_org_key, per_key
+
+
+# ---------------------------------TESTS--------------------------
+def test_canonical_name_folds_variants():
+    variants = ['ACME LTD', 'Acme Limited', 'acme ltd.', '  Acme   Ltd ']
+    assert {canonical_name(name) for name in variants} == {'acme ltd'}
+
+
+def test_canonical_name_italian_suffix():
+    assert canonical_name('Rossi S.R.L.') == canonical_name(
+        'Rossi Società a Responsabilità Limitata') == 'rossi srl'
+
+
+def test_canonical_name_blank():
+    assert canonical_name(None) == canonical_name(float('nan')) == ''
+
+
+def test_per_key_calls_once_per_key():
+    df = add_org_key(pd.DataFrame({'org_string': ['ACME LTD', 'Acme Limited',
+                                                  "St Mary's School"]}))
+    sent = []
+
+    def lookup(org_strings):
+        sent.extend(org_strings)
+        return {word: len(word) for word in org_strings}
+
+    results = per_key(df, lookup)
+    assert sent == ['ACME LTD', "St Mary's School"]
+    assert df['org_key'].map(results).tolist() == [8, 8, 16]
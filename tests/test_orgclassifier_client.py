@@ -0,0 +1,153 @@
+import gzip
+import pickle
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from classifier_server import PredictHandler, make_server
+from orgclassifier_client import (LocalClassifier, OrgClassifierClient,
+                                  wait_until_ready)
+
+
+class StubModel:
+    """
+    Classifies names by keyword, recording the size of every predict call
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, org_strings):
+        self.calls.append(len(org_strings))
+        return StubArray(['School' if 'School' in name
+                          else 'Private Limited Company'
+                          for name in org_strings])
+
+
+class StubArray(list):
+    # Stands in for the numpy array a real model returns
+    def tolist(self):
+        return list(self)
+
+
+class FlakyHandler(PredictHandler):
+    """
+    Answers the first `failures` requests of the server with a 503
+    """
+
+    def do_GET(self):
+        if self.fail():
+            return self.send_json(503, {'error': 'unavailable'})
+        super().do_GET()
+
+    def do_POST(self):
+        if self.fail():
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            return self.send_json(503, {'error': 'unavailable'})
+        super().do_POST()
+
+    def fail(self):
+        with self.server.lock:
+            self.server.requests += 1
+            return self.server.requests <= self.server.failures
+
+
+@contextmanager
+def serving(model, failures=0):
+    server = make_server(model, port=0)
+    if failures:
+        server.RequestHandlerClass = FlakyHandler
+        server.lock = threading.Lock()
+        server.requests = 0
+        server.failures = failures
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, 'http://127.0.0.1:{}'.format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+NAMES = ['Org {} {}'.format(i, 'School' if i % 4 == 0 else 'Ltd')
+         for i in range(23)]
+EXPECTED = {name: 'School' if 'School' in name else 'Private Limited Company'
+            for name in NAMES}
+
+
+# ---------------------------------TESTS--------------------------
+@pytest.mark.parametrize('method', ['get', 'post'])
+def test_batches_larger_than_one_request(method):
+    model = StubModel()
+    with serving(model) as (server, url), \
+            OrgClassifierClient(url, batch_size=5, max_workers=3,
+                                method=method) as client:
+        assert client.classify(NAMES + NAMES[:4], progress=False) == EXPECTED
+    # Each unique name is sent once, in batches of at most 5
+    assert sorted(model.calls) == [3, 5, 5, 5, 5]
+
+
+@pytest.mark.parametrize('method', ['get', 'post'])
+def test_server_errors_are_retried(method):
+    with serving(StubModel(), failures=2) as (server, url), \
+            OrgClassifierClient(url, batch_size=50, max_retries=3,
+                                backoff=0.01, method=method) as client:
+        assert client.classify(NAMES, progress=False) == EXPECTED
+    assert server.requests == 3
+
+
+def test_gives_up_after_max_retries():
+    with serving(StubModel(), failures=10) as (server, url), \
+            OrgClassifierClient(url, max_retries=2, backoff=0.01) as client:
+        with pytest.raises(requests.HTTPError):
+            client.classify(NAMES[:3], progress=False)
+    assert server.requests == 3
+
+
+def test_local_classifier_matches_server(tmp_path):
+    model_path = str(tmp_path / 'model.pkl.gz')
+    with gzip.open(model_path, 'wb') as f:
+        pickle.dump(StubModel(), f)
+    with LocalClassifier(model_path, batch_size=7) as local:
+        found = local.classify(NAMES + NAMES[:4], progress=False)
+    with serving(StubModel()) as (server, url), \
+            OrgClassifierClient(url, batch_size=5) as client:
+        assert found == client.classify(NAMES, progress=False)
+    assert found == EXPECTED
+    assert local.model.calls == [7, 7, 7, 2]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_wait_until_ready_times_out():
+    url = 'http://127.0.0.1:{}'.format(free_port())
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='not ready'):
+        wait_until_ready(url, timeout=0.5, interval=0.1)
+    assert time.monotonic() - start < 5
+
+
+def test_wait_until_ready_stops_when_server_exits():
+    url = 'http://127.0.0.1:{}'.format(free_port())
+    proc = subprocess.Popen([sys.executable, '-c', 'import sys; sys.exit(3)'])
+    proc.wait()
+    with pytest.raises(RuntimeError, match='exited with code 3'):
+        wait_until_ready(url, timeout=30, proc=proc)
+
+
+def test_wait_until_ready_returns_when_serving():
+    with serving(StubModel()) as (server, url):
+        wait_until_ready(url, timeout=5)
@@ -0,0 +1,41 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from registry_sql import lookup_registry
+
+
+def lookup(con, names):
+    found = lookup_registry(con, names, 'registry', 'name',
+                            ['name', 'tax_id'], ['obtd_legal_name',
+                                                 'obtd_tax_id'])
+    return dict(zip(found['org_string'], found['obtd_tax_id']))
+
+
+# ---------------------------------TESTS--------------------------
+def test_lookup_registry_tracks_changes(tmp_path):
+    con = sqlite3.connect(str(tmp_path / 'registry.db'))
+    con.execute("CREATE TABLE registry (name TEXT, tax_id TEXT)")
+    con.executemany("INSERT INTO registry VALUES (?, ?)",
+                    [('Società Èlite S.r.l.', 'IT01'),
+                     ('ACME SPA', 'IT02')])
+    con.commit()
+
+    # Accents and legal forms fold as in normalise.canonical_name
+    assert lookup(con, ['societa elite srl', 'Acme S.p.A.', 'Other']) == \
+        {'societa elite srl': 'IT01', 'Acme S.p.A.': 'IT02'}
+    # The registry table itself is not altered
+    assert [row[1] for row in con.execute("PRAGMA table_info(registry)")] \
+        == ['name', 'tax_id']
+
+    # Rows added, renamed or deleted after the first run are picked up
+    con.execute("INSERT INTO registry VALUES ('Nuova Srl', 'IT03')")
+    con.execute("UPDATE registry SET name = 'Acme Due SpA' "
+                "WHERE tax_id = 'IT02'")
+    con.execute("DELETE FROM registry WHERE tax_id = 'IT01'")
+    con.commit()
+    assert lookup(con, ['NUOVA S.R.L.', 'acme due spa', 'Acme SpA',
+                        'societa elite srl']) == \
+        {'NUOVA S.R.L.': 'IT03', 'acme due spa': 'IT02'}
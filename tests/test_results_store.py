@@ -0,0 +1,47 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from results_store import ResultsStore
+
+
+# ---------------------------------TESTS--------------------------
+def test_results_store(tmp_path):
+    df = pd.DataFrame({
+        'org_string': ['Acme Ltd', 'ACME Limited', 'Beta plc', 'Gamma Trust'],
+        'obtained_id': ['01234567', '01234567', '07654321', None],
+        'company_or_not': pd.Categorical(['Company', 'Company', 'Company',
+                                          'Not A Company']),
+        'Cluster ID': [0, 0, 1, 2],
+        'Confidence Score': [0.95, 0.9, 0.6, None]})
+    path = str(tmp_path / 'results.db')
+    with ResultsStore(path) as store:
+        store.write(df, accepted=[True, True, False, False])
+
+    with ResultsStore(path) as store:
+        rows = store.lookup('acme limited.')
+        assert sorted(rows['org_string']) == ['ACME Limited', 'Acme Ltd']
+        assert list(store.cluster(0)['Confidence Score']) == [0.95, 0.9]
+        assert len(store.cluster_of('Acme Ltd')) == 2
+        assert list(store.company('01234567')['Cluster ID']) == [0, 0]
+        band = store.confidence_band(0.5, 0.92, company_or_not='Company')
+        assert sorted(band['org_string']) == ['ACME Limited', 'Beta plc']
+        assert list(store.lookup('Beta PLC')['accepted']) == [0]
+        # Rewriting replaces the contents
+        store.write(df.iloc[:1])
+        assert len(store.query()) == 1
+
+
+def test_results_store_without_company_or_not(tmp_path):
+    df = pd.DataFrame({'org_string': ['Acme srl'], 'obtd_id': [12345.0],
+                       'Cluster ID': [0], 'Confidence Score': [0.8]})
+    with ResultsStore(str(tmp_path / 'results.db')) as store:
+        store.write(df, company_col='obtd_id')
+        assert list(store.company(12345)['org_string']) == ['Acme srl']
+        assert len(store.confidence_band(0.5, 1.0)) == 1
+        with pytest.raises(ValueError):
+            store.confidence_band(0.5, 1.0, company_or_not='Company')
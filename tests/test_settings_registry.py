@@ -0,0 +1,58 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from settings_registry import SettingsRegistry, schema_key
+
+VARIABLES = [{'field': 'org_string', 'type': 'String', 'has missing': True},
+             {'field': 'address', 'type': 'String', 'has missing': True}]
+
+
+# ---------------------------------TESTS--------------------------
+def test_schema_key():
+    assert schema_key(VARIABLES) == schema_key([dict(var) for var
+                                                in VARIABLES])
+    assert schema_key(VARIABLES) != schema_key(VARIABLES[:1])
+    assert schema_key(VARIABLES) != schema_key(VARIABLES, 'csvdedupe')
+
+
+def test_publish_and_checkout(tmp_path):
+    registry = SettingsRegistry(str(tmp_path / 'registry'))
+    project_a = tmp_path / 'a'
+    project_a.mkdir()
+    (project_a / 'learned_settings').write_bytes(b'settings v1')
+    (project_a / 'training.json').write_text('{"match": []}')
+
+    assert registry.publish(VARIABLES, str(project_a / 'learned_settings'),
+                            str(project_a / 'training.json')) == 1
+    # Identical settings are not registered twice
+    assert registry.publish(VARIABLES, str(project_a / 'learned_settings'),
+                            str(project_a / 'training.json')) == 1
+
+    # A new project without settings or training data gets both
+    project_b = tmp_path / 'b'
+    project_b.mkdir()
+    assert registry.checkout(VARIABLES, str(project_b / 'learned_settings'),
+                             str(project_b / 'training.json'))
+    assert (project_b / 'learned_settings').read_bytes() == b'settings v1'
+    assert (project_b / 'training.json').read_text() == '{"match": []}'
+
+    # Different fields, or training data of its own, do not match
+    project_c = tmp_path / 'c'
+    project_c.mkdir()
+    assert not registry.checkout(VARIABLES[:1],
+                                 str(project_c / 'learned_settings'))
+    (project_c / 'training.json').write_text('{"match": [1]}')
+    assert not registry.checkout(VARIABLES,
+                                 str(project_c / 'learned_settings'),
+                                 str(project_c / 'training.json'))
+
+    (project_a / 'learned_settings').write_bytes(b'settings v2')
+    assert registry.publish(VARIABLES, str(project_a / 'learned_settings'),
+                            str(project_a / 'training.json'),
+                            source='a') == 2
+    versions = registry.versions(VARIABLES)
+    assert [meta['version'] for meta in versions] == [1, 2]
+    assert versions[1]['source'] == 'a'
+    assert versions[1]['fields'] == ['org_string', 'address']
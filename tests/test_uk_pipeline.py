@@ -0,0 +1,163 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip('dedupe')
+pytest.importorskip('chwrapper')
+import DM_UK_match_MASTER as uk
+
+
+def orgs():
+    return pd.DataFrame({'org_string': ['Acme Ltd', np.nan, 'Beta plc'],
+                         'postcode': ['AB1', 'CD2', 'EF3']})
+
+
+# ---------------------------------TESTS--------------------------
+
+
+def test_pre_processing_quits_on_blank_name():
+    with pytest.raises(SystemExit):
+        uk.pre_processing(orgs(), 'org_string', blank_rows='quit')
+
+
+def test_pre_processing_drops_blank_name():
+    df = uk.pre_processing(orgs(), 'org_string', blank_rows='drop')
+    assert list(df['org_string']) == ['Acme Ltd', 'Beta plc']
+    assert list(df.index) == [0, 2]
+    assert 'nan' not in set(df['org_string'])
+
+
+def parse_config(tmp_path, monkeypatch, values):
+    config_file = tmp_path / 'run.json'
+    config_file.write_text(json.dumps(values))
+    monkeypatch.setattr(sys, 'argv', ['DM_UK_match_MASTER.py',
+                                      '--config', str(config_file)])
+    return uk.get_input_args()
+
+
+def test_config_values_are_used(tmp_path, monkeypatch):
+    args = parse_config(tmp_path, monkeypatch,
+                        {'batch': True, 'dedupe': 'csvdedupe',
+                         'min_length': 4})
+    assert args.dedupe == 'csvdedupe'
+    assert args.min_length == 4
+    assert args.blank_rows == 'drop'
+
+
+def test_config_rejects_invalid_choice(tmp_path, monkeypatch):
+    with pytest.raises(SystemExit):
+        parse_config(tmp_path, monkeypatch, {'dedupe': 'native '})
+
+
+def test_config_rejects_unknown_argument(tmp_path, monkeypatch):
+    with pytest.raises(SystemExit):
+        parse_config(tmp_path, monkeypatch, {'chunk_size': 1000})
+
+
+def test_batch_csvdedupe_needs_learned_settings(tmp_path, monkeypatch):
+    started = []
+    monkeypatch.setattr(uk.subprocess, 'Popen',
+                        lambda *args, **kwargs: started.append(args))
+    with pytest.raises(SystemExit):
+        uk.deduplicate('orgs_classified.csv', 'org_string',
+                       'orgs_deduped.csv', str(tmp_path) + '/',
+                       interactive=False)
+    assert started == []
+
+
+class StubClassifier:
+    def classify(self, org_strings):
+        return {name: 'Private Limited Company' if 'Ltd' in name
+                else 'Registered charity' for name in org_strings}
+
+    def close(self):
+        pass
+
+
+class StubLookup:
+    def lookup_many(self, org_strings):
+        return {name: ('0' + str(len(name)), name + ' House', '2001-01-01')
+                for name in org_strings if 'Ltd' in name}
+
+
+def write_orgs(tmp_path):
+    pd.DataFrame({'org_string': ['Acme Ltd', 'Beta Trust', 'ACME LTD',
+                                 'Gamma Ltd', np.nan, 'Delta Trust',
+                                 'Beta Trust'],
+                  'postcode': ['AB1', 'CD2', 'AB1', 'EF3', 'GH4', 'IJ5',
+                               'CD2']}).to_csv(tmp_path / 'orgs.csv',
+                                               index=False)
+    return str(tmp_path) + '/'
+
+
+def test_streaming_matches_in_memory(tmp_path):
+    data_dir = write_orgs(tmp_path)
+    df, df_name = uk.load_df(data_dir, 'orgs.csv')
+    df = uk.pre_processing(df, 'org_string', 'drop')
+    df = uk.checkpointed_pipeline(df, StubClassifier(), engine=StubLookup(),
+                                  rows=len(df))
+    df.to_csv(tmp_path / 'in_memory.csv')
+
+    reader, df_name = uk.load_df_chunks(data_dir, 'orgs.csv', 3)
+    classd_name = uk.stream_pipeline(reader, data_dir, df_name,
+                                     StubClassifier(), engine=StubLookup(),
+                                     column='org_string', blank_rows='drop')
+
+    streamed = pd.read_csv(data_dir + classd_name, index_col=0)
+    assert len(streamed) == 6
+    pd.testing.assert_frame_equal(
+        streamed, pd.read_csv(tmp_path / 'in_memory.csv', index_col=0))
+
+
+def test_streaming_quits_on_blank_name_in_later_chunk(tmp_path):
+    data_dir = write_orgs(tmp_path)
+    reader, df_name = uk.load_df_chunks(data_dir, 'orgs.csv', 3)
+    with pytest.raises(SystemExit):
+        uk.stream_pipeline(reader, data_dir, df_name, StubClassifier(),
+                           engine=StubLookup(), column='org_string',
+                           blank_rows='quit')
+
+
+def test_data_columns_always_include_name_column():
+    assert uk.data_columns('') is None
+    assert uk.data_columns('postcode') == ['postcode', 'org_string']
+    assert uk.data_columns('postcode,name', 'name', 'ch_id') == \
+        ['postcode', 'name', 'ch_id']
+
+
+def test_selected_columns_and_categoricals_use_less_memory(tmp_path):
+    # A data file with free-text columns the pipeline never reads
+    n = 20000
+    pd.DataFrame({'org_string': ['Org {} {}'.format(i, 'Ltd' if i % 3
+                                                    else 'Trust')
+                                 for i in range(n)],
+                  'postcode': ['AB{} {}CD'.format(i % 90, i % 9)
+                               for i in range(n)],
+                  'notes': ['Supplier record {} entered by hand'.format(i)
+                            for i in range(n)],
+                  'description': ['Goods and services contract ' + str(i)
+                                  for i in range(n)],
+                  'contact': ['contact{}@example.com'.format(i)
+                              for i in range(n)]}
+                 ).to_csv(tmp_path / 'orgs.csv', index=False)
+    data_dir = str(tmp_path) + '/'
+
+    # All columns, with the classifier output held as plain strings
+    before, _ = uk.load_df(data_dir, 'orgs.csv')
+    classified = uk.map_columns(before.copy(), StubClassifier())
+    for col in uk.CLASSIFY_COLUMNS:
+        before[col] = classified[col].astype(object)
+
+    df, _ = uk.load_df(data_dir, 'orgs.csv',
+                       uk.data_columns('postcode'))
+    df = uk.map_columns(df, StubClassifier())
+    assert all(df[col].dtype.name == 'category'
+               for col in uk.CLASSIFY_COLUMNS)
+    assert df.memory_usage(deep=True).sum() * 3 <= \
+        before.memory_usage(deep=True).sum()